@@ -18,6 +18,63 @@ const genAI = new GoogleGenerativeAI(process.env.GEMINI_API_KEY);
 const ANALYSIS_MODEL = 'gemini-2.5-flash';
 const CHAT_MODEL = 'gemini-2.5-flash-lite';
 
+// ==================== LOCAL INFERENCE ====================
+// Optional first pass through the TFLite service (models/src/inference_service.py).
+// Confident local diagnoses are returned in milliseconds; Gemini stays the slow path for
+// low-confidence results, service errors, or when the client sends ?deep=true.
+const LOCAL_INFERENCE_URL = process.env.LOCAL_INFERENCE_URL;
+const LOCAL_CONFIDENCE_THRESHOLD = parseFloat(process.env.LOCAL_CONFIDENCE_THRESHOLD || '0.8');
+const LOCAL_TIMEOUT_MS = parseInt(process.env.LOCAL_TIMEOUT_MS || '2000', 10);
+// Run the leaf-check gate before the disease model and reject uploads that are not leaves
+const LOCAL_LEAF_GATE = process.env.LOCAL_LEAF_GATE === 'true';
+// Small -> large model cascade with calibrated thresholds (models/src/confidence_cascade.py);
+// its `escalate` flag replaces LOCAL_CONFIDENCE_THRESHOLD as the Gemini fallback trigger
+const LOCAL_ADAPTIVE = process.env.LOCAL_ADAPTIVE === 'true';
+
+async function localDiagnosis(file) {
+    try {
+        const endpoint = LOCAL_ADAPTIVE ? 'adaptive' : LOCAL_LEAF_GATE ? 'cascade' : 'disease_detection';
+        // With both flags the adaptive cascade runs behind the leaf gate
+        const leafGate = LOCAL_ADAPTIVE && LOCAL_LEAF_GATE ? '&leaf_gate=true' : '';
+        const response = await fetch(`${LOCAL_INFERENCE_URL}/predict/${endpoint}?top_k=3${leafGate}`, {
+            method: 'POST',
+            headers: { 'Content-Type': file.mimetype || 'application/octet-stream' },
+            body: file.buffer,
+            signal: AbortSignal.timeout(LOCAL_TIMEOUT_MS)
+        });
+        // 422 = failed the service's image quality gate; the body carries the failed checks
+        if (!response.ok && response.status !== 422) throw new Error(`HTTP ${response.status}`);
+        return await response.json();
+    } catch (error) {
+        console.error('⚠️ Local inference unavailable:', error.message);
+        return null;
+    }
+}
+
+// Shape a local prediction like the Gemini analysis the app already renders
+function localToAnalysis(local) {
+    const top = local.predictions[0];
+    const [plant, ...rest] = top.label.split('___');
+    const isHealthy = /healthy/i.test(top.label);
+    const info = top.info || {};
+    return {
+        plantType: plant.replace(/_/g, ' '),
+        isHealthy,
+        confidence: Math.round(top.confidence * 100),
+        disease: isHealthy ? null : {
+            name: (rest.join(' ') || top.label).replace(/_/g, ' '),
+            severity: 'Unknown',
+            symptoms: info.symptoms ? [info.symptoms] : [],
+            reasoning: info.cause || '',
+            treatment_steps: [info.organic_treatment, info.chemical_treatment].filter(Boolean),
+            prevention_steps: [],
+            expert_insights: []
+        },
+        summary: `${top.label.replace(/_+/g, ' ')} (${Math.round(top.confidence * 100)}% confidence, on-device model)`,
+        alternatives: local.predictions.slice(1).map(p => ({ label: p.label, confidence: p.confidence }))
+    };
+}
+
 // ==================== ROUTES ====================
 
 // Logging Middleware
@@ -37,6 +94,30 @@ app.get('/', (req, res) => {
 });
 
 // ==================== IMAGE ANALYSIS ====================
+// Save a scan to Supabase
+async function saveScan(file, resultText, analysisData) {
+    const { data: scan, error } = await supabase
+        .from('scan_results')
+        .insert([{
+            image_name: file.originalname || 'captured',
+            image_size: file.size,
+            mime_type: file.mimetype,
+            analysis_result: resultText,
+            plant_type: analysisData.plantType,
+            disease_name: analysisData.disease?.name,
+            severity: analysisData.disease?.severity || 'Unknown',
+            is_healthy: analysisData.isHealthy
+        }])
+        .select()
+        .single();
+
+    if (error) {
+        console.error('Database error:', error);
+        // Still return analysis even if DB save fails
+    }
+    return scan;
+}
+
 app.post('/analyze', upload.single('image'), async (req, res) => {
     try {
         if (!req.file) {
@@ -44,6 +125,33 @@ app.post('/analyze', upload.single('image'), async (req, res) => {
         }
 
         console.log('📸 Analyzing image...', req.file.size, 'bytes');
+        const deep = req.query.deep === 'true' || req.body?.deep === 'true';
+        let local = LOCAL_INFERENCE_URL ? await localDiagnosis(req.file) : null;
+        if (local?.quality?.verdict === 'reject' && !local.predictions) {
+            if (!deep) {
+                return res.status(422).json({
+                    error: 'Image quality too low',
+                    details: `Retake the photo (${local.quality.reasons.join(', ')})`,
+                    quality: local.quality,
+                    source: 'local'
+                });
+            }
+            local = null;
+        }
+        if (local?.stopped_at === 'leaf_check' && !deep) {
+            return res.status(422).json({ error: 'No leaf detected', details: local.reason, source: 'local' });
+        }
+        const confident = local && (local.escalate !== undefined
+            ? !local.escalate
+            : local.predictions[0]?.confidence >= LOCAL_CONFIDENCE_THRESHOLD);
+        if (confident && !deep) {
+            console.log(`⚡ Local diagnosis in ${local.latency_ms.toFixed(1)} ms`);
+            const analysisData = localToAnalysis(local);
+            const resultText = JSON.stringify(analysisData);
+            const scan = await saveScan(req.file, resultText, analysisData);
+            return res.json({ result: resultText, analysis: analysisData, scanId: scan?.id, source: 'local' });
+        }
+
         const base64Image = req.file.buffer.toString('base64');
 
         const contents = [
@@ -82,31 +190,14 @@ If healthy, set disease to null.` }
             analysisData = { raw: resultText };
         }
 
-        // Save to Supabase
-        const { data: scan, error } = await supabase
-            .from('scan_results')
-            .insert([{
-                image_name: req.file.originalname || 'captured',
-                image_size: req.file.size,
-                mime_type: req.file.mimetype,
-                analysis_result: resultText,
-                plant_type: analysisData.plantType,
-                disease_name: analysisData.disease?.name,
-                severity: analysisData.disease?.severity || 'Unknown',
-                is_healthy: analysisData.isHealthy
-            }])
-            .select()
-            .single();
-
-        if (error) {
-            console.error('Database error:', error);
-            // Still return analysis even if DB save fails
-        }
+        const scan = await saveScan(req.file, resultText, analysisData);
 
         res.json({
             result: resultText,
             analysis: analysisData,
-            scanId: scan?.id
+            scanId: scan?.id,
+            source: 'gemini',
+            localPrediction: local?.predictions
         });
 
     } catch (error) {
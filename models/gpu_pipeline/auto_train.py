@@ -9,8 +9,21 @@ from pathlib import Path
 # Add current dir to path to find modules
 sys.path.append(os.path.dirname(__file__))
 
+from runtime_tuner import load_runtime_profile, apply_runtime_profile, calibrate_runtime
+from gpu_utils import enable_xla_cache
+
+# XLA-compiled train steps (measure with xla_benchmark.py first); its cache must be set before TF starts
+USE_XLA = False
+if USE_XLA: enable_xla_cache(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xla_cache'))
+
+# oneDNN and the thread pools are fixed once TensorFlow initialises, so the host profile goes first
+RUNTIME_PROFILE = apply_runtime_profile(load_runtime_profile('train', 'mobilenetv3'))
+
 from gpu_utils import setup_gpu
-from train_model import prepare_training_data, CropDiseaseModel
+from train_model import prepare_training_data, load_tfrecord_dataset, CropDiseaseModel
+
+# Effective batch per optimizer update on every machine; micro-batches are sized to the host's memory
+TARGET_BATCH_SIZE = 64
 
 def run_auto_train():
     print("="*60)
@@ -19,7 +32,8 @@ def run_auto_train():
 
     # 1. Setup GPU
     print("\n[1/4] Initializing GPU...")
-    setup_gpu(memory_growth=True)
+    has_gpu = setup_gpu(memory_growth=True)
+    profile = RUNTIME_PROFILE
 
     # 2. Paths
     # We use the raw dataset we already have
@@ -34,9 +48,14 @@ def run_auto_train():
         raw_data_dir=dataset_dir,
         output_dir=output_dir,
         val_split=0.2,
-        batch_size=32 # Safe for RTX 4050 6GB
+        batch_size=TARGET_BATCH_SIZE
     )
     print(f"      Classes found: {num_classes}")
+    train_dir, val_dir = os.path.join(output_dir, 'train'), os.path.join(output_dir, 'val')
+
+    # CPU-only host without a profile: calibrate once; threads/oneDNN apply from the next run
+    if profile is None and not has_gpu:
+        profile = calibrate_runtime(train_dir, num_classes, model_type='mobilenetv3')
 
     # 4. Build Model
     print(f"\n[3/4] Building MobileNetV3 (Transfer Learning)...")
@@ -46,7 +65,13 @@ def run_auto_train():
         use_mixed_precision=True
     )
     model.build_model(pretrained=True)
-    model.compile_model(learning_rate=0.001)
+    model.compile_model(learning_rate=0.001, jit_compile=USE_XLA)
+
+    # Largest micro-batch that fits (capped at the CPU profile's fastest), accumulated to TARGET_BATCH_SIZE
+    plan = model.find_batch_size(target_batch_size=TARGET_BATCH_SIZE, max_batch_size=profile['batch_size'] if profile else 512)
+    parallel_calls = profile['num_parallel_calls'] if profile else -1
+    train_ds = load_tfrecord_dataset(train_dir, plan['batch_size'], shuffle=True, num_parallel_calls=parallel_calls)
+    val_ds = load_tfrecord_dataset(val_dir, plan['batch_size'], shuffle=False, num_parallel_calls=parallel_calls)
 
     # 5. Train
     print(f"\n[4/4] Starting Training Loop...")
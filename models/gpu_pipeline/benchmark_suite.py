@@ -0,0 +1,237 @@
+"""
+Benchmark Suite
+Measures every pipeline stage on synthetic images (no downloaded data needed): directory scan,
+decode + resize, TFRecord write and read, train step per model type, batched model.predict and
+TFLite invoke for each model in assets/. Results are saved as JSON with host metadata; --baseline
+flags regressions against an earlier run.
+
+Usage:
+    python benchmark_suite.py --output benchmarks/host.json
+    python benchmark_suite.py --output benchmarks/new.json --baseline benchmarks/host.json
+    python benchmark_suite.py --compare benchmarks/new.json benchmarks/host.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from gpu_utils import detect_hardware
+from dataset_processor import CropDiseaseDatasetProcessor, load_tfrecord_dataset
+
+DEFAULT_MODEL_TYPES = ('mobilenetv3', 'mobilenetv3_small', 'efficientnet', 'custom')
+ASSETS_DIR = Path(__file__).resolve().parent.parent / 'assets'
+DEFAULT_TOLERANCE = 0.10  # relative slowdown that counts as a regression
+
+
+def host_metadata() -> Dict:
+    hardware = detect_hardware()
+    return {'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(),
+            'tensorflow': tf.__version__, 'cpu_count': os.cpu_count(), 'processor': platform.processor(), **hardware}
+
+
+def generate_synthetic_images(output_dir: str, num_images: int = 256, num_classes: int = 4,
+                              size: Sequence[int] = (480, 640), seed: int = 0) -> Dict[str, int]:
+    """Write smooth random JPEGs into class sub-folders (camera-like size); returns the labels map."""
+    rng = np.random.default_rng(seed)
+    labels = {}
+    for i in range(num_images):
+        label = i % num_classes
+        folder = Path(output_dir) / f"class_{label}"
+        folder.mkdir(parents=True, exist_ok=True)
+        # Upsampled noise compresses like a photo rather than like white noise
+        small = rng.integers(0, 256, (size[0] // 8, size[1] // 8, 3), dtype=np.uint8)
+        image = Image.fromarray(small).resize((size[1], size[0]), Image.BILINEAR)
+        name = f"img_{i:05d}.jpg"
+        image.save(folder / name, quality=90)
+        labels[name] = label
+    return labels
+
+
+def _timed(fn: Callable, repeats: int = 1) -> float:
+    """Best wall time in seconds over `repeats` runs of fn()."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _metric(value: float, unit: str, higher_is_better: bool) -> Dict:
+    return {'value': float(value), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def bench_data_pipeline(image_dir: str, labels: Dict[str, int], work_dir: str, batch_size: int = 32,
+                        image_size: int = 224) -> Dict[str, Dict]:
+    processor = CropDiseaseDatasetProcessor(batch_size=batch_size, target_size=(image_size, image_size))
+    num_images = len(labels)
+    results = {}
+
+    scan_s = _timed(lambda: processor._find_images(image_dir), repeats=3)
+    results['scan.files_per_sec'] = _metric(num_images / scan_s, 'files/s', True)
+
+    def decode():
+        for _ in processor.create_dataset_from_directory(image_dir, labels=labels, shuffle=False): pass
+    decode()  # warm the page cache and trace the map function
+    results['decode_resize.images_per_sec'] = _metric(num_images / _timed(decode, repeats=2), 'img/s', True)
+
+    tfrecord_dir = Path(work_dir) / 'tfrecords'
+    write_s = _timed(lambda: processor.process_and_save_tfrecords(image_dir, str(tfrecord_dir), labels_map=labels))
+    results['tfrecord_write.images_per_sec'] = _metric(num_images / write_s, 'img/s', True)
+
+    def read():
+        for _ in load_tfrecord_dataset(str(tfrecord_dir), batch_size, shuffle=False): pass
+    read()
+    results['tfrecord_read.images_per_sec'] = _metric(num_images / _timed(read, repeats=2), 'img/s', True)
+    return results
+
+
+def bench_models(model_types: Sequence[str], batch_size: int = 32, image_size: int = 224, num_classes: int = 38,
+                 steps: int = 10, predict_images: int = 256, mixed_precision: bool = False) -> Dict[str, Dict]:
+    """Median train-step time (frozen backbone and full fine-tune) and batched predict throughput per model type."""
+    from train_model import CropDiseaseModel
+    images = tf.random.uniform((batch_size, image_size, image_size, 3))
+    labels = tf.random.uniform((batch_size,), maxval=num_classes, dtype=tf.int32)
+    predict_batch = np.random.rand(predict_images, image_size, image_size, 3).astype(np.float32)
+
+    def median_step_ms(model):
+        for _ in range(2): model.train_on_batch(images, labels)
+        timings = []
+        for _ in range(steps):
+            start = time.perf_counter()
+            model.train_on_batch(images, labels)
+            timings.append((time.perf_counter() - start) * 1000)
+        return float(np.median(timings))
+
+    results = {}
+    for model_type in model_types:
+        print(f"\nBenchmarking {model_type}...")
+        wrapper = CropDiseaseModel(num_classes, (image_size, image_size, 3), model_type, use_mixed_precision=mixed_precision)
+        model = wrapper.build_model(pretrained=False)
+        wrapper.compile_model()
+        results[f"train_step.{model_type}.ms"] = _metric(median_step_ms(model), 'ms', False)
+        if model_type != 'custom':
+            wrapper._compile_fine_tune()
+            results[f"finetune_step.{model_type}.ms"] = _metric(median_step_ms(model), 'ms', False)
+        model.predict(predict_batch[:batch_size], batch_size=batch_size, verbose=0)
+        predict_s = _timed(lambda: model.predict(predict_batch, batch_size=batch_size, verbose=0), repeats=2)
+        results[f"predict.{model_type}.images_per_sec"] = _metric(predict_images / predict_s, 'img/s', True)
+    return results
+
+
+def bench_tflite(model_paths: Sequence[Path], num_threads: Optional[Sequence[int]] = None) -> Dict[str, Dict]:
+    """Median single-image invoke latency for each .tflite model at each thread count (default: 1 and all cores)."""
+    from quantization_workbench import measure_latency
+    num_threads = num_threads or sorted({1, os.cpu_count() or 1})
+    results = {}
+    for path in model_paths:
+        tflite_model = path.read_bytes()
+        interpreter = tf.lite.Interpreter(model_content=tflite_model)
+        shape = interpreter.get_input_details()[0]['shape'][1:]
+        image = np.random.rand(*shape).astype(np.float32)
+        for threads in num_threads:
+            latency = measure_latency(tflite_model, image, threads)
+            results[f"tflite.{path.stem}.t{threads}.ms"] = _metric(latency['median_ms'], 'ms', False)
+    return results
+
+
+def run_suite(output_path: Optional[str] = None, num_images: int = 256, batch_size: int = 32, image_size: int = 224,
+              model_types: Sequence[str] = DEFAULT_MODEL_TYPES, steps: int = 10, tflite_dir: Path = ASSETS_DIR,
+              stages: Sequence[str] = ('data', 'models', 'tflite')) -> Dict:
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'host': host_metadata(),
+              'config': {'num_images': num_images, 'batch_size': batch_size, 'image_size': image_size,
+                         'model_types': list(model_types), 'steps': steps, 'stages': list(stages)},
+              'results': {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        if 'data' in stages:
+            print(f"Generating {num_images} synthetic images...")
+            image_dir = str(Path(work_dir) / 'images')
+            labels = generate_synthetic_images(image_dir, num_images)
+            report['results'].update(bench_data_pipeline(image_dir, labels, work_dir, batch_size, image_size))
+        if 'models' in stages:
+            report['results'].update(bench_models(model_types, batch_size, image_size, steps=steps))
+        if 'tflite' in stages:
+            tflite_models = sorted(Path(tflite_dir).glob('*.tflite'))
+            if not tflite_models:
+                print(f"⚠ No .tflite models in {tflite_dir}, skipping TFLite stage")
+            report['results'].update(bench_tflite(tflite_models))
+
+    print_report(report)
+    if output_path:
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f: json.dump(report, f, indent=2)
+        print(f"✓ Benchmark saved to: {output_path}")
+    return report
+
+
+def print_report(report: Dict):
+    print("\n" + "=" * 70)
+    print(f"BENCHMARK RESULTS ({report['host']['host']}, {report['host']['device']})")
+    print("=" * 70)
+    for name, metric in report['results'].items():
+        print(f"{name:<50}{metric['value']:>12.1f} {metric['unit']}")
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[Dict]:
+    """Metrics present in both reports, with relative change (positive = better); regressions flagged."""
+    rows = []
+    for name, metric in current['results'].items():
+        if name not in baseline['results']: continue
+        old, new = baseline['results'][name]['value'], metric['value']
+        change = (new - old) / old if metric['higher_is_better'] else (old - new) / old
+        rows.append({'metric': name, 'baseline': old, 'current': new, 'unit': metric['unit'],
+                     'change': change, 'regression': change < -tolerance})
+
+    print("\n" + "=" * 86)
+    print(f"COMPARISON vs baseline from {baseline['created']} ({baseline['host']['host']}), tolerance {tolerance:.0%}")
+    print("=" * 86)
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ''
+        print(f"{row['metric']:<46}{row['baseline']:>12.1f}{row['current']:>12.1f} {row['unit']:<6}{row['change']:>+8.1%}{flag}")
+    if baseline['host']['host'] != current['host']['host']:
+        print(f"⚠ Different hosts: {baseline['host']['host']} vs {current['host']['host']}")
+    regressions = [r for r in rows if r['regression']]
+    print(f"\n{len(regressions)} regression(s) in {len(rows)} shared metric(s)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data pipeline, training, inference and TFLite on synthetic images")
+    parser.add_argument('--output', help="JSON report path")
+    parser.add_argument('--baseline', help="Earlier report to check for regressions")
+    parser.add_argument('--compare', nargs=2, metavar=('CURRENT', 'BASELINE'), help="Only compare two saved reports")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--images', type=int, default=256, help="Synthetic images for the data stages")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--model-types', nargs='+', default=list(DEFAULT_MODEL_TYPES))
+    parser.add_argument('--stages', nargs='+', default=['data', 'models', 'tflite'], choices=['data', 'models', 'tflite'])
+    parser.add_argument('--tflite-dir', default=str(ASSETS_DIR))
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f: current = json.load(f)
+        with open(args.compare[1]) as f: baseline = json.load(f)
+    else:
+        current = run_suite(args.output, args.images, args.batch_size, args.image_size, args.model_types,
+                            args.steps, Path(args.tflite_dir), args.stages)
+        if not args.baseline: return
+        with open(args.baseline) as f: baseline = json.load(f)
+    rows = compare(current, baseline, args.tolerance)
+    if any(r['regression'] for r in rows): sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
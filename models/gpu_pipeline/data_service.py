@@ -0,0 +1,171 @@
+"""
+tf.data Service Launcher
+Runs the input pipeline (read, decode, resize, augment) in separate tf.data service worker
+processes so preprocessing stops competing with the training step for the trainer's cores.
+Workers can run on this host or on other CPU boxes; the trainer consumes batches from the
+dispatcher via `load_tfrecord_dataset(..., data_service=...)` or
+`CropDiseaseDatasetProcessor(data_service=...)`.
+
+Usage:
+    # dispatcher + 4 workers on this host
+    python data_service.py local --workers 4 --port 5050
+
+    # or by hand, e.g. workers on other boxes (input files must be readable there too)
+    python data_service.py dispatcher --port 5050
+    python data_service.py worker --dispatcher trainer-host:5050 --port 5051 --host worker-host
+
+    # throughput: in-process pipeline vs. the service, with a real train step consuming batches
+    python data_service.py compare --tfrecords prepared_data/train --local-workers 4 --model-type mobilenetv3
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import tensorflow as tf
+
+from dataset_processor import CropDiseaseDatasetProcessor, load_tfrecord_dataset
+
+
+def run_dispatcher(port: int = 5050, work_dir: Optional[str] = None):
+    """Serve the dispatcher until killed. `work_dir` enables fault-tolerant restarts."""
+    config = tf.data.experimental.service.DispatcherConfig(port=port, work_dir=work_dir, fault_tolerant_mode=bool(work_dir))
+    server = tf.data.experimental.service.DispatchServer(config)
+    print(f"✓ tf.data dispatcher listening on {server.target}")
+    server.join()
+
+
+def run_worker(dispatcher: str, port: int = 0, host: str = 'localhost'):
+    """Serve one preprocessing worker until killed. `host` is the address the trainer reaches it at."""
+    config = tf.data.experimental.service.WorkerConfig(dispatcher_address=dispatcher.split('://')[-1], port=port,
+                                                       worker_address=f"{host}:%port%")
+    server = tf.data.experimental.service.WorkerServer(config)
+    print(f"✓ tf.data worker registered with {dispatcher}")
+    server.join()
+
+
+def launch_local(num_workers: int, port: int = 5050) -> List[subprocess.Popen]:
+    """Start a dispatcher and `num_workers` worker processes on this host; returns the processes."""
+    script = str(Path(__file__).resolve())
+    procs = [subprocess.Popen([sys.executable, script, 'dispatcher', '--port', str(port)])]
+    procs += [subprocess.Popen([sys.executable, script, 'worker', '--dispatcher', f"localhost:{port}"])
+              for _ in range(num_workers)]
+    print(f"Launched dispatcher on localhost:{port} with {num_workers} worker process(es)")
+    return procs
+
+
+def make_dataset(batch_size: int, tfrecords: Optional[str] = None, images: Optional[str] = None,
+                 image_size: int = 224, data_service: Optional[str] = None) -> tf.data.Dataset:
+    """The training pipeline on TFRecords, or raw class-folder images with augmentation."""
+    if tfrecords:
+        return load_tfrecord_dataset(tfrecords, batch_size, shuffle=True, image_size=image_size, data_service=data_service)
+    class_folders = sorted(d for d in Path(images).iterdir() if d.is_dir())
+    labels = {img.name: i for i, folder in enumerate(class_folders) for img in folder.glob('*.*')}
+    processor = CropDiseaseDatasetProcessor(batch_size, (image_size, image_size), augmentation=True, data_service=data_service)
+    return processor.create_dataset_from_directory(images, labels=labels)
+
+
+def measure_throughput(dataset: tf.data.Dataset, steps: int, train_step=None, warmup: int = 3) -> float:
+    """Images/sec over `steps` batches, optionally running `train_step(images, labels)` on each."""
+    iterator = iter(dataset.repeat())
+    for _ in range(warmup):
+        images, labels = next(iterator)
+        if train_step: train_step(images, labels)
+    count, start = 0, time.perf_counter()
+    for _ in range(steps):
+        images, labels = next(iterator)
+        if train_step: train_step(images, labels)
+        count += int(images.shape[0])
+    return count / (time.perf_counter() - start)
+
+
+def compare_throughput(service: str, batch_size: int = 32, steps: int = 50, tfrecords: Optional[str] = None,
+                       images: Optional[str] = None, image_size: int = 224, model_type: Optional[str] = None,
+                       num_classes: int = 38) -> Dict:
+    """
+    Input-only and (with `model_type`) end-to-end training throughput for the in-process
+    pipeline vs. the same pipeline served by the tf.data service at `service`.
+    """
+    train_step = None
+    if model_type:
+        from train_model import CropDiseaseModel
+        wrapper = CropDiseaseModel(num_classes, (image_size, image_size, 3), model_type, use_mixed_precision=False)
+        model = wrapper.build_model(pretrained=False)
+        wrapper.compile_model()
+        train_step = model.train_on_batch
+
+    report = {'batch_size': batch_size, 'steps': steps, 'model_type': model_type, 'service': service}
+    for label, address in (('in_process', None), ('data_service', service)):
+        dataset = make_dataset(batch_size, tfrecords, images, image_size, data_service=address)
+        report[label] = {'input_images_per_sec': measure_throughput(dataset, steps)}
+        if train_step:
+            report[label]['train_images_per_sec'] = measure_throughput(dataset, steps, train_step)
+        print(f"[{label}] " + ", ".join(f"{k}: {v:.1f}" for k, v in report[label].items()))
+
+    key = 'train_images_per_sec' if train_step else 'input_images_per_sec'
+    report['speedup'] = report['data_service'][key] / report['in_process'][key]
+    print(f"Data service speedup ({key}): x{report['speedup']:.2f}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run preprocessing on tf.data service workers")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('dispatcher', help="Run the dispatcher")
+    p.add_argument('--port', type=int, default=5050)
+    p.add_argument('--work-dir', help="Journal directory for fault-tolerant restarts")
+
+    p = sub.add_parser('worker', help="Run one preprocessing worker")
+    p.add_argument('--dispatcher', required=True, help="Dispatcher address, host:port")
+    p.add_argument('--port', type=int, default=0, help="0 = any free port")
+    p.add_argument('--host', default='localhost', help="Address the trainer uses to reach this worker")
+
+    p = sub.add_parser('local', help="Dispatcher + N workers on this host")
+    p.add_argument('--workers', type=int, default=2)
+    p.add_argument('--port', type=int, default=5050)
+
+    p = sub.add_parser('compare', help="Throughput: in-process pipeline vs. data service")
+    source = p.add_mutually_exclusive_group(required=True)
+    source.add_argument('--tfrecords', help="Directory of .tfrecord shards")
+    source.add_argument('--images', help="Directory of class sub-folders (decoded + augmented per batch)")
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument('--service', help="Running dispatcher address, host:port")
+    target.add_argument('--local-workers', type=int, help="Start a local dispatcher with this many workers")
+    p.add_argument('--port', type=int, default=5050, help="Dispatcher port for --local-workers")
+    p.add_argument('--batch-size', type=int, default=32)
+    p.add_argument('--image-size', type=int, default=224)
+    p.add_argument('--steps', type=int, default=50)
+    p.add_argument('--model-type', help="Also time a real train step (e.g. mobilenetv3, custom)")
+    p.add_argument('--num-classes', type=int, default=38)
+    p.add_argument('--output', help="Optional JSON report path")
+    args = parser.parse_args()
+
+    if args.command == 'dispatcher':
+        run_dispatcher(args.port, args.work_dir)
+    elif args.command == 'worker':
+        run_worker(args.dispatcher, args.port, args.host)
+    elif args.command == 'local':
+        procs = launch_local(args.workers, args.port)
+        try:
+            for proc in procs: proc.wait()
+        except KeyboardInterrupt:
+            for proc in procs: proc.terminate()
+    else:
+        procs = launch_local(args.local_workers, args.port) if args.local_workers else []
+        try:
+            report = compare_throughput(args.service or f"localhost:{args.port}", args.batch_size, args.steps,
+                                        args.tfrecords, args.images, args.image_size, args.model_type, args.num_classes)
+        finally:
+            for proc in procs: proc.terminate()
+        if args.output:
+            with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+            print(f"✓ Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,9 @@ class CropDiseaseDatasetProcessor:
     def __init__(self, 
                  batch_size: int = 64,
                  target_size: Tuple[int, int] = (224, 224),
-                 augmentation: bool = False):
+                 augmentation: bool = False,
+                 data_service: Optional[str] = None,
+                 quality_gate=None):
         """
         Initialize the dataset processor.
         
@@ -28,16 +30,24 @@ class CropDiseaseDatasetProcessor:
             batch_size: Number of images per batch (adjust based on GPU memory)
             target_size: Target image size (height, width)
             augmentation: Whether to apply data augmentation
+            data_service: tf.data service dispatcher address (see data_service.py) to run
+                decoding/augmentation on separate worker processes; None = in-process
+            quality_gate: e.g. src/quality_gate.QualityGate(); images it rejects (blurry, badly exposed,
+                tiny or unreadable) are dropped when the directory is scanned
         """
         self.batch_size = batch_size
         self.target_size = target_size
         self.augmentation = augmentation
+        self.data_service = data_service
+        self.quality_gate = quality_gate
+        self._quality_checked: Dict[str, List[Path]] = {}
         
         # Statistics
         self.stats = {
             'total_images': 0,
             'processed_images': 0,
             'failed_images': 0,
+            'rejected_images': 0,
             'processing_time': 0,
             'images_per_second': 0
         }
@@ -57,13 +67,13 @@ class CropDiseaseDatasetProcessor:
         # Resize to target size
         image = tf.image.resize(image, self.target_size)
         
+        # Normalize to [0, 1] for MobileNet/EfficientNet (augmentation works in this range)
+        image = image / 255.0
+        
         # Apply augmentation if enabled
         if self.augmentation:
             image = self._augment_image(image)
         
-        # Normalize to [0, 1] for MobileNet/EfficientNet
-        image = image / 255.0
-        
         if label is not None:
             return image, label
         return image, filepath
@@ -85,8 +95,13 @@ class CropDiseaseDatasetProcessor:
     def create_dataset_from_directory(self, 
                                      image_dir: str,
                                      labels: Optional[Dict[str, int]] = None,
-                                     shuffle: bool = True) -> tf.data.Dataset:
-        """Create TensorFlow dataset from directory of images."""
+                                     shuffle: bool = True,
+                                     return_paths: bool = False) -> tf.data.Dataset:
+        """
+        Create TensorFlow dataset from directory of images.
+        Yields (image, label) when `labels` is given, else (image, path); `return_paths` keeps the
+        paths even when `labels` filters the files (TFRecord export looks labels up by file name).
+        """
         all_paths = self._find_images(image_dir)
         
         # Filter paths if labels map is provided (Critical for Train/Val split)
@@ -103,7 +118,7 @@ class CropDiseaseDatasetProcessor:
         
         path_strings = [str(p) for p in image_paths]
         
-        if labels:
+        if labels and not return_paths:
             label_list = [labels[p.name] for p in image_paths]
             dataset = tf.data.Dataset.from_tensor_slices((path_strings, label_list))
         else:
@@ -119,18 +134,39 @@ class CropDiseaseDatasetProcessor:
         )
         
         dataset = dataset.batch(self.batch_size)
+        if self.data_service:
+            dataset = from_data_service(dataset, self.data_service)
         dataset = dataset.prefetch(tf.data.AUTOTUNE)
         
         return dataset
     
     def _find_images(self, image_dir: str) -> List[Path]:
-        """Find all image files in directory"""
+        """Find all image files in directory (minus the quality gate's rejects, checked once per directory)"""
         extensions = ['*.jpg', '*.jpeg', '*.png', '*.JPG', '*.JPEG', '*.PNG']
         image_paths = []
         img_dir = Path(image_dir)
         for ext in extensions:
             image_paths.extend(list(img_dir.rglob(ext)))
-        return sorted(image_paths)
+        image_paths = sorted(image_paths)
+        if self.quality_gate is None:
+            return image_paths
+        if image_dir not in self._quality_checked:
+            self._quality_checked[image_dir] = self._filter_quality(image_paths)
+        return self._quality_checked[image_dir]
+
+    def _filter_quality(self, image_paths: List[Path]) -> List[Path]:
+        kept, reasons = [], {}
+        for path in image_paths:
+            report = self.quality_gate.check_file(str(path))
+            if report['verdict'] == 'reject':
+                for reason in report['reasons']: reasons[reason] = reasons.get(reason, 0) + 1
+            else:
+                kept.append(path)
+        rejected = len(image_paths) - len(kept)
+        self.stats['rejected_images'] += rejected
+        print(f"✓ Quality gate: kept {len(kept)}/{len(image_paths)} images"
+              + (f" (rejected: {', '.join(f'{r} {n}' for r, n in sorted(reasons.items()))})" if rejected else ""))
+        return kept
 
     def process_and_save_tfrecords(self, image_dir: str, output_dir: str, samples_per_file: int = 5000, labels_map: Optional[Dict[str, int]] = None):
         """Process images and save as TFRecord files for efficient training."""
@@ -141,7 +177,7 @@ class CropDiseaseDatasetProcessor:
         total_images = len(image_paths)
         
         print(f"\nConverting {total_images} images to TFRecord format...")
-        dataset = self.create_dataset_from_directory(image_dir, labels_map, shuffle=False)
+        dataset = self.create_dataset_from_directory(image_dir, labels_map, shuffle=False, return_paths=True)
         
         start_time = time.time()
         file_count = 0
@@ -180,18 +216,25 @@ class CropDiseaseDatasetProcessor:
             feature['label'] = tf.train.Feature(int64_list=tf.train.Int64List(value=[label]))
         return tf.train.Example(features=tf.train.Features(feature=feature))
 
-    def process_with_model(self, image_dir: str, model: tf.keras.Model, output_file: str = "predictions.json", save_embeddings: bool = False):
-        """Process images with a trained model (inference)."""
+    def process_with_model(self, image_dir: str, model: tf.keras.Model, output_file: str = "predictions.json", save_embeddings: bool = False, jit_compile: bool = False):
+        """
+        Process images with a trained model (inference).
+
+        Batches run through one compiled function; with `jit_compile` it is XLA-compiled and the
+        last batch is padded to `batch_size`, so a single executable serves the whole run.
+        """
         dataset = self.create_dataset_from_directory(image_dir, shuffle=False)
         results = []
         print(f"\nRunning inference on images from {image_dir}...")
         
+        if save_embeddings:
+            model = tf.keras.Model(inputs=model.input, outputs=model.layers[-2].output)
+        predict_fn = tf.function(lambda images: model(images, training=False), jit_compile=jit_compile)
+        
         for batch_images, batch_paths in dataset:
-            if save_embeddings:
-                embedding_model = tf.keras.Model(inputs=model.input, outputs=model.layers[-2].output)
-                predictions = embedding_model.predict(batch_images, verbose=0)
-            else:
-                predictions = model.predict(batch_images, verbose=0)
+            count = batch_images.shape[0]
+            if jit_compile: batch_images = pad_batch(batch_images, self.batch_size)
+            predictions = predict_fn(batch_images).numpy()[:count]
             
             for path, pred in zip(batch_paths.numpy(), predictions):
                 path_str = path.decode('utf-8') if isinstance(path, bytes) else str(path)
@@ -204,31 +247,83 @@ class CropDiseaseDatasetProcessor:
             json.dump(results, f, indent=2)
         print(f"✓ Inference complete! Results saved to: {output_file}")
 
+def parse_tfrecord_example(example_proto, image_size: Optional[int] = None):
+    """Decode one serialized example into a [0, 1] float image and its label."""
+    feature_description = {
+        'image': tf.io.FixedLenFeature([], tf.string),
+        'path': tf.io.FixedLenFeature([], tf.string),
+        'label': tf.io.FixedLenFeature([], tf.int64, default_value=0)
+    }
+    parsed = tf.io.parse_single_example(example_proto, feature_description)
+    image = tf.io.decode_jpeg(parsed['image'], channels=3)
+    image = tf.cast(image, tf.float32) / 255.0
+    if image_size is not None:
+        image = tf.image.resize(image, (image_size, image_size))
+    label = parsed['label']
+    return image, label
+
 def load_tfrecord_dataset(tfrecord_dir: str, 
                           batch_size: int = 64,
                           shuffle: bool = True,
-                          buffer_size: int = 10000) -> tf.data.Dataset:
-    """Load and parse TFRecord dataset."""
-    tfrecord_files = list(Path(tfrecord_dir).glob("*.tfrecord"))
+                          buffer_size: int = 10000,
+                          image_size: Optional[int] = None,
+                          num_parallel_calls: int = tf.data.AUTOTUNE,
+                          data_service: Optional[str] = None) -> tf.data.Dataset:
+    """
+    Load and parse TFRecord dataset. `image_size` resizes the stored images (e.g. progressive resizing);
+    `num_parallel_calls` sets the decode parallelism (see runtime_tuner.py for per-host values);
+    `data_service` moves reading/decoding to tf.data service workers (see data_service.py).
+    """
+    tfrecord_files = sorted(Path(tfrecord_dir).glob("*.tfrecord"))
     if not tfrecord_files:
         raise ValueError(f"No .tfrecord files found in {tfrecord_dir}")
         
     dataset = tf.data.TFRecordDataset([str(f) for f in tfrecord_files])
-    
-    def parse_example(example_proto):
-        feature_description = {
-            'image': tf.io.FixedLenFeature([], tf.string),
-            'path': tf.io.FixedLenFeature([], tf.string),
-            'label': tf.io.FixedLenFeature([], tf.int64, default_value=0)
-        }
-        parsed = tf.io.parse_single_example(example_proto, feature_description)
-        image = tf.io.decode_jpeg(parsed['image'], channels=3)
-        image = tf.cast(image, tf.float32) / 255.0
-        label = parsed['label']
-        return image, label
-    
-    dataset = dataset.map(parse_example, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.map(lambda proto: parse_tfrecord_example(proto, image_size), num_parallel_calls=num_parallel_calls)
     if shuffle:
         dataset = dataset.shuffle(buffer_size)
-    dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
-    return dataset
+    dataset = dataset.batch(batch_size)
+    if data_service:
+        dataset = from_data_service(dataset, data_service)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def from_data_service(dataset: tf.data.Dataset, service: str, job_name: Optional[str] = None) -> tf.data.Dataset:
+    """
+    Execute `dataset` on tf.data service workers and stream its elements back to this process.
+
+    Sharding is dynamic, so each element is produced once per epoch across all workers, in
+    nondeterministic order. Input files must be readable from every worker (same host or shared storage).
+    """
+    if '://' not in service:
+        service = f"grpc://{service}"
+    return dataset.apply(tf.data.experimental.service.distribute(
+        processing_mode=tf.data.experimental.service.ShardingPolicy.DYNAMIC, service=service, job_name=job_name))
+
+
+def resize_batches(dataset: tf.data.Dataset, image_size: int, batch_size: int) -> tf.data.Dataset:
+    """Re-batch an (image, label) dataset at a new resolution and batch size."""
+    dataset = dataset.unbatch()
+    dataset = dataset.map(
+        lambda image, label: (tf.image.resize(image, (image_size, image_size)), label),
+        num_parallel_calls=tf.data.AUTOTUNE
+    )
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def pad_batch(tensor: tf.Tensor, batch_size: int) -> tf.Tensor:
+    """Zero-pad the leading (batch) dimension of `tensor` up to `batch_size`."""
+    padding = [[0, batch_size - tf.shape(tensor)[0]]] + [[0, 0]] * (len(tensor.shape) - 1)
+    return tf.ensure_shape(tf.pad(tensor, padding), [batch_size, *tensor.shape[1:]])
+
+
+def pad_batches(dataset: tf.data.Dataset, batch_size: int) -> tf.data.Dataset:
+    """
+    Pad every (image, label) batch to exactly `batch_size` rows and add sample weights that zero
+    out the padding, so XLA sees one static shape instead of recompiling for the last batch.
+    """
+    def pad(images, labels):
+        count = tf.shape(images)[0]
+        weights = tf.concat([tf.ones([count]), tf.zeros([batch_size - count])], axis=0)
+        return pad_batch(images, batch_size), pad_batch(labels, batch_size), weights
+    return dataset.map(pad, num_parallel_calls=tf.data.AUTOTUNE)
@@ -0,0 +1,116 @@
+"""
+Knowledge Distillation for Crop Disease Detection
+Trains a small student (MobileNetV3Small / custom CNN) against cached soft targets
+from a large teacher (MobileNetV3Large / EfficientNet).
+"""
+
+import tensorflow as tf
+from tensorflow import keras
+from pathlib import Path
+from typing import Optional
+import numpy as np
+
+from dataset_processor import load_tfrecord_dataset
+
+
+class Distiller(keras.Model):
+    """
+    Wraps a student model and trains it on (label, teacher_log_probs) targets.
+
+    Loss = alpha * CE(label, student) + (1 - alpha) * T^2 * KL(teacher_T || student_T).
+    The student keeps its softmax head, so softened probabilities are recovered as
+    softmax(log(p) / T), which equals softmax(logits / T).
+    """
+
+    def __init__(self, student: keras.Model, temperature: float = 4.0, alpha: float = 0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.student = student
+        self.temperature = temperature
+        self.alpha = alpha
+        self.hard_loss = keras.losses.SparseCategoricalCrossentropy()
+
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+
+    def compute_loss(self, x=None, y=None, y_pred=None, sample_weight=None, training=True):
+        labels, teacher_log_probs = _split_targets(y)
+        hard = self.hard_loss(labels, y_pred)
+        if teacher_log_probs is None:
+            return hard  # validation data carries plain labels
+
+        t = self.temperature
+        student_log_probs = tf.nn.log_softmax(tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0)) / t)
+        teacher_log_probs = tf.cast(teacher_log_probs, student_log_probs.dtype)
+        kl = tf.reduce_sum(tf.exp(teacher_log_probs) * (teacher_log_probs - student_log_probs), axis=-1)
+        soft = tf.reduce_mean(kl) * t * t
+        return self.alpha * hard + (1 - self.alpha) * soft
+
+    def compute_metrics(self, x, y, y_pred, sample_weight=None):
+        labels, _ = _split_targets(y)
+        return super().compute_metrics(x, labels, y_pred, sample_weight)
+
+
+def _split_targets(y):
+    if isinstance(y, (tuple, list)):
+        return y[0], y[1]
+    return y, None
+
+
+def _read_paths(tfrecord_dir: str) -> np.ndarray:
+    """Read only the 'path' feature of every record (no image decoding)."""
+    files = [str(f) for f in sorted(Path(tfrecord_dir).glob("*.tfrecord"))]
+    dataset = tf.data.TFRecordDataset(files).map(
+        lambda proto: tf.io.parse_single_example(proto, {'path': tf.io.FixedLenFeature([], tf.string)})['path'],
+        num_parallel_calls=tf.data.AUTOTUNE
+    )
+    return np.array([p for batch in dataset.batch(4096).as_numpy_iterator() for p in batch], dtype=bytes)
+
+
+def cache_teacher_targets(teacher: keras.Model,
+                          tfrecord_dir: str,
+                          temperature: float = 4.0,
+                          cache_path: Optional[str] = None,
+                          batch_size: int = 64) -> Path:
+    """
+    Run the teacher once over the TFRecord shards and store softened log-probabilities.
+
+    The cache is keyed by each record's source path and reused while the paths and
+    temperature still match, so the teacher never re-runs per epoch.
+    """
+    cache_path = Path(cache_path or Path(tfrecord_dir) / f"teacher_targets_T{temperature:g}.npz")
+    paths = _read_paths(tfrecord_dir)
+
+    if cache_path.exists():
+        cached = np.load(cache_path)
+        if float(cached['temperature']) == temperature and np.array_equal(cached['paths'], paths):
+            print(f"✓ Reusing teacher targets from {cache_path}")
+            return cache_path
+        print(f"Teacher cache {cache_path.name} is stale, rebuilding...")
+
+    print(f"\nCaching teacher soft targets for {len(paths)} images (T={temperature})...")
+    dataset = load_tfrecord_dataset(tfrecord_dir, batch_size=batch_size, shuffle=False)
+    targets = []
+    for images, _ in dataset:
+        probs = teacher.predict_on_batch(images)
+        log_probs = tf.nn.log_softmax(tf.math.log(tf.clip_by_value(tf.cast(probs, tf.float32), 1e-7, 1.0)) / temperature)
+        targets.append(log_probs.numpy().astype(np.float16))
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path, paths=paths, targets=np.concatenate(targets), temperature=temperature)
+    print(f"✓ Teacher targets saved to: {cache_path}")
+    return cache_path
+
+
+def load_distillation_dataset(tfrecord_dir: str,
+                              cache_path: str,
+                              batch_size: int = 64,
+                              shuffle: bool = True,
+                              buffer_size: int = 10000) -> tf.data.Dataset:
+    """Yield (image, (label, teacher_log_probs)) batches aligned record-by-record with the cache."""
+    targets = np.load(cache_path)['targets']
+    examples = load_tfrecord_dataset(tfrecord_dir, batch_size=batch_size, shuffle=False).unbatch()
+    dataset = tf.data.Dataset.zip((examples, tf.data.Dataset.from_tensor_slices(targets)))
+    dataset = dataset.map(lambda example, soft: (example[0], (example[1], soft)), num_parallel_calls=tf.data.AUTOTUNE)
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,174 @@
+"""
+Multi-Worker Data-Parallel Training
+MultiWorkerMirroredStrategy over CPU processes on one or more hosts, configured from a simple
+cluster spec ({"worker": ["host1:12345", "host2:12345"]}), with per-worker TFRecord sharding.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import tensorflow as tf
+
+from dataset_processor import parse_tfrecord_example
+
+
+def load_cluster_spec(path: str) -> Dict[str, List[str]]:
+    with open(path) as f: cluster = json.load(f)
+    if not cluster.get('worker'):
+        raise ValueError(f"Cluster spec {path} needs a non-empty 'worker' list")
+    return cluster
+
+
+def local_cluster_spec(num_workers: int, base_port: int = 12345) -> Dict[str, List[str]]:
+    """Cluster spec for `num_workers` processes on this machine (testing / one big box)."""
+    return {'worker': [f"localhost:{base_port + i}" for i in range(num_workers)]}
+
+
+def configure_worker(cluster: Dict[str, List[str]], task_index: int):
+    """Export TF_CONFIG for this process. Must run before TensorFlow initialises (see make_strategy)."""
+    os.environ['TF_CONFIG'] = json.dumps({'cluster': cluster, 'task': {'type': 'worker', 'index': task_index}})
+
+
+def _tf_config() -> Dict:
+    return json.loads(os.environ.get('TF_CONFIG', '{}'))
+
+
+def worker_info():
+    """(task_index, num_workers) of this process; (0, 1) when not distributed."""
+    config = _tf_config()
+    if not config: return 0, 1
+    return config['task']['index'], len(config['cluster'].get('worker', [])) + len(config['cluster'].get('chief', []))
+
+
+def is_chief() -> bool:
+    """Only the chief writes checkpoints, logs and exports (worker 0 unless the spec names a chief)."""
+    config = _tf_config()
+    if not config: return True
+    task = config['task']
+    return task['type'] == 'chief' or (task['type'] == 'worker' and task['index'] == 0 and 'chief' not in config['cluster'])
+
+
+def make_strategy() -> tf.distribute.Strategy:
+    """
+    MultiWorkerMirroredStrategy with ring all-reduce (the CPU collective) when TF_CONFIG is set,
+    else the default single-process strategy. Create it at program start, before other TF ops.
+    """
+    if not _tf_config(): return tf.distribute.get_strategy()
+    options = tf.distribute.experimental.CommunicationOptions(implementation=tf.distribute.experimental.CommunicationImplementation.RING)
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(communication_options=options)
+    index, num_workers = worker_info()
+    print(f"✓ Worker {index}/{num_workers} joined ({strategy.num_replicas_in_sync} replicas in sync)")
+    return strategy
+
+
+def load_sharded_tfrecord_dataset(tfrecord_dir: str,
+                                  per_worker_batch_size: int = 64,
+                                  shuffle: bool = True,
+                                  buffer_size: int = 10000,
+                                  num_parallel_calls: int = tf.data.AUTOTUNE) -> tf.data.Dataset:
+    """
+    This worker's share of the TFRecord shard files, batched at the global batch size and repeated.
+
+    Files are split round-robin between workers; the strategy then hands each worker
+    global_batch / num_workers examples per step. With fewer files than workers every worker
+    reads all files and keeps every n-th record instead. Shares differ in size, so the dataset
+    repeats and fit() must get steps_per_epoch (see steps_per_epoch()) to keep workers in lockstep.
+    """
+    index, num_workers = worker_info()
+    files = [str(f) for f in sorted(Path(tfrecord_dir).glob("*.tfrecord"))]
+    if not files:
+        raise ValueError(f"No .tfrecord files found in {tfrecord_dir}")
+
+    if len(files) >= num_workers:
+        dataset = tf.data.TFRecordDataset(files[index::num_workers])
+    else:
+        print(f"⚠ {len(files)} shard files for {num_workers} workers: sharding by record")
+        dataset = tf.data.TFRecordDataset(files).shard(num_workers, index)
+    dataset = dataset.map(parse_tfrecord_example, num_parallel_calls=num_parallel_calls)
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size)
+    dataset = dataset.repeat().batch(per_worker_batch_size * num_workers).prefetch(tf.data.AUTOTUNE)
+
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF  # sharded above
+    return dataset.with_options(options)
+
+
+def steps_per_epoch(tfrecord_dir: str, per_worker_batch_size: int) -> int:
+    """Global steps covering every record once (counted from the shard files)."""
+    _, num_workers = worker_info()
+    files = [str(f) for f in sorted(Path(tfrecord_dir).glob("*.tfrecord"))]
+    records = int(tf.data.TFRecordDataset(files).reduce(0, lambda count, _: count + 1))
+    return max(records // (per_worker_batch_size * num_workers), 1)
+
+
+def fit_multi_worker(model,
+                     strategy: tf.distribute.Strategy,
+                     train_dataset: tf.data.Dataset,
+                     val_dataset: tf.data.Dataset,
+                     epochs: int,
+                     steps_per_epoch: int,
+                     validation_steps: int,
+                     initial_epoch: int = 0,
+                     callbacks=()):
+    """
+    Synchronous data-parallel training loop standing in for model.fit under MultiWorkerMirroredStrategy
+    (Keras 3's fit cannot reduce scalar metrics across workers). Gradients are all-reduced by the
+    optimizer; loss/accuracy are summed over workers, and Keras callbacks run on every worker.
+    Batches are (images, labels) or (images, labels, sample_weight), e.g. the zero-weighted padding rows
+    of XLA's fixed-shape batches, which then count neither in the loss nor in the metrics.
+    """
+    from tensorflow import keras
+    optimizer = model.optimizer
+    with strategy.scope():
+        optimizer.build(model.trainable_variables)
+
+    def replica_step(images, labels, weights, training):
+        with tf.GradientTape() as tape:
+            probs = model(images, training=training)
+            per_example = keras.losses.sparse_categorical_crossentropy(labels, probs)
+            weights = tf.ones_like(per_example) if weights is None else tf.cast(weights, per_example.dtype)
+            loss = tf.nn.compute_average_loss(per_example, sample_weight=weights)
+            if model.losses: loss += tf.nn.scale_regularization_loss(tf.add_n(model.losses))
+            scaled = optimizer.scale_loss(loss) if isinstance(optimizer, keras.optimizers.LossScaleOptimizer) else loss
+        if training:
+            optimizer.apply_gradients(zip(tape.gradient(scaled, model.trainable_variables), model.trainable_variables))
+        correct = tf.cast(tf.equal(tf.argmax(probs, axis=-1), tf.cast(labels, tf.int64)), tf.float32)
+        weights = tf.cast(weights, tf.float32)
+        return (tf.reduce_sum(tf.cast(per_example, tf.float32) * weights), tf.reduce_sum(correct * weights),
+                tf.reduce_sum(weights))
+
+    def make_step(training):
+        @tf.function
+        def step(iterator):
+            images, labels, *weights = next(iterator)
+            totals = strategy.run(replica_step, args=(images, labels, weights[0] if weights else None, training))
+            return [strategy.reduce("SUM", t, axis=None) for t in totals]
+        return step
+
+    def run_epoch(step, iterator, steps):
+        loss = correct = count = 0.0
+        for _ in range(steps):
+            batch_loss, batch_correct, batch_count = step(iterator)
+            loss, correct, count = loss + float(batch_loss), correct + float(batch_correct), count + float(batch_count)
+        return loss / max(count, 1), correct / max(count, 1)
+
+    train_step, eval_step = make_step(True), make_step(False)
+    train_iter = iter(strategy.experimental_distribute_dataset(train_dataset))
+    val_iter = iter(strategy.experimental_distribute_dataset(val_dataset))
+    callback_list = keras.callbacks.CallbackList(list(callbacks), add_history=True, model=model,
+                                                 epochs=epochs, steps=steps_per_epoch)
+    model.stop_training = False
+    callback_list.on_train_begin()
+    for epoch in range(initial_epoch, epochs):
+        callback_list.on_epoch_begin(epoch)
+        loss, accuracy = run_epoch(train_step, train_iter, steps_per_epoch)
+        val_loss, val_accuracy = run_epoch(eval_step, val_iter, validation_steps)
+        logs = {'loss': loss, 'accuracy': accuracy, 'val_loss': val_loss, 'val_accuracy': val_accuracy}
+        print(f"Epoch {epoch + 1}/{epochs} - " + " - ".join(f"{k}: {v:.4f}" for k, v in logs.items()))
+        callback_list.on_epoch_end(epoch, logs)
+        if model.stop_training: break
+    callback_list.on_train_end()
+    return model.history
@@ -0,0 +1,92 @@
+"""
+Multi-Worker Training Launcher
+Runs CropDiseaseModel training as one worker of a MultiWorkerMirroredStrategy cluster, or
+spawns N local worker processes (single Linux box) with --local-workers.
+
+Usage:
+    # one box, 4 worker processes
+    python distributed_train.py --local-workers 4 --data prepared_data --num-classes 38
+
+    # several hosts: same cluster.json everywhere, a different --task-index per host
+    #   cluster.json: {"worker": ["10.0.0.1:12345", "10.0.0.2:12345", "10.0.0.3:12345"]}
+    python distributed_train.py --cluster cluster.json --task-index 0 --data /shared/prepared_data --num-classes 38
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from distributed import (load_cluster_spec, local_cluster_spec, configure_worker, make_strategy,
+                         load_sharded_tfrecord_dataset, steps_per_epoch, is_chief)
+
+
+def run_worker(args):
+    # TF_CONFIG must be exported and the strategy created before any other TensorFlow op
+    strategy = make_strategy()
+    from train_model import CropDiseaseModel
+
+    model = CropDiseaseModel(args.num_classes, (args.image_size, args.image_size, 3), args.model_type,
+                             use_mixed_precision=not args.no_mixed_precision, strategy=strategy)
+    model.build_model(pretrained=not args.no_pretrained)
+    model.compile_model(learning_rate=args.learning_rate)
+
+    train_dir, val_dir = os.path.join(args.data, 'train'), os.path.join(args.data, 'val')
+    train_ds = load_sharded_tfrecord_dataset(train_dir, args.batch_size, shuffle=True)
+    val_ds = load_sharded_tfrecord_dataset(val_dir, args.batch_size, shuffle=False)
+    model.train(train_ds, val_ds, epochs=args.epochs, output_dir=args.output, fine_tune_at=args.fine_tune_at,
+                steps_per_epoch=steps_per_epoch(train_dir, args.batch_size),
+                validation_steps=steps_per_epoch(val_dir, args.batch_size))
+    if is_chief():
+        model.convert_to_tflite(os.path.join(args.output, f"crop_disease_{args.model_type}.tflite"))
+
+
+def launch_local(args):
+    """Spawn one worker process per local port and wait for all of them."""
+    cluster = local_cluster_spec(args.local_workers, args.base_port)
+    worker_args = list(sys.argv[1:])
+    i = worker_args.index('--local-workers'); del worker_args[i:i + 2]
+    cluster_path = os.path.join(args.output, 'local_cluster.json')
+    os.makedirs(args.output, exist_ok=True)
+    with open(cluster_path, 'w') as f: json.dump(cluster, f)
+
+    print(f"Launching {args.local_workers} local workers: {cluster['worker']}")
+    procs = [subprocess.Popen([sys.executable, __file__, *worker_args, '--cluster', cluster_path, '--task-index', str(i)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+             for i in range(args.local_workers)]
+    codes = [p.wait() for p in procs]
+    if any(codes):
+        raise SystemExit(f"Workers exited with codes {codes}")
+    print("✓ All workers finished")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker CPU training with MultiWorkerMirroredStrategy")
+    parser.add_argument('--data', required=True, help="Directory with train/ and val/ TFRecord shards")
+    parser.add_argument('--num-classes', type=int, required=True)
+    parser.add_argument('--cluster', help="Cluster spec JSON: {\"worker\": [\"host:port\", ...]}")
+    parser.add_argument('--task-index', type=int, default=0, help="This host's index in the worker list")
+    parser.add_argument('--local-workers', type=int, help="Spawn this many workers on localhost instead")
+    parser.add_argument('--base-port', type=int, default=12345)
+    parser.add_argument('--model-type', default='mobilenetv3')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32, help="Per-worker batch size")
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--fine-tune-at', type=int, default=10)
+    parser.add_argument('--learning-rate', type=float, default=0.001)
+    parser.add_argument('--no-pretrained', action='store_true')
+    parser.add_argument('--no-mixed-precision', action='store_true')
+    parser.add_argument('--output', default='models')
+    args = parser.parse_args()
+
+    if args.local_workers:
+        launch_local(args)
+        return
+    if args.cluster:
+        configure_worker(load_cluster_spec(args.cluster), args.task_index)
+    run_worker(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
 import tensorflow as tf
+import numpy as np
+import os
+import re
+import time
 
 def setup_gpu(memory_growth=True):
     gpus = tf.config.list_physical_devices('GPU')
@@ -11,10 +15,141 @@ def setup_gpu(memory_growth=True):
         except RuntimeError as e: print(e)
     return False
 
-def enable_mixed_precision():
-    policy = tf.keras.mixed_precision.Policy('mixed_float16')
-    tf.keras.mixed_precision.set_global_policy(policy)
-    print("✓ Mixed precision (FP16) enabled")
+def configure_cpu_threads(intra_op=0, inter_op=0, cpu_affinity=None):
+    """
+    Set TensorFlow's intra-/inter-op thread pools (0 = TF default) and optionally pin the
+    process to `cpu_affinity` cores. Must run before the first TensorFlow op executes.
+    """
+    if cpu_affinity and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpu_affinity)
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    except RuntimeError as e:
+        print(f"⚠ Thread pools already initialised, keeping defaults: {e}")
+        return False
+    print(f"✓ CPU threads: intra-op {intra_op or 'default'}, inter-op {inter_op or 'default'}"
+          + (f", pinned to cores {list(cpu_affinity)}" if cpu_affinity else ""))
+    return True
+
+def _proc_kb(path, key):
+    with open(path) as f: match = re.search(rf'{key}:\s+(\d+) kB', f.read())
+    return int(match.group(1)) if match else 0
+
+def reset_peak_memory():
+    """Start a new peak-memory window: GPU allocator stats, or the process high-water mark on Linux."""
+    if tf.config.list_physical_devices('GPU'):
+        tf.config.experimental.reset_memory_stats('GPU:0')
+    elif os.path.exists('/proc/self/clear_refs'):
+        try:
+            with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        except OSError: pass
+
+def peak_memory_mb():
+    """Peak GPU:0 allocation, or peak process RSS on CPU, since the last reset_peak_memory()."""
+    if tf.config.list_physical_devices('GPU'):
+        return tf.config.experimental.get_memory_info('GPU:0')['peak'] / 2**20
+    if os.path.exists('/proc/self/status'):
+        return _proc_kb('/proc/self/status', 'VmHWM') / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def host_rss_mb():
+    """Current resident set size of this process (host memory), or None where /proc is unavailable."""
+    if not os.path.exists('/proc/self/status'): return None
+    return _proc_kb('/proc/self/status', 'VmRSS') / 1024
+
+def memory_ceiling_mb():
+    """Memory the process may grow into: None on GPU (found by probing to OOM), else RSS + MemAvailable."""
+    if tf.config.list_physical_devices('GPU') or not os.path.exists('/proc/meminfo'):
+        return None
+    return (_proc_kb('/proc/self/status', 'VmRSS') + _proc_kb('/proc/meminfo', 'MemAvailable')) / 1024
+
+def enable_xla_cache(cache_dir='xla_cache'):
+    """
+    Persist XLA executables in `cache_dir` so later runs reuse compiled training/inference clusters.
+    TensorFlow reads TF_XLA_FLAGS once, when it initialises its devices, so call this at program start.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    flags = [f for f in os.environ.get('TF_XLA_FLAGS', '').split() if not f.startswith('--tf_xla_persistent_cache_directory')]
+    os.environ['TF_XLA_FLAGS'] = ' '.join(flags + [f'--tf_xla_persistent_cache_directory={os.path.abspath(cache_dir)}'])
+    print(f"✓ XLA compilation cache: {os.path.abspath(cache_dir)}")
+
+# Keras policy per compute dtype
+PRECISION_POLICIES = {'float32': 'float32', 'bfloat16': 'mixed_bfloat16', 'float16': 'mixed_float16'}
+# CPU flags that give native (not emulated) low-precision math
+CPU_NATIVE_FLAGS = {'bfloat16': ('avx512_bf16', 'amx_bf16'), 'float16': ('avx512_fp16', 'amx_fp16')}
+_resolved_precision = None
+
+def detect_hardware():
+    """Accelerator and instruction-set support that decides which precisions are native."""
+    gpus = tf.config.list_physical_devices('GPU')
+    info = {'device': 'GPU' if gpus else 'CPU', 'gpus': [], 'cpu_flags': []}
+    for gpu in gpus:
+        details = tf.config.experimental.get_device_details(gpu)
+        info['gpus'].append({'name': details.get('device_name', gpu.name), 'compute_capability': details.get('compute_capability')})
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f: flags = set(re.findall(r'\w+', next((l for l in f if l.startswith('flags')), '')))
+        info['cpu_flags'] = sorted(flag for names in CPU_NATIVE_FLAGS.values() for flag in names if flag in flags)
+    return info
+
+def _native_precisions(hardware):
+    """float16 needs tensor cores (CC >= 7.0), bfloat16 needs Ampere (CC >= 8.0) or CPU bf16 instructions."""
+    if hardware['device'] == 'GPU':
+        capability = min((g['compute_capability'] or (0, 0) for g in hardware['gpus']), default=(0, 0))
+        return [p for p, cc in (('bfloat16', (8, 0)), ('float16', (7, 0))) if tuple(capability) >= cc]
+    return [p for p, flags in CPU_NATIVE_FLAGS.items() if any(f in hardware['cpu_flags'] for f in flags)]
+
+def benchmark_precision(dtype, device, steps=10):
+    """Median ms per (matmul + conv) step in `dtype`, and its max relative error against float32."""
+    size, image = (2048, (16, 56, 56, 64)) if device == 'GPU' else (512, (4, 56, 56, 64))
+    with tf.device(f'/{device}:0'):
+        a, b = tf.random.normal([size, size], seed=1), tf.random.normal([size, size], seed=2)
+        x, k = tf.random.normal(image, seed=3), tf.random.normal([3, 3, 64, 64], seed=4)
+        step = lambda a, b, x, k: (tf.matmul(a, b), tf.nn.conv2d(x, k, 1, 'SAME'))
+        reference = step(a, b, x, k)[0]
+        a, b, x, k = (tf.cast(t, dtype) for t in (a, b, x, k))
+        result = step(a, b, x, k)[0]
+        timings = []
+        for _ in range(steps):
+            start = time.perf_counter()
+            out = step(a, b, x, k); out[0].numpy(); out[1].numpy()
+            timings.append((time.perf_counter() - start) * 1000)
+    error = tf.reduce_max(tf.abs(tf.cast(result, tf.float32) - reference)) / tf.reduce_max(tf.abs(reference))
+    return {'median_ms': float(np.median(timings[1:])), 'max_rel_error': float(error)}
+
+def resolve_precision_policy(min_speedup=1.1, max_rel_error=1e-2):
+    """
+    Benchmark float32 against the natively supported low precisions and pick a Keras policy.
+
+    A low precision is only chosen if it is native on this host, numerically close to float32
+    and at least `min_speedup` times faster; otherwise training stays in float32.
+    """
+    hardware = detect_hardware()
+    candidates = ['float32'] + _native_precisions(hardware)
+    benchmarks = {dtype: benchmark_precision(dtype, hardware['device']) for dtype in candidates}
+    baseline = benchmarks['float32']['median_ms']
+    safe = [d for d in candidates[1:] if benchmarks[d]['max_rel_error'] <= max_rel_error and baseline / benchmarks[d]['median_ms'] >= min_speedup]
+    dtype = min(safe, key=lambda d: benchmarks[d]['median_ms']) if safe else 'float32'
+    return {'policy': PRECISION_POLICIES[dtype], 'hardware': hardware, 'benchmarks': benchmarks}
+
+def enable_mixed_precision(policy='auto'):
+    """
+    Set the global Keras precision policy and return how it was chosen (for run metadata).
+
+    policy: 'auto' resolves (once per process) the fastest numerically safe policy for this
+        hardware; any Keras policy name ('mixed_float16', 'mixed_bfloat16', 'float32') is forced.
+    """
+    global _resolved_precision
+    if policy == 'auto':
+        if _resolved_precision is None: _resolved_precision = resolve_precision_policy()
+        resolution = _resolved_precision
+    else:
+        resolution = {'policy': policy, 'hardware': detect_hardware(), 'benchmarks': None}
+    tf.keras.mixed_precision.set_global_policy(resolution['policy'])
+    timings = ", ".join(f"{d} {b['median_ms']:.1f}ms" for d, b in (resolution['benchmarks'] or {}).items())
+    print(f"✓ Precision policy: {resolution['policy']} on {resolution['hardware']['device']}" + (f" ({timings})" if timings else ""))
+    return resolution
 
 def print_gpu_info():
     gpus = tf.config.list_physical_devices('GPU')
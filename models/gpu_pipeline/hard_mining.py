@@ -0,0 +1,133 @@
+"""
+Hard-Example Mining
+Tracks the latest training loss of every TFRecord sample (keyed by its position in the shard
+manifest) and, after a few uniform warm-up epochs, resamples each epoch in proportion to loss:
+hard examples are repeated, easy ones are skipped before they are even decoded.
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from dataset_processor import parse_tfrecord_example
+from distillation import _read_paths, _split_targets
+
+
+class HardExampleMiner:
+    """
+    Per-sample loss table and sampling counts for the records in `tfrecord_dir`.
+
+    The manifest is the shard files read in sorted order, so record i is the i-th example of
+    the concatenated shards and manifest[i] its source image path.
+
+    budget: samples drawn per mined epoch, as a fraction of the dataset.
+    uniform_mix: share of the sampling mass spread uniformly, so easy samples still get revisited.
+    max_repeats: cap on how often one sample appears in an epoch.
+    """
+
+    def __init__(self, tfrecord_dir: str, warmup_epochs: int = 2, budget: float = 0.5, uniform_mix: float = 0.2,
+                 max_repeats: int = 3, seed: int = 0):
+        self.files = [str(f) for f in sorted(Path(tfrecord_dir).glob("*.tfrecord"))]
+        if not self.files:
+            raise ValueError(f"No .tfrecord files found in {tfrecord_dir}")
+        self.manifest = _read_paths(tfrecord_dir)
+        self.num_records = len(self.manifest)
+        self.warmup_epochs, self.budget, self.uniform_mix, self.max_repeats = warmup_epochs, budget, uniform_mix, max_repeats
+        self.rng = np.random.default_rng(seed)
+        self.losses = tf.Variable(tf.zeros([self.num_records]), trainable=False, name='sample_losses')
+        self.counts = tf.Variable(tf.ones([self.num_records], tf.int32), trainable=False, name='sample_counts')
+        self.epochs: List[Dict] = []
+
+    def dataset(self, batch_size: int = 64, buffer_size: int = 10000,
+                num_parallel_calls: int = tf.data.AUTOTUNE) -> tf.data.Dataset:
+        """(image, (label, record_id)) batches; re-reads `counts` every epoch, dropping zero-count records before decoding."""
+        records = tf.data.Dataset.zip((tf.data.Dataset.range(self.num_records), tf.data.TFRecordDataset(self.files)))
+        records = records.map(lambda i, proto: (i, proto, tf.gather(self.counts, i)))
+        records = records.filter(lambda i, proto, count: count > 0)
+        records = records.flat_map(lambda i, proto, count: tf.data.Dataset.from_tensors((i, proto)).repeat(tf.cast(count, tf.int64)))
+        records = records.shuffle(buffer_size)
+
+        def parse(i, proto):
+            image, label = parse_tfrecord_example(proto)
+            return image, (label, i)
+        return records.map(parse, num_parallel_calls=num_parallel_calls).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def resample(self, epoch: int) -> Dict:
+        """Draw this epoch's per-record counts (uniform during warm-up) and return the epoch's sampling stats."""
+        if epoch < self.warmup_epochs:
+            counts = np.ones(self.num_records, np.int32)
+        else:
+            losses = np.maximum(self.losses.numpy().astype(np.float64), 1e-8)
+            probs = (1 - self.uniform_mix) * losses / losses.sum() + self.uniform_mix / self.num_records
+            expected = np.minimum(self.budget * self.num_records * probs, self.max_repeats)
+            counts = (np.floor(expected) + (self.rng.random(self.num_records) < expected % 1)).astype(np.int32)
+        self.counts.assign(counts)
+        stats = {'epoch': epoch + 1, 'processed': int(counts.sum()), 'skipped': int((counts == 0).sum()),
+                 'repeated': int((counts > 1).sum()), 'mined': epoch >= self.warmup_epochs}
+        self.epochs.append(stats)
+        return stats
+
+    def report(self, top_k: int = 20) -> Dict:
+        """Images processed vs. uniform training over the same epochs, plus the currently hardest samples."""
+        processed = sum(e['processed'] for e in self.epochs)
+        uniform = self.num_records * len(self.epochs)
+        losses = self.losses.numpy()
+        hardest = np.argsort(-losses)[:top_k]
+        return {
+            'num_records': self.num_records, 'epochs': len(self.epochs), 'images_processed': processed,
+            'uniform_images': uniform, 'saved_fraction': 1 - processed / uniform if uniform else 0.0,
+            'per_epoch': self.epochs,
+            'hardest': [{'path': self.manifest[i].decode(), 'loss': float(losses[i])} for i in hardest],
+        }
+
+
+class HardExampleTrainer(keras.Model):
+    """
+    Wraps a model and trains it on (label, record_id) targets, writing each sample's loss into
+    the miner's table. Validation data carries plain labels.
+    """
+
+    def __init__(self, model: keras.Model, miner: HardExampleMiner, **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.miner = miner
+
+    def call(self, inputs, training=False):
+        return self.model(inputs, training=training)
+
+    def compute_loss(self, x=None, y=None, y_pred=None, sample_weight=None, training=True):
+        labels, record_ids = _split_targets(y)
+        per_sample = tf.cast(keras.losses.sparse_categorical_crossentropy(labels, y_pred), tf.float32)
+        if record_ids is not None and training:
+            self.miner.losses.scatter_nd_update(tf.expand_dims(record_ids, -1), per_sample)
+        return tf.reduce_mean(per_sample)
+
+    def compute_metrics(self, x, y, y_pred, sample_weight=None):
+        labels, _ = _split_targets(y)
+        return super().compute_metrics(x, labels, y_pred, sample_weight)
+
+
+class HardExampleSampler(keras.callbacks.Callback):
+    """Resamples the miner's counts before every epoch and logs how many images the epoch will process."""
+
+    def __init__(self, miner: HardExampleMiner):
+        super().__init__()
+        self.miner = miner
+
+    def on_epoch_begin(self, epoch, logs=None):
+        stats = self.miner.resample(epoch)
+        if stats['mined']:
+            print(f"\n[hard mining] epoch {epoch + 1}: {stats['processed']:,}/{self.miner.num_records:,} samples "
+                  f"({stats['skipped']:,} easy skipped, {stats['repeated']:,} hard repeated)")
+
+
+def save_mining_report(miner: HardExampleMiner, path: str, val_accuracy: Optional[float] = None) -> Dict:
+    report = {**miner.report(), 'final_val_accuracy': val_accuracy}
+    with open(path, 'w') as f: json.dump(report, f, indent=2)
+    print(f"\n✓ Processed {report['images_processed']:,} images vs {report['uniform_images']:,} for uniform training "
+          f"({report['saved_fraction']:.0%} fewer); report saved to: {path}")
+    return report
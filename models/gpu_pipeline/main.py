@@ -6,9 +6,14 @@ Complete workflow for processing 400k images and training models
 import os
 import sys
 from pathlib import Path
+from runtime_tuner import load_runtime_profile, apply_runtime_profile, calibrate_runtime
+
+# Apply this host's calibrated CPU profile before TensorFlow initialises its thread pools
+RUNTIME_PROFILE = apply_runtime_profile(load_runtime_profile('train', 'mobilenetv3'))
+
 from gpu_utils import setup_gpu, print_gpu_info, test_gpu_computation
 from dataset_processor import CropDiseaseDatasetProcessor
-from train_model import CropDiseaseModel, prepare_training_data
+from train_model import CropDiseaseModel, prepare_training_data, load_tfrecord_dataset
 
 def check_environment():
     print("=" * 70); print("ENVIRONMENT CHECK"); print("=" * 70)
@@ -24,7 +29,7 @@ def main():
     has_gpu = check_environment()
     while True:
         print("\n" + "=" * 70); print("CROP DISEASE DETECTION - GPU TRAINING SYSTEM"); print("=" * 70)
-        print("1. Batch process images"); print("2. Convert to TFRecord"); print("3. Train model"); print("4. Run inference"); print("0. Exit")
+        print("1. Batch process images"); print("2. Convert to TFRecord"); print("3. Train model"); print("4. Run inference"); print("5. Tune CPU runtime"); print("0. Exit")
         choice = input("\nEnter choice: ").strip()
         
         if choice == '1':
@@ -43,11 +48,21 @@ def main():
         elif choice == '3':
             data_dir = input("Enter dataset dir: ").strip()
             if Path(data_dir).exists():
+                max_batch, parallel_calls = (RUNTIME_PROFILE['batch_size'], RUNTIME_PROFILE['num_parallel_calls']) if RUNTIME_PROFILE else (512, -1)
                 train_ds, val_ds, n_classes, names = prepare_training_data(data_dir, "prepared_data")
                 model = CropDiseaseModel(n_classes, model_type='mobilenetv3')
                 model.build_model(); model.compile_model()
+                plan = model.find_batch_size(target_batch_size=64, max_batch_size=max_batch)
+                train_ds = load_tfrecord_dataset("prepared_data/train", plan['batch_size'], shuffle=True, num_parallel_calls=parallel_calls)
+                val_ds = load_tfrecord_dataset("prepared_data/val", plan['batch_size'], shuffle=False, num_parallel_calls=parallel_calls)
                 model.train(train_ds, val_ds)
                 model.convert_to_tflite('models/crop_disease.tflite')
+        elif choice == '5':
+            tfrecord_dir = input("Enter training TFRecord dir: ").strip()
+            n_classes = int(input("Number of classes: ").strip())
+            if Path(tfrecord_dir).exists():
+                calibrate_runtime(tfrecord_dir, n_classes, model_type='mobilenetv3')
+                print("Restart to apply the new thread settings.")
         elif choice == '0': break
 
 if __name__ == "__main__":
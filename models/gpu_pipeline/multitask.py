@@ -0,0 +1,174 @@
+"""
+Multi-Task Crop Model
+One backbone shared by the leaf-vs-random, disease and grain-variety heads, so the app runs one
+forward pass and loads one TFLite file instead of three. Each task keeps its own dataset; the
+streams are interleaved into mixed batches where every row carries a label for its own task only
+and a zero sample weight on the other heads (masked losses).
+"""
+
+import functools
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+from dataset_processor import pad_batch
+from distributed import is_chief
+from train_model import CropDiseaseModel, prepare_training_data
+
+# Head names match the single-task assets (models/assets/<name>.tflite) and src/tflite_runner.MODEL_LABELS
+LEAF_CHECK, DISEASE, GRAIN = 'leaf_check', 'disease_detection', 'grain_quality'
+TASKS = (LEAF_CHECK, DISEASE, GRAIN)
+
+
+class MultiTaskCropModel(CropDiseaseModel):
+    """
+    CropDiseaseModel with one softmax head per task on a shared backbone.
+
+    task_classes: head name -> number of classes, e.g. {'leaf_check': 2, 'disease_detection': 38, 'grain_quality': 5}.
+        The leaf check is a two-class softmax head ('leaf', 'random') instead of the single-task sigmoid.
+    loss_weights: optional per-head weights of the summed loss.
+    class_names: optional head name -> labels, written to the head manifest on export.
+
+    num_classes is the total over all heads; the per-head counts stay in task_classes.
+
+    Train with (image, labels, weights) batches from multitask_dataset(). Progressive resizing, QAT and
+    MultiWorkerMirroredStrategy (whose custom loop in distributed.py has a single loss) are single-output
+    only; XLA, fine-tuning and every TFLite variant work as usual.
+    """
+
+    monitor = ('val_loss', 'min')
+
+    def __init__(self, task_classes: Dict[str, int], input_shape: Tuple[int, int, int] = (224, 224, 3),
+                 model_type: str = 'mobilenetv3', use_mixed_precision: bool = True,
+                 strategy: Optional[tf.distribute.Strategy] = None, loss_weights: Optional[Dict[str, float]] = None,
+                 class_names: Optional[Dict[str, List[str]]] = None):
+        super().__init__(sum(task_classes.values()), input_shape, model_type, use_mixed_precision, strategy)
+        if isinstance(self.strategy, tf.distribute.MultiWorkerMirroredStrategy):
+            raise ValueError("Multi-task models cannot train under MultiWorkerMirroredStrategy: fit_multi_worker "
+                             "has no per-head masked losses; train on one worker")
+        self.task_classes = dict(task_classes)
+        self.loss_weights = {task: (loss_weights or {}).get(task, 1.0) for task in self.task_classes}
+        self.class_names = class_names or {}
+
+    def _classifier_head(self, x, default_dropout: float):
+        if self.head_units: x = layers.Dense(self.head_units, activation='relu')(x)
+        outputs = {}
+        for task, num_classes in self.task_classes.items():
+            h = layers.Dropout(default_dropout if self.dropout is None else self.dropout, name=f"{task}_dropout")(x)
+            outputs[task] = layers.Dense(num_classes, activation='softmax', dtype='float32', name=task)(h)
+        return outputs
+
+    def _loss_and_metrics(self, metrics):
+        # Rows of other tasks carry weight 0: each head averages over its own rows, and a head
+        # with no rows in the batch contributes 0 instead of NaN
+        compiled = {'loss': {task: keras.losses.SparseCategoricalCrossentropy(reduction='mean_with_sample_weight')
+                             for task in self.task_classes},
+                    'loss_weights': self.loss_weights,
+                    'weighted_metrics': {task: ['accuracy'] for task in self.task_classes}}
+        if self.jit_compile: compiled['jit_compile'] = True
+        return compiled
+
+    def _fixed_shape(self, dataset, batch_size: Optional[int] = None):
+        """Under XLA, pad the last batch; padding rows get weight 0 on every head."""
+        if not self.jit_compile: return dataset
+        batch_size = batch_size or (self.batch_plan['batch_size'] if self.batch_plan else int(next(iter(dataset))[0].shape[0]))
+        pad = functools.partial(pad_batch, batch_size=batch_size)
+        return dataset.map(lambda images, labels, weights: (pad(images), tf.nest.map_structure(pad, labels),
+                                                           tf.nest.map_structure(pad, weights)),
+                           num_parallel_calls=tf.data.AUTOTUNE)
+
+    def _probe_batch(self, batch_size: int):
+        """Mixed batch as from multitask_dataset: rows cycle through the tasks, each weighted on its own head only."""
+        rows = tf.range(batch_size) % len(self.task_classes)
+        labels = {task: tf.random.uniform((batch_size,), maxval=num_classes, dtype=tf.int64)
+                  for task, num_classes in self.task_classes.items()}
+        weights = {task: tf.cast(rows == i, tf.float32) for i, task in enumerate(self.task_classes)}
+        return tf.random.uniform((batch_size, *self.input_shape)), labels, weights
+
+    def _save_run_metadata(self, path: Path, **run_config):
+        super()._save_run_metadata(path, task_classes=self.task_classes, loss_weights=self.loss_weights, **run_config)
+
+    def train(self, train_dataset, val_dataset, epochs=20, output_dir='models', fine_tune_at=10, progressive_schedule=None,
+              qat_epochs=0, **kwargs):
+        """CropDiseaseModel.train on (image, labels, weights) batches; best checkpoint and early stopping follow val_loss."""
+        if progressive_schedule or qat_epochs:
+            raise ValueError("Progressive resizing and QAT are not supported for multi-task models")
+        return super().train(train_dataset, val_dataset, epochs=epochs, output_dir=output_dir, fine_tune_at=fine_tune_at, **kwargs)
+
+    def convert_to_tflite(self, output_path: str, quantize: bool = True, calibration_dataset=None):
+        """One TFLite model with an output per head, plus <output>.heads.json mapping each head to its output index."""
+        super().convert_to_tflite(output_path, quantize, calibration_dataset)
+        if is_chief(): write_head_manifest(output_path, self.task_classes, self.class_names)
+
+
+def _tag_task(task: str, tasks: Sequence[str]):
+    """(image, label) -> (image, labels, weights) with the label on `task` and zero weight on every other head."""
+    def tag(image, label):
+        labels = {t: tf.cast(label, tf.int64) if t == task else tf.constant(0, tf.int64) for t in tasks}
+        weights = {t: tf.constant(1.0 if t == task else 0.0) for t in tasks}
+        return image, labels, weights
+    return tag
+
+
+def multitask_dataset(streams: Dict[str, tf.data.Dataset], batch_size: int = 64, weights: Optional[Dict[str, float]] = None,
+                      shuffle: bool = True, seed: Optional[int] = None) -> tf.data.Dataset:
+    """
+    Interleave per-task batched (image, label) datasets (e.g. load_tfrecord_dataset per task) into
+    (image, labels, weights) batches for MultiTaskCropModel. Every stream must yield the same image size.
+
+    weights: sampling share per task (default uniform). Streams are read to the end, so once a small
+        task runs out the rest of the epoch comes from the others. shuffle=False takes one row per
+        task in turn instead (deterministic, for validation), so per-head metrics average over mixed batches.
+    """
+    tasks = list(streams)
+    tagged = [streams[t].unbatch().map(_tag_task(t, tasks), num_parallel_calls=tf.data.AUTOTUNE) for t in tasks]
+    if shuffle:
+        shares = [float((weights or {}).get(t, 1.0)) for t in tasks]
+        mixed = tf.data.Dataset.sample_from_datasets(tagged, [s / sum(shares) for s in shares], seed=seed,
+                                                     stop_on_empty_dataset=False)
+    else:
+        mixed = tf.data.Dataset.choose_from_datasets(tagged, tf.data.Dataset.range(len(tagged)).repeat(),
+                                                     stop_on_empty_dataset=False)
+    return mixed.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def prepare_multitask_data(raw_data_dirs: Dict[str, str], output_dir: str, val_split: float = 0.2, batch_size: int = 64,
+                           weights: Optional[Dict[str, float]] = None):
+    """
+    prepare_training_data for each task's class-folder directory (TFRecords under <output_dir>/<task>),
+    then mix the streams. Returns (train_ds, val_ds, task_classes, class_names).
+    """
+    train_streams, val_streams, task_classes, class_names = {}, {}, {}, {}
+    for task, raw_dir in raw_data_dirs.items():
+        print(f"\n[{task}]")
+        train_streams[task], val_streams[task], task_classes[task], class_names[task] = prepare_training_data(
+            raw_dir, str(Path(output_dir) / task), val_split=val_split, batch_size=batch_size)
+    return (multitask_dataset(train_streams, batch_size, weights), multitask_dataset(val_streams, batch_size, shuffle=False),
+            task_classes, class_names)
+
+
+def tflite_head_indices(tflite_model: bytes) -> Dict[str, int]:
+    """Head name -> position in get_output_details(), read from the model's serving signature."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model)
+    positions = {detail['index']: i for i, detail in enumerate(interpreter.get_output_details())}
+    signature = interpreter.get_signature_runner()
+    return {name: positions[detail['index']] for name, detail in signature.get_output_details().items()}
+
+
+def write_head_manifest(tflite_path: str, task_classes: Dict[str, int], class_names: Optional[Dict[str, List[str]]] = None) -> Dict:
+    """
+    Write <tflite_path>.heads.json: for each head, its output index, class count and labels. TFLite
+    orders outputs by tensor, not by head, so apps should look heads up here (or use the signature runner).
+    """
+    indices = tflite_head_indices(Path(tflite_path).read_bytes())
+    manifest = {'model': Path(tflite_path).name, 'signature': 'serving_default', 'heads': {
+        task: {'output_index': indices[task], 'num_classes': num_classes, 'labels': (class_names or {}).get(task)}
+        for task, num_classes in task_classes.items()}}
+    manifest_path = f"{tflite_path}.heads.json"
+    with open(manifest_path, 'w') as f: json.dump(manifest, f, indent=2)
+    print(f"✓ Head manifest saved to: {manifest_path}")
+    return manifest
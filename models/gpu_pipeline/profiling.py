@@ -0,0 +1,119 @@
+"""
+Training Throughput Profiler
+Keras callback that splits every train step into time blocked on the input iterator and time in
+the compiled train step, tracks images/sec and host RSS, optionally captures a TensorFlow profiler
+trace for a step window, and writes a JSON summary with an input-bound / compute-bound verdict per epoch.
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from gpu_utils import host_rss_mb
+
+
+class ThroughputProfiler(keras.callbacks.Callback):
+    """
+    Per-step timing for model.fit (steps_per_execution=1).
+
+    Keras fetches the next batch inside its compiled train function, so the callback wraps that
+    function: the batch is pulled from the iterator in Python (input wait) and then handed to
+    Keras's own compiled step (compute). The first step of every fit() includes tracing and is excluded.
+
+    output_dir: where profile_epoch_NNN.json summaries go.
+    trace_steps: optional (first, last) global step window to capture with tf.profiler into
+        `trace_dir` (view in TensorBoard's Profile tab).
+    input_bound_threshold: fraction of step time spent waiting on input above which an epoch
+        is reported as input-bound.
+    """
+
+    def __init__(self, output_dir: str, trace_steps: Optional[Tuple[int, int]] = None, trace_dir: Optional[str] = None,
+                 input_bound_threshold: float = 0.2):
+        super().__init__()
+        self.output_dir = Path(output_dir)
+        self.trace_steps = trace_steps
+        self.trace_dir = str(trace_dir or self.output_dir / 'trace')
+        self.input_bound_threshold = input_bound_threshold
+        self.summaries = []
+        self._global_step = 0
+        self._tracing = False
+        self._train_function = None
+        self._warmup = True
+
+    def on_train_begin(self, logs=None):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self._warmup = True
+        self._train_function = self.model.train_function
+        if self._train_function is not None:
+            self.model.train_function = self._timed_train_function
+
+    def _timed_train_function(self, iterator):
+        start = time.perf_counter()
+        data = next(iterator)
+        fetched = time.perf_counter()
+        # A list is not a tf.data iterator, so Keras runs its compiled one-step function on it directly
+        outputs = self._train_function([data])
+        tf.nest.flatten(outputs)[0].numpy()  # wait for the step to finish
+        self._step.update(input_s=fetched - start, compute_s=time.perf_counter() - fetched,
+                          images=int(tf.nest.flatten(data)[0].shape[0]))
+        return outputs
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._records = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and self._global_step == self.trace_steps[0] and not self._tracing:
+            tf.profiler.experimental.start(self.trace_dir)
+            self._tracing = True
+        self._step = {'start': time.perf_counter()}
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step['wall_s'] = time.perf_counter() - self._step.pop('start')
+        if not self._warmup: self._records.append(self._step)
+        self._warmup = False
+        if self._tracing and self._global_step >= self.trace_steps[1]:
+            self._stop_trace()
+        self._global_step += 1
+
+    def _stop_trace(self):
+        tf.profiler.experimental.stop()
+        self._tracing = False
+        print(f"✓ Profiler trace for steps {self.trace_steps[0]}-{self.trace_steps[1]} saved to: {self.trace_dir}")
+
+    def on_epoch_end(self, epoch, logs=None):
+        summary = self.summarize(epoch)
+        if summary is None: return
+        self.summaries.append(summary)
+        with open(self.output_dir / f"profile_epoch_{epoch + 1:03d}.json", 'w') as f: json.dump(summary, f, indent=2)
+        if 'input_fraction' in summary:
+            print(f"\n[profile] epoch {epoch + 1}: {summary['images_per_sec']:.1f} img/s, step {summary['step_ms']['median']:.1f} ms "
+                  f"(input wait {summary['input_ms']['mean']:.1f} ms / compute {summary['compute_ms']['mean']:.1f} ms, "
+                  f"{summary['input_fraction']:.0%} waiting), RSS {summary['rss_mb']:.0f} MB -> {summary['verdict'].upper()}")
+
+    def summarize(self, epoch: int) -> Optional[Dict]:
+        if not self._records: return None
+        wall = np.array([r['wall_s'] for r in self._records]) * 1000
+        stats = lambda ms: {'mean': float(ms.mean()), 'median': float(np.median(ms)), 'p90': float(np.percentile(ms, 90))}
+        summary = {'epoch': epoch + 1, 'steps': len(wall), 'step_ms': stats(wall), 'rss_mb': host_rss_mb()}
+        if 'input_s' not in self._records[0]:
+            return summary  # custom training loop: only wall times are available
+        input_ms = np.array([r['input_s'] for r in self._records]) * 1000
+        compute_ms = np.array([r['compute_s'] for r in self._records]) * 1000
+        images = sum(r['images'] for r in self._records)
+        input_fraction = float(input_ms.sum() / wall.sum())
+        summary.update({
+            'input_ms': stats(input_ms), 'compute_ms': stats(compute_ms),
+            'images_per_sec': images / (wall.sum() / 1000), 'input_fraction': input_fraction,
+            'verdict': 'input-bound' if input_fraction >= self.input_bound_threshold else 'compute-bound',
+        })
+        return summary
+
+    def on_train_end(self, logs=None):
+        if self._tracing: self._stop_trace()
+        if self._train_function is not None:
+            self.model.train_function = self._train_function
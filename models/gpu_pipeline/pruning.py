@@ -0,0 +1,162 @@
+"""
+Pruning for the on-device models
+Magnitude (per-weight) and structured (per-output-channel) pruning on a polynomial
+sparsity schedule during fine-tuning, removal of pruned Dense units, plus sparsity
+reporting for the TFLite export.
+"""
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from typing import Dict, List, Tuple
+
+PRUNING_MODES = ('magnitude', 'channel')
+
+
+def prunable_layers(model: keras.Model, mode: str = 'magnitude') -> List[layers.Layer]:
+    """
+    Conv/Dense layers (recursing into nested backbones) whose kernels get pruned.
+
+    The final classifier is left dense; channel mode also skips depthwise convs, whose
+    channels follow the pointwise conv that feeds them.
+    """
+    kinds = (layers.Conv2D, layers.Dense) if mode == 'channel' else (layers.Conv2D, layers.DepthwiseConv2D, layers.Dense)
+    found = []
+
+    def walk(parent):
+        for layer in parent.layers:
+            if isinstance(layer, keras.Model): walk(layer)
+            elif isinstance(layer, kinds): found.append(layer)
+
+    walk(model)
+    return [l for l in found if l is not model.layers[-1]]
+
+
+def polynomial_sparsity(step: float, total_steps: float, initial: float, final: float, power: int = 3) -> float:
+    """Sparsity ramp used by tfmot's PolynomialDecay: fast early, flat near the target (`final` at once if total_steps <= 0)."""
+    progress = 1.0 if total_steps <= 0 else min(max(step / total_steps, 0.0), 1.0)
+    return final + (initial - final) * (1 - progress) ** power
+
+
+def _compute_mask(kernel: np.ndarray, sparsity: float, mode: str) -> np.ndarray:
+    if sparsity <= 0:
+        return np.ones_like(kernel)
+    if mode == 'channel':
+        # L2 norm per output channel (last axis for both Conv2D and Dense kernels)
+        norms = np.sqrt(np.sum(kernel.reshape(-1, kernel.shape[-1]) ** 2, axis=0))
+        keep = norms > np.quantile(norms, sparsity)
+        return np.broadcast_to(keep, kernel.shape).astype(kernel.dtype)
+    threshold = np.quantile(np.abs(kernel), sparsity)
+    return (np.abs(kernel) > threshold).astype(kernel.dtype)
+
+
+class PruningCallback(keras.callbacks.Callback):
+    """
+    Keeps the smallest weights (or channels) of every prunable layer at zero.
+
+    Sparsity ramps from `initial_sparsity` at the first step to `final_sparsity` after
+    `ramp_epochs` epochs (masks recomputed every `update_every` steps while ramping, per epoch
+    when the step count is unknown) and stays there. Masks are re-applied after every batch,
+    since the optimizer would otherwise revive pruned weights.
+    """
+
+    def __init__(self, target_model: keras.Model, final_sparsity: float, initial_sparsity: float = 0.0,
+                 ramp_epochs: int = 1, mode: str = 'magnitude', update_every: int = 100):
+        super().__init__()
+        if mode not in PRUNING_MODES: raise ValueError(f"Unknown pruning mode: {mode}")
+        self.layers = prunable_layers(target_model, mode)
+        self.final_sparsity = final_sparsity
+        self.initial_sparsity = initial_sparsity
+        self.ramp_epochs = ramp_epochs
+        self.mode = mode
+        self.update_every = update_every
+        self.masks, self.sparsity, self.epoch = {}, None, 0
+
+    def _set_sparsity(self, sparsity: float):
+        if sparsity == self.sparsity: return
+        self.sparsity = sparsity
+        self.masks = {id(l): _compute_mask(l.kernel.numpy(), sparsity, self.mode) for l in self.layers}
+        self._apply_masks()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self._set_sparsity(polynomial_sparsity(epoch, self.ramp_epochs, self.initial_sparsity, self.final_sparsity))
+        end = polynomial_sparsity(epoch + 1, self.ramp_epochs, self.initial_sparsity, self.final_sparsity)
+        print(f"\n  Pruning ({self.mode}): sparsity {self.sparsity:.2f}" + (f" -> {end:.2f}" if end != self.sparsity else ""))
+
+    def on_train_batch_begin(self, batch, logs=None):
+        steps = self.params.get('steps')
+        if steps and self.epoch < self.ramp_epochs and batch % self.update_every == 0:
+            self._set_sparsity(polynomial_sparsity(self.epoch + batch / steps, self.ramp_epochs,
+                                                   self.initial_sparsity, self.final_sparsity))
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._apply_masks()
+
+    def on_train_end(self, logs=None):
+        self._apply_masks()
+
+    def _apply_masks(self):
+        for layer in self.layers:
+            mask = self.masks.get(id(layer))
+            if mask is None: continue
+            layer.kernel.assign(layer.kernel * mask)
+            if self.mode == 'channel' and getattr(layer, 'bias', None) is not None:
+                layer.bias.assign(layer.bias * mask.reshape(-1, mask.shape[-1])[0])
+
+
+def _sole_consumer(layer: layers.Layer):
+    nodes = layer._outbound_nodes
+    return nodes[0].operation if len(nodes) == 1 else None
+
+
+def remove_pruned_units(model: keras.Model) -> Tuple[keras.Model, Dict[str, int]]:
+    """
+    Copy of `model` with the channel-pruned units of its top-level Dense layers cut out, and the
+    matching input rows of the Dense layer they feed (directly or through Dropout).
+
+    A unit is removed when its kernel column and bias are zero and the activation maps 0 to 0, so
+    the copy computes the same outputs with fewer parameters. Conv channels stay zeroed in place:
+    BatchNorm, residual adds and squeeze-excite blocks would all have to be cut with them.
+    Returns (model, {layer name: units removed}); `model` itself when nothing can be removed.
+    """
+    keep_out, keep_in = {}, {}
+    for layer in model.layers:
+        if not isinstance(layer, layers.Dense) or layer.name in keep_out: continue
+        keep = np.any(layer.kernel.numpy() != 0, axis=0)
+        if layer.use_bias: keep |= layer.bias.numpy() != 0
+        if keep.all() or not keep.any(): continue
+        if float(np.asarray(layer.activation(tf.zeros(1)))[0]) != 0: continue
+        consumer = _sole_consumer(layer)
+        while isinstance(consumer, layers.Dropout): consumer = _sole_consumer(consumer)
+        if isinstance(consumer, layers.Dense):
+            keep_out[layer.name], keep_in[consumer.name] = keep, keep
+    if not keep_out: return model, {}
+
+    def clone(layer):
+        config = layer.get_config()
+        if layer.name in keep_out: config['units'] = int(keep_out[layer.name].sum())
+        return layer.__class__.from_config(config)
+
+    compact = keras.models.clone_model(model, clone_function=clone)
+    for layer, copy in zip(model.layers, compact.layers):  # same order; only input layer names differ
+        weights = layer.get_weights()
+        if layer.name in keep_in: weights[0] = weights[0][keep_in[layer.name]]
+        if layer.name in keep_out: weights = [w[..., keep_out[layer.name]] for w in weights]
+        copy.set_weights(weights)
+    for old, new in zip(model._flatten_layers(), compact._flatten_layers()): new.trainable = old.trainable
+    return compact, {name: int((~keep).sum()) for name, keep in keep_out.items()}
+
+
+def sparsity_report(model: keras.Model, mode: str = 'magnitude') -> Dict[str, float]:
+    """Parameter counts and the achieved sparsity of the pruned kernels."""
+    kernels = [l.kernel.numpy() for l in prunable_layers(model, mode)]
+    pruned_params = sum(k.size for k in kernels)
+    zeros = sum(int(np.sum(k == 0)) for k in kernels)
+    total = model.count_params()
+    return {
+        'total_params': int(total),
+        'nonzero_params': int(total - zeros),
+        'kernel_sparsity': float(zeros / pruned_params) if pruned_params else 0.0,
+    }
@@ -0,0 +1,179 @@
+"""
+Quantization for the on-device models
+- Quantization-Aware Training (QAT): fine-tunes with simulated int8 activations so the
+  full-integer TFLite export keeps float accuracy.
+- TFLite export variants (float32 / float16 / dynamic range / full int8) used by
+  CropDiseaseModel, the src/ training scripts and quantization_workbench.py.
+"""
+
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+import tempfile
+
+# Layers whose outputs TFLite materialises as int8 tensors (after BN folding / activation fusion)
+QUANTIZED_OUTPUT_LAYERS = (
+    layers.BatchNormalization, layers.ReLU, layers.Activation, layers.Add, layers.Multiply,
+    layers.Dense, layers.GlobalAveragePooling2D, layers.MaxPooling2D, layers.Rescaling
+)
+
+
+class ActivationFakeQuant(layers.Layer):
+    """
+    Simulates int8 quantization of a tensor with moving-average min/max ranges.
+
+    The ranges are learned during QAT fine-tuning and become the tensor's quantization
+    parameters when the converter lowers the FakeQuant op to TFLite.
+    """
+
+    def __init__(self, momentum: float = 0.99, **kwargs):
+        super().__init__(**kwargs)
+        self.momentum = momentum
+
+    def build(self, input_shape):
+        self.range_min = self.add_weight(name='range_min', shape=(), initializer='zeros', trainable=False)
+        self.range_max = self.add_weight(name='range_max', shape=(), initializer='zeros', trainable=False)
+        self.observed = self.add_weight(name='observed', shape=(), initializer='zeros', trainable=False)
+
+    def call(self, inputs, training=None):
+        x = tf.cast(inputs, tf.float32)
+        if training:
+            momentum = tf.where(self.observed > 0, self.momentum, 0.0)  # first batch initialises the range
+            self.range_min.assign(momentum * self.range_min + (1 - momentum) * tf.minimum(tf.reduce_min(x), 0.0))
+            self.range_max.assign(momentum * self.range_max + (1 - momentum) * tf.maximum(tf.reduce_max(x), 0.0))
+            self.observed.assign(1.0)
+        x = tf.quantization.fake_quant_with_min_max_vars(x, self.range_min, self.range_max, num_bits=8)
+        return tf.cast(x, inputs.dtype)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'momentum': self.momentum})
+        return config
+
+
+def quantize_aware_model(model: keras.Model) -> keras.Model:
+    """
+    Return a QAT view of `model` with fake-quant ops after every int8 tensor boundary.
+
+    Layers (and weights) are shared with `model`, so QAT fine-tuning updates it in place;
+    nested backbones such as MobileNetV3 are rewritten recursively.
+    """
+    def insert_fake_quant(layer, *args, **kwargs):
+        outputs = layer(*args, **kwargs)
+        if isinstance(layer, QUANTIZED_OUTPUT_LAYERS):
+            outputs = ActivationFakeQuant(name=f"{layer.name}_fake_quant")(outputs)
+        return outputs
+
+    inputs = keras.Input(shape=model.input_shape[1:])
+    quant_input = ActivationFakeQuant(name='input_fake_quant')(inputs)
+    body = keras.models.clone_model(model, clone_function=lambda layer: layer, call_function=insert_fake_quant, recursive=True)
+    return keras.Model(inputs, body(quant_input), name=f"{model.name}_qat")
+
+
+def fine_tune_qat(model: keras.Model,
+                  train_dataset,
+                  val_dataset=None,
+                  epochs: int = 3,
+                  learning_rate: float = 1e-5,
+                  loss: str = 'sparse_categorical_crossentropy',
+                  steps_per_epoch: Optional[int] = None) -> keras.Model:
+    """Insert fake-quant ops into `model` and fine-tune the whole network for a few epochs."""
+    qat_model = quantize_aware_model(model)
+    qat_model.trainable = True
+    qat_model.compile(optimizer=keras.optimizers.Adam(learning_rate=learning_rate), loss=loss, metrics=['accuracy'])
+    print(f"\nQAT fine-tuning for {epochs} epochs (lr={learning_rate})...")
+    qat_model.fit(train_dataset, validation_data=val_dataset, epochs=epochs, steps_per_epoch=steps_per_epoch)
+    return qat_model
+
+
+def representative_dataset_from(dataset, num_samples: int = 100) -> Callable[[], Iterable]:
+    """Build a converter representative_dataset from batches of (image, label, ...)."""
+    def generator():
+        seen = 0
+        for batch in dataset:
+            for image in batch[0]:
+                if seen >= num_samples: return
+                yield [tf.cast(image[tf.newaxis], tf.float32)]
+                seen += 1
+    return generator
+
+
+# TFLite export variants: name -> (optimize, supported_types, full-int8 ops, I/O dtype)
+TFLITE_VARIANTS = {
+    'float32': (False, None, False, None),
+    'float16': (True, [tf.float16], False, None),
+    'dynamic_range': (True, None, False, None),
+    'int8_float_io': (True, None, True, tf.float32),
+    'int8_uint8_io': (True, None, True, tf.uint8),
+    'int8_int8_io': (True, None, True, tf.int8),
+}
+
+
+def convert_variant(model: keras.Model, variant: str,
+                    representative_dataset: Optional[Callable[[], Iterable]] = None,
+                    sparse: bool = False) -> bytes:
+    """
+    Convert `model` to one of TFLITE_VARIANTS and return the flatbuffer.
+
+    Full-int8 variants need a representative dataset. `sparse` stores pruned (zeroed)
+    weights in TFLite's sparse format. Conversion goes through a SavedModel
+    export because `from_keras_model` cannot full-int8 quantize Keras 3 models on TF 2.16.
+    """
+    if variant not in TFLITE_VARIANTS:
+        raise ValueError(f"Unknown TFLite variant: {variant} (expected one of {list(TFLITE_VARIANTS)})")
+    optimize, supported_types, full_int8, io_type = TFLITE_VARIANTS[variant]
+    if full_int8 and representative_dataset is None:
+        raise ValueError(f"Variant '{variant}' needs a representative dataset")
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        model.export(export_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(export_dir)
+        if optimize:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if sparse:
+            converter.optimizations = list(converter.optimizations) + [tf.lite.Optimize.EXPERIMENTAL_SPARSITY]
+        if supported_types:
+            converter.target_spec.supported_types = supported_types
+        if full_int8:
+            converter.representative_dataset = representative_dataset
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = io_type
+            converter.inference_output_type = io_type
+        return converter.convert()
+
+
+def convert_smallest(model: keras.Model, variant: str,
+                     representative_dataset: Optional[Callable[[], Iterable]] = None) -> Tuple[bytes, Dict]:
+    """
+    Convert a pruned `model` with dense and with sparse weight storage and return the smaller
+    flatbuffer plus both sizes. The sparse format stores indices next to the values, so it only
+    pays off at high sparsity (around 75% for MobileNetV3); below that it makes the file bigger.
+    """
+    dense = convert_variant(model, variant, representative_dataset)
+    sparse = convert_variant(model, variant, representative_dataset, sparse=True)
+    encoding = 'sparse' if len(sparse) < len(dense) else 'dense'
+    sizes = {'dense_kb': round(len(dense) / 1024, 1), 'sparse_kb': round(len(sparse) / 1024, 1), 'encoding': encoding}
+    return (sparse if encoding == 'sparse' else dense), sizes
+
+
+def save_tflite(tflite_model: bytes, output_path: str):
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'wb') as f: f.write(tflite_model)
+
+
+def convert_qat_to_tflite(qat_model: keras.Model,
+                          representative_dataset: Callable[[], Iterable],
+                          output_path: str,
+                          int8_io: bool = False) -> bytes:
+    """
+    Export a QAT model as a full-integer (TFLITE_BUILTINS_INT8) TFLite model.
+
+    Fake-quant ranges fix the activation scales; the representative dataset only covers
+    tensors without one.
+    """
+    tflite_model = convert_variant(qat_model, 'int8_int8_io' if int8_io else 'int8_float_io', representative_dataset)
+    save_tflite(tflite_model, output_path)
+    print(f"✓ Full-integer QAT TFLite model saved to: {output_path} ({len(tflite_model) / 1024:.0f} KB)")
+    return tflite_model
@@ -0,0 +1,251 @@
+"""
+Quantization Workbench
+Builds every TFLite variant of a .keras model and measures file size, invoke latency and
+agreement with the float model, so the shipped variant is chosen on measurements.
+
+Usage:
+    python quantization_workbench.py --model ../assets/best_disease_model.keras --data ../datasets/raw
+"""
+
+import argparse
+import hashlib
+import json
+import platform
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+import tensorflow as tf
+
+from quantization import TFLITE_VARIANTS, convert_variant, save_tflite
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DEFAULT_VARIANTS = ['float32', 'float16', 'dynamic_range', 'int8_float_io', 'int8_uint8_io']
+DEFAULT_THREADS = (1, 2, 4)
+
+
+def _load_image(path: str, image_size: int) -> np.ndarray:
+    image = tf.image.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, (image_size, image_size))
+    return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8).numpy()
+
+
+def build_calibration_set(data_dir: str,
+                          cache_path: str,
+                          image_size: int = 224,
+                          calib_per_class: int = 8,
+                          eval_per_class: int = 4,
+                          seed: int = 123) -> Dict[str, np.ndarray]:
+    """
+    Sample a class-stratified calibration split plus a disjoint evaluation split.
+
+    Images are stored resized as uint8 in a compressed .npz and reused on later runs,
+    so every variant and every run is calibrated and scored on the same images. The cache
+    records a fingerprint of the data directory, class list and sampling settings and is
+    rebuilt when they change.
+    """
+    cache_path = Path(cache_path)
+    class_dirs = sorted(d for d in Path(data_dir).iterdir() if d.is_dir())
+    if not class_dirs:
+        raise ValueError(f"No class folders found in {data_dir}")
+    source = hashlib.sha256(json.dumps([str(Path(data_dir).resolve()), [d.name for d in class_dirs], image_size,
+                                        calib_per_class, eval_per_class, seed]).encode()).hexdigest()[:16]
+    if cache_path.exists():
+        cached = dict(np.load(cache_path))
+        if str(cached.get('source', '')) == source:
+            print(f"✓ Reusing calibration set: {cache_path}")
+            return cached
+        print(f"Calibration set {cache_path.name} was built from other data, rebuilding...")
+
+    rng = np.random.default_rng(seed)
+
+    splits = {'calib': ([], []), 'eval': ([], [])}
+    for label, class_dir in enumerate(class_dirs):
+        files = sorted(str(f) for f in class_dir.rglob('*') if f.suffix.lower() in IMAGE_EXTENSIONS)
+        for i, path in enumerate(rng.permutation(files)[:calib_per_class + eval_per_class]):
+            images, labels = splits['calib' if i < calib_per_class else 'eval']
+            images.append(_load_image(path, image_size)); labels.append(label)
+
+    data = {'class_names': np.array([d.name for d in class_dirs]), 'source': np.array(source)}
+    for split, (images, labels) in splits.items():
+        data[f'{split}_images'] = np.stack(images) if images else np.zeros((0, image_size, image_size, 3), np.uint8)
+        data[f'{split}_labels'] = np.array(labels, dtype=np.int64)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(cache_path, **data)
+    print(f"✓ Calibration set saved to {cache_path} "
+          f"({len(data['calib_images'])} calibration / {len(data['eval_images'])} evaluation images, {len(class_dirs)} classes)")
+    return data
+
+
+def _representative_dataset(images: np.ndarray):
+    def generator():
+        for image in images:
+            yield [image[np.newaxis].astype(np.float32) / 255.0]
+    return generator
+
+
+def _to_probabilities(outputs: np.ndarray) -> np.ndarray:
+    """Expand single-unit sigmoid outputs (leaf check) to two-class probabilities."""
+    outputs = outputs.reshape(len(outputs), -1)
+    return np.concatenate([1 - outputs, outputs], axis=1) if outputs.shape[1] == 1 else outputs
+
+
+def _set_input(interpreter, detail, image: np.ndarray):
+    x = image[np.newaxis].astype(np.float32) / 255.0
+    if detail['dtype'] in (np.uint8, np.int8):
+        scale, zero_point = detail['quantization']
+        info = np.iinfo(detail['dtype'])
+        x = np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(detail['dtype'])
+    interpreter.set_tensor(detail['index'], x)
+
+
+def _get_output(interpreter, detail) -> np.ndarray:
+    y = interpreter.get_tensor(detail['index'])[0]
+    if detail['dtype'] in (np.uint8, np.int8):
+        scale, zero_point = detail['quantization']
+        y = (y.astype(np.float32) - zero_point) * scale
+    return y
+
+
+def run_tflite(tflite_model: bytes, images: np.ndarray, num_threads: int = 1) -> np.ndarray:
+    """Run one image per invoke and return the (dequantized) outputs."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    input_detail = interpreter.get_input_details()[0]
+    output_detail = interpreter.get_output_details()[0]
+    outputs = []
+    for image in images:
+        _set_input(interpreter, input_detail, image)
+        interpreter.invoke()
+        outputs.append(_get_output(interpreter, output_detail))
+    return np.array(outputs)
+
+
+def measure_latency(tflite_model: bytes, image: np.ndarray, num_threads: int, warmup: int = 5, runs: int = 50) -> Dict[str, float]:
+    """Median / p90 per-invoke latency in ms for a single image."""
+    interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=num_threads)
+    interpreter.allocate_tensors()
+    _set_input(interpreter, interpreter.get_input_details()[0], image)
+    for _ in range(warmup): interpreter.invoke()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        interpreter.invoke()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': float(np.median(timings)), 'p90_ms': float(np.percentile(timings, 90))}
+
+
+def agreement(reference: np.ndarray, candidate: np.ndarray) -> Dict[str, float]:
+    """Top-1 agreement, and how often the reference top-1 is inside the candidate's top-3."""
+    ref_top1 = reference.argmax(axis=1)
+    top3 = np.argsort(-candidate, axis=1)[:, :3]
+    return {
+        'top1_agreement': float(np.mean(candidate.argmax(axis=1) == ref_top1)),
+        'top3_agreement': float(np.mean([r in row for r, row in zip(ref_top1, top3)])),
+    }
+
+
+def run_workbench(model_path: str,
+                  data_dir: str,
+                  output_dir: str,
+                  variants: Sequence[str] = DEFAULT_VARIANTS,
+                  threads: Sequence[int] = DEFAULT_THREADS,
+                  calib_per_class: int = 8,
+                  eval_per_class: int = 4,
+                  min_top1_agreement: float = 0.99,
+                  rank_threads: int = 1) -> Dict:
+    """Export each variant, benchmark it and recommend the fastest one meeting the agreement bar."""
+    output_path = Path(output_dir); output_path.mkdir(parents=True, exist_ok=True)
+    model = tf.keras.models.load_model(model_path)
+    image_size = model.input_shape[1]
+    data = build_calibration_set(data_dir, output_path / f"calibration_{image_size}px.npz", image_size,
+                                 calib_per_class, eval_per_class)
+    eval_images, eval_labels = data['eval_images'], data['eval_labels']
+    if len(eval_images) == 0:
+        raise ValueError("Evaluation split is empty; increase eval_per_class")
+
+    reference = _to_probabilities(model.predict(eval_images.astype(np.float32) / 255.0, batch_size=32, verbose=0))
+    representative = _representative_dataset(data['calib_images'])
+
+    results: List[Dict] = []
+    for variant in variants:
+        print(f"\n[{variant}] converting...")
+        tflite_model = convert_variant(model, variant, representative)
+        tflite_path = output_path / f"{Path(model_path).stem}_{variant}.tflite"
+        save_tflite(tflite_model, str(tflite_path))
+
+        outputs = _to_probabilities(run_tflite(tflite_model, eval_images))
+        result = {
+            'variant': variant,
+            'path': str(tflite_path),
+            'size_kb': round(len(tflite_model) / 1024, 1),
+            'latency': {str(t): measure_latency(tflite_model, eval_images[0], t) for t in threads},
+            'top1_accuracy': float(np.mean(outputs.argmax(axis=1) == eval_labels)),
+            **agreement(reference, outputs),
+        }
+        results.append(result)
+        latency = ", ".join(f"{t}T {result['latency'][str(t)]['median_ms']:.1f}ms" for t in threads)
+        print(f"  {result['size_kb']:.0f} KB | {latency} | top1 agree {result['top1_agreement']:.3f} | top3 agree {result['top3_agreement']:.3f}")
+
+    eligible = [r for r in results if r['top1_agreement'] >= min_top1_agreement]
+    recommended = min(eligible, key=lambda r: r['latency'][str(rank_threads)]['median_ms']) if eligible else None
+
+    report = {
+        'model': str(model_path),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': {'platform': platform.platform(), 'processor': platform.processor(), 'tensorflow': tf.__version__},
+        'eval_images': int(len(eval_images)),
+        'float_top1_accuracy': float(np.mean(reference.argmax(axis=1) == eval_labels)),
+        'min_top1_agreement': min_top1_agreement,
+        'rank_threads': rank_threads,
+        'variants': results,
+        'recommended': recommended['variant'] if recommended else None,
+    }
+    report_path = output_path / f"{Path(model_path).stem}_quantization_report.json"
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    _print_report(report, threads)
+    print(f"\n✓ Report saved to: {report_path}")
+    return report
+
+
+def _print_report(report: Dict, threads: Sequence[int]):
+    print("\n" + "=" * 78)
+    print("QUANTIZATION REPORT")
+    print("=" * 78)
+    header = f"{'variant':<16}{'size KB':>9}" + "".join(f"{f'{t}T ms':>9}" for t in threads) + f"{'top1':>8}{'top3':>8}{'acc':>8}"
+    print(header)
+    for r in report['variants']:
+        row = f"{r['variant']:<16}{r['size_kb']:>9.0f}" + "".join(f"{r['latency'][str(t)]['median_ms']:>9.2f}" for t in threads)
+        print(row + f"{r['top1_agreement']:>8.3f}{r['top3_agreement']:>8.3f}{r['top1_accuracy']:>8.3f}")
+    print("-" * 78)
+    if report['recommended']:
+        print(f"Recommended: {report['recommended']} (fastest at {report['rank_threads']} thread(s) with "
+              f"top-1 agreement >= {report['min_top1_agreement']})")
+    else:
+        print(f"No variant reached top-1 agreement >= {report['min_top1_agreement']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and compare every TFLite variant of a .keras model")
+    parser.add_argument('--model', required=True, help="Path to the trained .keras model")
+    parser.add_argument('--data', required=True, help="Image root with one folder per class")
+    parser.add_argument('--output', default='quantization_workbench', help="Directory for variants, calibration set and report")
+    parser.add_argument('--variants', nargs='+', default=DEFAULT_VARIANTS, choices=list(TFLITE_VARIANTS))
+    parser.add_argument('--threads', nargs='+', type=int, default=list(DEFAULT_THREADS))
+    parser.add_argument('--calib-per-class', type=int, default=8)
+    parser.add_argument('--eval-per-class', type=int, default=4)
+    parser.add_argument('--min-top1-agreement', type=float, default=0.99)
+    parser.add_argument('--rank-threads', type=int, default=1, help="Thread count used to rank latency")
+    args = parser.parse_args()
+
+    run_workbench(args.model, args.data, args.output, args.variants, args.threads, args.calib_per_class,
+                  args.eval_per_class, args.min_top1_agreement, args.rank_threads)
+
+
+if __name__ == "__main__":
+    main()
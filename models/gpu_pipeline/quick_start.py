@@ -92,30 +92,29 @@ def test_tensorflow_gpu():
         return False
 
 
-def estimate_performance():
-    """Estimate performance for 400k images"""
+def estimate_performance(num_images=400_000):
+    """Measure this machine with a short benchmark_suite run and extrapolate to 400k images"""
     print("\n" + "=" * 60)
-    print("Expected Performance for 400k Images")
+    print(f"Expected Performance for {num_images // 1000}k Images (measured on this machine)")
     print("=" * 60)
     
-    print("\nWith your RTX 4050 GPU:")
-    print("\n1. Image Loading + Preprocessing:")
-    print("   Speed: ~500-800 images/second")
-    print("   Time for 400k images: 8-13 minutes")
-    
-    print("\n2. Model Inference (MobileNetV3):")
-    print("   Speed: ~200-400 images/second")
-    print("   Time for 400k images: 17-33 minutes")
-    
-    print("\n3. Model Training:")
-    print("   Speed: ~150-300 images/second per epoch")
-    print("   Time per epoch: 22-44 minutes")
-    print("   Full training (20 epochs): 7-15 hours")
-    
-    print("\n4. TFRecord Conversion:")
-    print("   Speed: ~400-600 images/second")
-    print("   Time for 400k images: 11-17 minutes")
-    print("   Benefit: 10-20x faster training after conversion!")
+    from benchmark_suite import run_suite
+    report = run_suite(num_images=128, model_types=['mobilenetv3'], steps=5, stages=('data', 'models'))
+    results, batch_size = report['results'], report['config']['batch_size']
+    
+    stages = [
+        ("1. Image Loading + Preprocessing", results['decode_resize.images_per_sec']['value']),
+        ("2. Model Inference (MobileNetV3)", results['predict.mobilenetv3.images_per_sec']['value']),
+        ("3. Model Training (MobileNetV3, frozen backbone)", batch_size / results['train_step.mobilenetv3.ms']['value'] * 1000),
+        ("4. TFRecord Conversion", results['tfrecord_write.images_per_sec']['value']),
+    ]
+    for title, images_per_sec in stages:
+        print(f"\n{title}:")
+        print(f"   Speed: ~{images_per_sec:.0f} images/second")
+        print(f"   Time for {num_images // 1000}k images: {num_images / images_per_sec / 60:.0f} minutes")
+    print(f"\nTFRecord reads run at ~{results['tfrecord_read.images_per_sec']['value']:.0f} images/second vs "
+          f"~{results['decode_resize.images_per_sec']['value']:.0f} for raw JPEG decoding.")
+    print("Full suite with regression checks: python benchmark_suite.py --output benchmarks/this_host.json")
 
 
 def create_test_script():
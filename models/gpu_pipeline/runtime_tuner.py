@@ -0,0 +1,185 @@
+"""
+CPU Runtime Auto-Tuner
+Times the real model and TFRecord pipeline over a small grid of thread counts, oneDNN on/off,
+core pinning, batch sizes and decode parallelism, and stores the fastest profile per host.
+
+Thread pools and oneDNN are fixed once TensorFlow initialises, so every thread configuration
+is measured in its own subprocess, and entry scripts apply the stored profile before TF runs.
+
+Usage:
+    python runtime_tuner.py --tfrecords prepared_data/train --num-classes 38 --mode train
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Sequence
+
+DEFAULT_PROFILE_PATH = Path(__file__).parent / 'runtime_profiles.json'
+DEFAULT_BATCH_SIZES = (16, 32, 64)
+DEFAULT_PARALLEL_CALLS = (-1, 1, 2, 4)  # -1 = tf.data.AUTOTUNE
+TUNER_MODES = ('train', 'inference')
+
+
+def host_id() -> str:
+    return f"{platform.node()}-{os.cpu_count()}cpu"
+
+
+def workload_key(mode: str, model_type: str, image_size: int) -> str:
+    return f"{mode}:{model_type}:{image_size}"
+
+
+def load_runtime_profile(mode: str, model_type: str, image_size: int = 224,
+                         profile_path: str = DEFAULT_PROFILE_PATH) -> Optional[Dict]:
+    """Stored profile for this host and workload, or None if the host was never calibrated."""
+    profile_path = Path(profile_path)
+    if not profile_path.exists(): return None
+    with open(profile_path) as f: profiles = json.load(f)
+    return profiles.get(host_id(), {}).get(workload_key(mode, model_type, image_size))
+
+
+def save_runtime_profile(profile: Dict, profile_path: str = DEFAULT_PROFILE_PATH):
+    profile_path = Path(profile_path)
+    profiles = json.loads(profile_path.read_text()) if profile_path.exists() else {}
+    profiles.setdefault(host_id(), {})[profile['workload']] = profile
+    profile_path.write_text(json.dumps(profiles, indent=2))
+    print(f"✓ Runtime profile for {host_id()} saved to {profile_path}")
+
+
+def apply_runtime_profile(profile: Optional[Dict]) -> Optional[Dict]:
+    """
+    Apply the oneDNN, thread and pinning settings of `profile` to this process.
+
+    oneDNN is only honoured if TensorFlow has not been imported yet; the batch size and
+    num_parallel_calls are returned in the profile for the caller's datasets.
+    """
+    if profile is None: return None
+    if 'tensorflow' not in sys.modules:
+        os.environ['TF_ENABLE_ONEDNN_OPTS'] = '1' if profile['onednn'] else '0'
+    from gpu_utils import configure_cpu_threads
+    configure_cpu_threads(profile['intra_op'], profile['inter_op'], profile['cpu_affinity'])
+    print(f"✓ Runtime profile: batch {profile['batch_size']}, num_parallel_calls {profile['num_parallel_calls']}, "
+          f"oneDNN {'on' if profile['onednn'] else 'off'} ({profile['images_per_sec']:.1f} img/s when calibrated)")
+    return profile
+
+
+def thread_grid(onednn_options: Sequence[bool] = (True, False)):
+    """Candidate (intra_op, inter_op, cpu_affinity, onednn) settings for this host."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    grid = []
+    for intra in sorted({len(cores), max(len(cores) // 2, 1)}, reverse=True):
+        for inter in sorted({1, 2}):
+            for pin in ([None, cores[:intra]] if intra < len(cores) else [None]):
+                for onednn in onednn_options:
+                    grid.append({'intra_op': intra, 'inter_op': inter, 'cpu_affinity': pin, 'onednn': onednn})
+    return grid
+
+
+def _run_trial(config: Dict) -> Dict:
+    """Subprocess body: apply one thread setting, then search batch size and num_parallel_calls."""
+    from gpu_utils import configure_cpu_threads
+    configure_cpu_threads(config['intra_op'], config['inter_op'], config['cpu_affinity'])
+    from dataset_processor import load_tfrecord_dataset
+    from train_model import CropDiseaseModel
+
+    wrapper = CropDiseaseModel(config['num_classes'], (config['image_size'], config['image_size'], 3),
+                               config['model_type'], use_mixed_precision=config['mixed_precision'])
+    wrapper.build_model(pretrained=False)
+    model = wrapper.model
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+
+    def throughput(batch_size, num_parallel_calls):
+        dataset = load_tfrecord_dataset(config['tfrecords'], batch_size, shuffle=False, image_size=config['image_size'],
+                                        num_parallel_calls=num_parallel_calls).repeat()
+        iterator = iter(dataset)
+        step = model.train_on_batch if config['mode'] == 'train' else lambda x, y: model.predict_on_batch(x)
+        for _ in range(config['warmup']): step(*next(iterator))
+        start = time.perf_counter()
+        for _ in range(config['steps']): step(*next(iterator))
+        return batch_size * config['steps'] / (time.perf_counter() - start)
+
+    # Coordinate search: batch size at AUTOTUNE decode, then decode parallelism at the best batch size
+    trials = [{'batch_size': b, 'num_parallel_calls': -1, 'images_per_sec': throughput(b, -1)} for b in config['batch_sizes']]
+    best_batch = max(trials, key=lambda t: t['images_per_sec'])['batch_size']
+    trials += [{'batch_size': best_batch, 'num_parallel_calls': n, 'images_per_sec': throughput(best_batch, n)}
+               for n in config['parallel_calls'] if n != -1]
+    return {'trials': trials}
+
+
+def calibrate_runtime(tfrecord_dir: str,
+                      num_classes: int,
+                      model_type: str = 'mobilenetv3',
+                      image_size: int = 224,
+                      mode: str = 'train',
+                      batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+                      parallel_calls: Sequence[int] = DEFAULT_PARALLEL_CALLS,
+                      onednn_options: Sequence[bool] = (True, False),
+                      mixed_precision: bool = True,
+                      steps: int = 5,
+                      warmup: int = 2,
+                      profile_path: str = DEFAULT_PROFILE_PATH) -> Dict:
+    """Time every thread configuration in a fresh subprocess and persist the fastest profile for this host."""
+    if mode not in TUNER_MODES: raise ValueError(f"Unknown tuner mode: {mode}")
+    base = {'tfrecords': str(tfrecord_dir), 'num_classes': num_classes, 'model_type': model_type, 'image_size': image_size,
+            'mode': mode, 'batch_sizes': list(batch_sizes), 'parallel_calls': list(parallel_calls),
+            'mixed_precision': mixed_precision, 'steps': steps, 'warmup': warmup}
+    grid = thread_grid(onednn_options)
+    print(f"\nCalibrating CPU runtime for {workload_key(mode, model_type, image_size)} on {host_id()} "
+          f"({len(grid)} thread configurations)...")
+
+    results = []
+    for i, threads in enumerate(grid, 1):
+        env = dict(os.environ, TF_ENABLE_ONEDNN_OPTS='1' if threads['onednn'] else '0', TF_CPP_MIN_LOG_LEVEL='2')
+        proc = subprocess.run([sys.executable, __file__, '--trial', json.dumps({**base, **threads})],
+                              env=env, cwd=Path(__file__).parent, capture_output=True, text=True)
+        line = next((l for l in proc.stdout.splitlines() if l.startswith('TRIAL_RESULT ')), None)
+        if line is None:
+            print(f"  [{i}/{len(grid)}] {threads} failed:\n{proc.stderr[-2000:]}")
+            continue
+        trials = [{**threads, **trial} for trial in json.loads(line[len('TRIAL_RESULT '):])['trials']]
+        results += trials
+        best = max(trials, key=lambda r: r['images_per_sec'])
+        print(f"  [{i}/{len(grid)}] intra {threads['intra_op']} inter {threads['inter_op']} "
+              f"pinned {bool(threads['cpu_affinity'])} oneDNN {threads['onednn']}: best {best['images_per_sec']:.1f} img/s")
+    if not results:
+        raise RuntimeError("Every calibration trial failed")
+
+    best = max(results, key=lambda r: r['images_per_sec'])
+    profile = {'workload': workload_key(mode, model_type, image_size), 'host': host_id(),
+               'created': datetime.now().isoformat(timespec='seconds'), **best, 'trials': len(results)}
+    print(f"✓ Best: batch {best['batch_size']}, num_parallel_calls {best['num_parallel_calls']}, intra {best['intra_op']}, "
+          f"inter {best['inter_op']}, oneDNN {best['onednn']} -> {best['images_per_sec']:.1f} img/s")
+    save_runtime_profile(profile, profile_path)
+    return profile
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate CPU threads, batch size and input-pipeline parallelism")
+    parser.add_argument('--trial', help=argparse.SUPPRESS)
+    parser.add_argument('--tfrecords', help="Directory of training .tfrecord shards")
+    parser.add_argument('--num-classes', type=int)
+    parser.add_argument('--model-type', default='mobilenetv3')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--mode', default='train', choices=TUNER_MODES)
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--profile', default=str(DEFAULT_PROFILE_PATH))
+    args = parser.parse_args()
+
+    if args.trial:
+        print('TRIAL_RESULT ' + json.dumps(_run_trial(json.loads(args.trial))))
+        return
+    if not args.tfrecords or not args.num_classes:
+        parser.error("--tfrecords and --num-classes are required")
+    calibrate_runtime(args.tfrecords, args.num_classes, args.model_type, args.image_size, args.mode,
+                      batch_sizes=args.batch_sizes, steps=args.steps, profile_path=args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Hyperparameter Sweep with Successive Halving
+Samples configs (model type, learning rate, dropout, head size, fine_tune_at), trains them as
+parallel worker processes pinned to disjoint cores under a CPU budget, and after each rung keeps
+only the best 1/eta for a longer budget. Frozen-backbone epochs train only the classifier head on
+backbone features cached once per model type. Survivors are ranked by validation accuracy against
+measured TFLite latency.
+
+Usage:
+    python sweep.py --data prepared_data --num-classes 38 --trials 27 --max-epochs 9 --eta 3 \\
+        --cpus 16 --threads-per-trial 4 --output sweeps/run1
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+# Lists are sampled uniformly; (low, high) tuples log-uniformly. fine_tune_at is the fraction of
+# max_epochs trained with the backbone frozen (1.0 = never unfreeze).
+DEFAULT_SEARCH_SPACE = {
+    'model_type': ['mobilenetv3', 'mobilenetv3_small', 'efficientnet', 'custom'],
+    'learning_rate': (1e-4, 1e-2),
+    'dropout': [0.1, 0.2, 0.3, 0.5],
+    'head_units': [0, 128, 256],
+    'fine_tune_at': [0.5, 0.75, 1.0],
+}
+FROZEN_BACKBONE_TYPES = ('mobilenetv3', 'mobilenetv3_small', 'efficientnet')
+# Unfrozen backbones fine-tune at the trial's learning rate times this (train()'s 1e-3 -> 1e-5 ratio)
+FINE_TUNE_LR_SCALE = 0.01
+
+
+def sample_configs(num_trials: int, space: Dict = DEFAULT_SEARCH_SPACE, seed: int = 0) -> List[Dict]:
+    rng = random.Random(seed)
+    configs = []
+    for i in range(num_trials):
+        config = {'trial_id': f"t{i:03d}"}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                config[name] = math.exp(rng.uniform(math.log(values[0]), math.log(values[1])))
+            else:
+                config[name] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+
+def rung_epochs(min_epochs: int, max_epochs: int, eta: int) -> List[int]:
+    """Cumulative epoch budget per rung, e.g. (1, 9, 3) -> [1, 3, 9]."""
+    rungs, epochs = [], min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs + [max_epochs]
+
+
+def core_slots(threads_per_trial: int, cpu_budget: Optional[int] = None) -> List[List[int]]:
+    """Disjoint core sets, one per concurrently running trial, within `cpu_budget` cores."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    cores = cores[:cpu_budget or len(cores)]
+    if threads_per_trial >= len(cores): return [cores]
+    return [cores[i:i + threads_per_trial] for i in range(0, len(cores) - threads_per_trial + 1, threads_per_trial)]
+
+
+def _feature_cache_path(cache_dir: Path, model_type: str, image_size: int, split: str) -> Path:
+    return cache_dir / f"{model_type}_{image_size}_{split}.npz"
+
+
+def cache_backbone_features(data_dir: str, model_type: str, image_size: int, cache_dir: Path, batch_size: int = 64):
+    """Run the frozen ImageNet backbone once over train/ and val/ and store pooled features + labels."""
+    import numpy as np
+    from dataset_processor import load_tfrecord_dataset
+    from train_model import CropDiseaseModel
+
+    paths = {split: _feature_cache_path(cache_dir, model_type, image_size, split) for split in ('train', 'val')}
+    if all(p.exists() for p in paths.values()):
+        print(f"✓ Reusing cached {model_type} features from {cache_dir}")
+        return
+    wrapper = CropDiseaseModel(1, (image_size, image_size, 3), model_type, use_mixed_precision=False)
+    backbone = wrapper.build_model(pretrained=True).layers[1]
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for split, path in paths.items():
+        features, labels = [], []
+        for images, batch_labels in load_tfrecord_dataset(str(Path(data_dir) / split), batch_size, shuffle=False, image_size=image_size):
+            features.append(backbone(images, training=False).numpy().astype(np.float32))
+            labels.append(batch_labels.numpy())
+        np.savez(path, features=np.concatenate(features), labels=np.concatenate(labels))
+        print(f"✓ Cached {model_type} {split} features: {path}")
+
+
+def _run_trial(job: Dict) -> Dict:
+    """Subprocess body: resume one trial's weights and train it from start_epoch to end_epoch."""
+    from gpu_utils import configure_cpu_threads
+    configure_cpu_threads(len(job['cpu_affinity']), 1, job['cpu_affinity'])
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow import keras
+    from dataset_processor import load_tfrecord_dataset
+    from train_model import CropDiseaseModel
+
+    image_size, start, end = job['image_size'], job['start_epoch'], job['end_epoch']
+    wrapper = CropDiseaseModel(job['num_classes'], (image_size, image_size, 3), job['model_type'], use_mixed_precision=False)
+    model = wrapper.build_model(pretrained=job['pretrained'], dropout=job['dropout'], head_units=job['head_units'])
+    weights_path = Path(job['state_dir']) / f"{job['trial_id']}.weights.h5"
+    if start > 0: model.load_weights(weights_path)
+
+    frozen = job['model_type'] in FROZEN_BACKBONE_TYPES and job['pretrained']
+    fine_tune_at = job['fine_tune_at_epoch'] if frozen else 0
+    started = time.perf_counter()
+    result = {}
+
+    if start < fine_tune_at:
+        # Backbone frozen: train only the head layers (shared with `model`) on cached features
+        def feature_dataset(split, shuffle):
+            cached = np.load(_feature_cache_path(Path(job['feature_cache']), job['model_type'], image_size, split))
+            dataset = tf.data.Dataset.from_tensor_slices((cached['features'], cached['labels']))
+            if shuffle: dataset = dataset.shuffle(len(cached['labels']))
+            return dataset.batch(job['batch_size']).prefetch(tf.data.AUTOTUNE)
+        features = keras.Input(shape=model.layers[1].output.shape[1:])
+        x = features
+        for layer in model.layers[2:]: x = layer(x)
+        head = keras.Model(features, x)
+        head.compile(optimizer=keras.optimizers.Adam(job['learning_rate']), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        val_features = feature_dataset('val', False)
+        head.fit(feature_dataset('train', True), initial_epoch=start, epochs=min(end, fine_tune_at), verbose=2)
+        if end <= fine_tune_at:
+            result['val_loss'], result['val_accuracy'] = head.evaluate(val_features, verbose=0)
+
+    if end > fine_tune_at:
+        train_ds = load_tfrecord_dataset(str(Path(job['data']) / 'train'), job['batch_size'], shuffle=True, image_size=image_size)
+        val_ds = load_tfrecord_dataset(str(Path(job['data']) / 'val'), job['batch_size'], shuffle=False, image_size=image_size)
+        if not frozen: model.trainable = True  # no ImageNet backbone to protect: train end to end
+        wrapper.compile_model(learning_rate=job['learning_rate'])
+        if frozen: wrapper._compile_fine_tune(job['learning_rate'] * FINE_TUNE_LR_SCALE)
+        model.fit(train_ds, initial_epoch=max(start, fine_tune_at), epochs=end, verbose=2)
+        result['val_loss'], result['val_accuracy'] = model.evaluate(val_ds, verbose=0)[:2]
+
+    model.save_weights(weights_path)
+    return {**result, 'train_seconds': time.perf_counter() - started}
+
+
+def _run_rung(jobs: List[Dict], slots: List[List[int]], log_dir: Path) -> Dict[str, Optional[Dict]]:
+    """Run `jobs` as subprocesses, at most one per core slot at a time. Returns trial_id -> result (None = failed)."""
+    pending, running, results = list(jobs), [], {}
+    free_slots = list(slots)
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='2')
+    while pending or running:
+        while pending and free_slots:
+            job = {**pending.pop(0), 'cpu_affinity': free_slots.pop(0)}
+            log_path = log_dir / f"{job['trial_id']}_epochs{job['start_epoch']}-{job['end_epoch']}.log"
+            log = open(log_path, 'w')
+            proc = subprocess.Popen([sys.executable, __file__, '--trial', json.dumps(job)], env=env,
+                                    cwd=Path(__file__).parent, stdout=log, stderr=subprocess.STDOUT)
+            running.append((proc, job, log, log_path))
+        for entry in list(running):
+            proc, job, log, log_path = entry
+            if proc.poll() is None: continue
+            log.close()
+            running.remove(entry); free_slots.append(job['cpu_affinity'])
+            line = next((l for l in log_path.read_text().splitlines() if l.startswith('TRIAL_RESULT ')), None)
+            results[job['trial_id']] = json.loads(line[len('TRIAL_RESULT '):]) if line else None
+            status = f"val_accuracy {results[job['trial_id']]['val_accuracy']:.4f}" if line else f"failed (see {log_path})"
+            print(f"  {job['trial_id']} {job['model_type']:<18} epochs {job['start_epoch']}->{job['end_epoch']}: {status}")
+        time.sleep(0.5)
+    return results
+
+
+def measure_tflite_latency(trials: List[Dict], num_classes: int, image_size: int, num_threads: int = 1) -> Dict:
+    """Median dynamic-range TFLite latency per distinct architecture (model type + head size)."""
+    import numpy as np
+    from train_model import CropDiseaseModel
+    from quantization import convert_variant
+    from quantization_workbench import measure_latency
+
+    latencies = {}
+    image = np.random.rand(image_size, image_size, 3).astype(np.float32)
+    for model_type, head_units in sorted({(t['model_type'], t['head_units']) for t in trials}):
+        wrapper = CropDiseaseModel(num_classes, (image_size, image_size, 3), model_type, use_mixed_precision=False)
+        model = wrapper.build_model(pretrained=False, head_units=head_units)
+        latency = measure_latency(convert_variant(model, 'dynamic_range'), image, num_threads)
+        latencies[f"{model_type}/{head_units}"] = latency['median_ms']
+        print(f"  {model_type} (head {head_units}): {latency['median_ms']:.1f} ms")
+    return latencies
+
+
+def run_sweep(data_dir: str,
+              num_classes: int,
+              output_dir: str = 'sweeps',
+              num_trials: int = 27,
+              min_epochs: int = 1,
+              max_epochs: int = 9,
+              eta: int = 3,
+              threads_per_trial: int = 2,
+              cpu_budget: Optional[int] = None,
+              image_size: int = 224,
+              batch_size: int = 32,
+              pretrained: bool = True,
+              latency_threads: int = 1,
+              space: Dict = DEFAULT_SEARCH_SPACE,
+              seed: int = 0) -> List[Dict]:
+    """Successive halving over `num_trials` sampled configs; returns the leaderboard (also saved as JSON)."""
+    output_path = Path(output_dir); output_path.mkdir(parents=True, exist_ok=True)
+    state_dir, log_dir = output_path / 'trials', output_path / 'logs'
+    state_dir.mkdir(exist_ok=True); log_dir.mkdir(exist_ok=True)
+    feature_cache = Path(data_dir) / 'feature_cache'
+    trials = sample_configs(num_trials, space, seed)
+    for trial in trials:
+        trial['fine_tune_at_epoch'] = round(trial['fine_tune_at'] * max_epochs)
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    slots = core_slots(threads_per_trial, cpu_budget)
+    print(f"\nSweep: {num_trials} trials, rungs {rungs} epochs, eta {eta}, "
+          f"{len(slots)} parallel worker(s) x {len(slots[0])} core(s)")
+
+    if pretrained:
+        for model_type in sorted({t['model_type'] for t in trials} & set(FROZEN_BACKBONE_TYPES)):
+            cache_backbone_features(data_dir, model_type, image_size, feature_cache, batch_size)
+
+    base = {'data': str(data_dir), 'num_classes': num_classes, 'image_size': image_size, 'batch_size': batch_size,
+            'pretrained': pretrained, 'state_dir': str(state_dir), 'feature_cache': str(feature_cache)}
+    alive, done = trials, 0
+    for rung, epochs in enumerate(rungs):
+        print(f"\nRung {rung}: {len(alive)} trial(s) -> {epochs} epoch(s)")
+        results = _run_rung([{**base, **t, 'start_epoch': done, 'end_epoch': epochs} for t in alive], slots, log_dir)
+        for trial in alive:
+            if results[trial['trial_id']] is None:
+                trial['status'] = 'failed'
+                continue
+            trial.update(results[trial['trial_id']], epochs=epochs, status='stopped')
+        alive = sorted((t for t in alive if t['status'] != 'failed'), key=lambda t: t['val_accuracy'], reverse=True)
+        if not alive:
+            print(f"⚠ Every trial in rung {rung} failed, stopping (see {log_dir})")
+            break
+        if rung < len(rungs) - 1:
+            alive = alive[:max(len(alive) // eta, 1)]
+        done = epochs
+    for trial in alive: trial['status'] = 'finished'
+
+    print("\nMeasuring TFLite latency...")
+    scored = [t for t in trials if t.get('status') != 'failed']
+    latencies = measure_tflite_latency(scored, num_classes, image_size, latency_threads)
+    for trial in scored:
+        trial['latency_ms'] = latencies[f"{trial['model_type']}/{trial['head_units']}"]
+        trial['accuracy_per_ms'] = trial['val_accuracy'] / trial['latency_ms']
+    # Trials that got the most epochs first, then by accuracy; Pareto = no faster trial with the same budget is more accurate
+    leaderboard = sorted(scored, key=lambda t: (t['epochs'], t['val_accuracy']), reverse=True)
+    for trial in leaderboard:
+        trial['pareto'] = not any(o['epochs'] == trial['epochs'] and o['val_accuracy'] > trial['val_accuracy']
+                                  and o['latency_ms'] <= trial['latency_ms'] for o in leaderboard)
+
+    _print_leaderboard(leaderboard)
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'rungs': rungs, 'eta': eta,
+              'latency_threads': latency_threads, 'leaderboard': leaderboard,
+              'failed': [t['trial_id'] for t in trials if t.get('status') == 'failed']}
+    with open(output_path / 'sweep_results.json', 'w') as f: json.dump(report, f, indent=2)
+    print(f"✓ Leaderboard saved to: {output_path / 'sweep_results.json'}")
+    return leaderboard
+
+
+def _print_leaderboard(leaderboard: Sequence[Dict]):
+    print("\n" + "=" * 100)
+    print("SWEEP LEADERBOARD")
+    print("=" * 100)
+    print(f"{'trial':<7}{'model':<19}{'lr':>9}{'drop':>6}{'head':>6}{'ft@':>5}{'epochs':>8}"
+          f"{'val acc':>9}{'ms':>8}{'acc/ms':>9}{'pareto':>8}")
+    for t in leaderboard:
+        print(f"{t['trial_id']:<7}{t['model_type']:<19}{t['learning_rate']:>9.2e}{t['dropout']:>6.2f}{t['head_units']:>6}"
+              f"{t['fine_tune_at_epoch']:>5}{t['epochs']:>8}{t['val_accuracy']:>9.4f}{t['latency_ms']:>8.1f}"
+              f"{t['accuracy_per_ms']:>9.4f}{'*' if t['pareto'] else '':>8}")
+    if not leaderboard:
+        print("\n⚠ No trial produced a result")
+        return
+    # If the last rung failed, fall back to the trials stopped in earlier rungs
+    finished = [t for t in leaderboard if t['status'] == 'finished']
+    best = max(finished or leaderboard, key=lambda t: t['accuracy_per_ms'])
+    if not finished: print("\n⚠ No trial finished the last rung")
+    print(f"\nBest accuracy per ms: {best['trial_id']} ({best['model_type']}, lr {best['learning_rate']:.2e}, "
+          f"dropout {best['dropout']}, head {best['head_units']}, fine_tune_at {best['fine_tune_at_epoch']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Successive-halving hyperparameter sweep for CropDiseaseModel")
+    parser.add_argument('--trial', help=argparse.SUPPRESS)
+    parser.add_argument('--data', help="Directory with train/ and val/ TFRecord shards")
+    parser.add_argument('--num-classes', type=int)
+    parser.add_argument('--output', default='sweeps')
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--min-epochs', type=int, default=1)
+    parser.add_argument('--max-epochs', type=int, default=9)
+    parser.add_argument('--eta', type=int, default=3, help="Keep the best 1/eta of trials per rung")
+    parser.add_argument('--threads-per-trial', type=int, default=2)
+    parser.add_argument('--cpus', type=int, help="CPU budget (cores) for the whole sweep; default all")
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--no-pretrained', action='store_true')
+    parser.add_argument('--latency-threads', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.trial:
+        print('TRIAL_RESULT ' + json.dumps(_run_trial(json.loads(args.trial))))
+        return
+    if not args.data or not args.num_classes:
+        parser.error("--data and --num-classes are required")
+    run_sweep(args.data, args.num_classes, args.output, args.trials, args.min_epochs, args.max_epochs, args.eta,
+              args.threads_per_trial, args.cpus, args.image_size, args.batch_size, not args.no_pretrained,
+              args.latency_threads, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
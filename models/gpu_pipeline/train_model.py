@@ -10,56 +10,99 @@ from tensorflow.keras.applications import (
     MobileNetV3Small, MobileNetV3Large, EfficientNetB0, EfficientNetB1
 )
 import os
+import math
+import time
 from pathlib import Path
 from datetime import datetime
-from typing import Tuple, Optional, Dict
+from typing import Tuple, Optional, Dict, Sequence
 import json
 
-from gpu_utils import setup_gpu, enable_mixed_precision
-from dataset_processor import CropDiseaseDatasetProcessor
+from gpu_utils import setup_gpu, enable_mixed_precision, reset_peak_memory, peak_memory_mb, memory_ceiling_mb
+from dataset_processor import CropDiseaseDatasetProcessor, resize_batches, pad_batches
+from distillation import Distiller, cache_teacher_targets, load_distillation_dataset
+from quantization import fine_tune_qat, convert_qat_to_tflite, representative_dataset_from, convert_variant, convert_smallest, save_tflite
+from quantization_workbench import measure_latency
+from pruning import PruningCallback, remove_pruned_units, sparsity_report
+from distributed import is_chief, fit_multi_worker
+from profiling import ThroughputProfiler
+from hard_mining import HardExampleMiner, HardExampleTrainer, HardExampleSampler, save_mining_report
+
+# Progressive resizing stages: (epochs, image_size, batch_size). Last stage = deployment resolution.
+DEFAULT_PROGRESSIVE_SCHEDULE = [(4, 128, 128), (3, 160, 96), (3, 224, 64)]
+ASSETS_DIR = Path(__file__).resolve().parent.parent / 'assets'  # read by src/tflite_runner.py and the inference service
 
 class CropDiseaseModel:
     """Wrapper for training crop disease detection models."""
+
+    # (metric, mode) for early stopping and best-checkpoint selection in train()
+    monitor = ('val_accuracy', 'max')
     
-    def __init__(self, num_classes: int, input_shape: Tuple[int, int, int] = (224, 224, 3), model_type: str = 'mobilenetv3', use_mixed_precision: bool = True):
+    def __init__(self, num_classes: int, input_shape: Tuple[int, int, int] = (224, 224, 3), model_type: str = 'mobilenetv3', use_mixed_precision: bool = True,
+                 strategy: Optional[tf.distribute.Strategy] = None):
+        """strategy: e.g. distributed.make_strategy(); models and optimizers are then created in its scope."""
         self.num_classes = num_classes
         self.input_shape = input_shape
         self.model_type = model_type
         self.model = None
+        self.learning_rate = 0.001
+        self.optimizer = 'adam'
+        self.qat_model = None
+        self.calibration_dataset = None
+        self.pruned = False
+        self.accumulation_steps = 1
+        self.batch_plan = None
+        self.jit_compile = False
+        self.dropout = None
+        self.head_units = 0
+        self.strategy = strategy or tf.distribute.get_strategy()
         setup_gpu(memory_growth=True)
-        if use_mixed_precision: enable_mixed_precision()
+        self.precision = enable_mixed_precision('auto' if use_mixed_precision else 'float32')
     
-    def build_model(self, pretrained: bool = True) -> keras.Model:
+    def build_model(self, pretrained: bool = True, dropout: Optional[float] = None, head_units: int = 0) -> keras.Model:
+        """dropout: classifier dropout (None = per-architecture default); head_units: optional hidden Dense layer."""
+        self.dropout, self.head_units = dropout, head_units
         print(f"\nBuilding {self.model_type} model...")
-        if self.model_type == 'mobilenetv3': self.model = self._build_mobilenetv3(pretrained)
-        elif self.model_type == 'efficientnet': self.model = self._build_efficientnet(pretrained)
-        elif self.model_type == 'custom': self.model = self._build_custom_cnn()
-        else: raise ValueError(f"Unknown model type: {self.model_type}")
+        self.model = self._build_architecture(pretrained, self.input_shape)
         print(f"✓ Model built successfully. Parameters: {self.model.count_params():,}")
         return self.model
     
-    def _build_mobilenetv3(self, pretrained: bool) -> keras.Model:
+    def _build_architecture(self, pretrained: bool, input_shape: Tuple) -> keras.Model:
+        with self.strategy.scope():
+            return self._build_architecture_unscoped(pretrained, input_shape)
+
+    def _build_architecture_unscoped(self, pretrained: bool, input_shape: Tuple) -> keras.Model:
+        if self.model_type == 'mobilenetv3': return self._build_mobilenetv3(pretrained, input_shape)
+        elif self.model_type == 'mobilenetv3_small': return self._build_mobilenetv3_small(pretrained, input_shape)
+        elif self.model_type == 'efficientnet': return self._build_efficientnet(pretrained, input_shape)
+        elif self.model_type == 'custom': return self._build_custom_cnn(input_shape)
+        else: raise ValueError(f"Unknown model type: {self.model_type}")
+
+    def _build_mobilenetv3(self, pretrained: bool, input_shape: Tuple) -> keras.Model:
         weights = 'imagenet' if pretrained else None
-        base_model = MobileNetV3Large(input_shape=self.input_shape, include_top=False, weights=weights, pooling='avg')
+        base_model = MobileNetV3Large(input_shape=input_shape, include_top=False, weights=weights, pooling='avg')
         base_model.trainable = False
-        inputs = keras.Input(shape=self.input_shape)
+        inputs = keras.Input(shape=input_shape)
         x = base_model(inputs, training=False)
-        x = layers.Dropout(0.2)(x)
-        outputs = layers.Dense(self.num_classes, activation='softmax', dtype='float32')(x)
-        return keras.Model(inputs, outputs, name='CropDisease_MobileNetV3')
+        return keras.Model(inputs, self._classifier_head(x, 0.2), name='CropDisease_MobileNetV3')
 
-    def _build_efficientnet(self, pretrained: bool) -> keras.Model:
+    def _build_mobilenetv3_small(self, pretrained: bool, input_shape: Tuple) -> keras.Model:
         weights = 'imagenet' if pretrained else None
-        base_model = EfficientNetB0(input_shape=self.input_shape, include_top=False, weights=weights, pooling='avg')
+        base_model = MobileNetV3Small(input_shape=input_shape, include_top=False, weights=weights, pooling='avg')
         base_model.trainable = False
-        inputs = keras.Input(shape=self.input_shape)
+        inputs = keras.Input(shape=input_shape)
         x = base_model(inputs, training=False)
-        x = layers.Dropout(0.2)(x)
-        outputs = layers.Dense(self.num_classes, activation='softmax', dtype='float32')(x)
-        return keras.Model(inputs, outputs, name='CropDisease_EfficientNet')
+        return keras.Model(inputs, self._classifier_head(x, 0.2), name='CropDisease_MobileNetV3Small')
+
+    def _build_efficientnet(self, pretrained: bool, input_shape: Tuple) -> keras.Model:
+        weights = 'imagenet' if pretrained else None
+        base_model = EfficientNetB0(input_shape=input_shape, include_top=False, weights=weights, pooling='avg')
+        base_model.trainable = False
+        inputs = keras.Input(shape=input_shape)
+        x = base_model(inputs, training=False)
+        return keras.Model(inputs, self._classifier_head(x, 0.2), name='CropDisease_EfficientNet')
         
-    def _build_custom_cnn(self) -> keras.Model:
-        inputs = keras.Input(shape=self.input_shape)
+    def _build_custom_cnn(self, input_shape: Tuple) -> keras.Model:
+        inputs = keras.Input(shape=input_shape)
         x = layers.Conv2D(32, 3, strides=2, padding='same')(inputs)
         x = layers.BatchNormalization()(x); x = layers.ReLU()(x)
         x = layers.Conv2D(64, 3, padding='same')(x)
@@ -67,55 +110,442 @@ class CropDiseaseModel:
         x = layers.Conv2D(128, 3, padding='same')(x)
         x = layers.BatchNormalization()(x); x = layers.ReLU()(x); x = layers.MaxPooling2D(2)(x)
         x = layers.GlobalAveragePooling2D()(x)
-        x = layers.Dropout(0.3)(x)
-        outputs = layers.Dense(self.num_classes, activation='softmax', dtype='float32')(x)
-        return keras.Model(inputs, outputs, name='CropDisease_CustomCNN')
+        return keras.Model(inputs, self._classifier_head(x, 0.3), name='CropDisease_CustomCNN')
+
+    def _classifier_head(self, x, default_dropout: float):
+        if self.head_units: x = layers.Dense(self.head_units, activation='relu')(x)
+        x = layers.Dropout(default_dropout if self.dropout is None else self.dropout)(x)
+        return layers.Dense(self.num_classes, activation='softmax', dtype='float32')(x)
 
-    def compile_model(self, learning_rate: float = 0.001, optimizer: str = 'adam'):
+    def compile_model(self, learning_rate: float = 0.001, optimizer: str = 'adam', jit_compile: bool = False):
+        """
+        jit_compile: XLA-compile the train/eval steps (fused conv/BN/activation blocks). Batches are then
+            padded to one static shape in train(); call gpu_utils.enable_xla_cache() at startup to keep
+            the compiled clusters between runs. Measure first with xla_benchmark.py.
+        """
         if self.model is None: raise ValueError("Model not built.")
-        opt = keras.optimizers.Adam(learning_rate=learning_rate) if optimizer == 'adam' else keras.optimizers.SGD(learning_rate=learning_rate, momentum=0.9)
-        self.model.compile(optimizer=opt, loss='sparse_categorical_crossentropy', metrics=['accuracy', keras.metrics.TopKCategoricalAccuracy(k=3, name='top3_accuracy')])
-        print(f"✓ Model compiled with {optimizer} optimizer")
+        self.learning_rate, self.optimizer, self.jit_compile = learning_rate, optimizer, jit_compile
+        if jit_compile and 'tf_xla_persistent_cache_directory' not in os.environ.get('TF_XLA_FLAGS', ''):
+            print("⚠ XLA cache disabled: call gpu_utils.enable_xla_cache() at startup to reuse compiled clusters")
+        self._compile(self.model)
+        print(f"✓ Model compiled with {optimizer} optimizer" + (" (XLA)" if jit_compile else ""))
+
+    def _make_optimizer(self, name: str, learning_rate: float) -> keras.optimizers.Optimizer:
+        # Gradient accumulation (see find_batch_size) averages gradients over micro-batches before each update
+        accumulate = {'gradient_accumulation_steps': self.accumulation_steps} if self.accumulation_steps > 1 else {}
+        if name == 'adam': return keras.optimizers.Adam(learning_rate=learning_rate, **accumulate)
+        return keras.optimizers.SGD(learning_rate=learning_rate, momentum=0.9, **accumulate)
+
+    def _compile(self, model: keras.Model):
+        with self.strategy.scope():
+            opt = self._make_optimizer(self.optimizer, self.learning_rate)
+            model.compile(optimizer=opt, **self._loss_and_metrics(['accuracy', keras.metrics.SparseTopKCategoricalAccuracy(k=3, name='top3_accuracy')]))
+
+    def _compile_fine_tune(self, learning_rate: float = 1e-5):
+        self.model.trainable = True
+        with self.strategy.scope():
+            self.model.compile(optimizer=self._make_optimizer('adam', learning_rate), **self._loss_and_metrics(['accuracy']))
+
+    def _loss_and_metrics(self, metrics):
+        if not self.jit_compile:
+            return {'loss': 'sparse_categorical_crossentropy', 'metrics': metrics}
+        # XLA batches carry zero sample weights on padding rows: average over real rows only
+        return {'loss': keras.losses.SparseCategoricalCrossentropy(reduction='mean_with_sample_weight'),
+                'weighted_metrics': metrics, 'jit_compile': True}
+
+    def find_batch_size(self, target_batch_size: Optional[int] = None, max_batch_size: int = 512, min_batch_size: int = 8,
+                        headroom: float = 0.2, memory_limit_mb: Optional[float] = None) -> Dict:
+        """
+        Probe doubling batch sizes with real train steps and keep the largest that fits in memory.
+
+        The ceiling is `memory_limit_mb`, else process RSS + available RAM on CPU, else (GPU) extrapolated
+        from the first out-of-memory probe; `headroom` of it stays free. If `target_batch_size` is larger
+        than what fits, gradients are accumulated over micro-batches so the effective batch is the same on
+        every machine. Re-batch the datasets with the returned 'batch_size'; weights and trainable flags are
+        left untouched. Probes run with the whole model trainable, as in the fine-tuning phase (the worst case).
+        """
+        if self.model is None: raise ValueError("Model not built.")
+        weights = self.model.get_weights()
+        trainable = [(layer, layer.trainable) for layer in _layer_tree(self.model)]
+        for layer, _ in trainable: layer.trainable = True  # model.trainable = True leaves a frozen nested backbone frozen
+        self._compile(self.model)
+        ceiling = memory_limit_mb or memory_ceiling_mb()
+        probes, batch_size = [], min_batch_size
+        print(f"\nProbing batch sizes {min_batch_size}-{max_batch_size}" + (f" (ceiling {ceiling:.0f} MB)" if ceiling else ""))
+        while batch_size <= max_batch_size:
+            images, labels, sample_weight = self._probe_batch(batch_size)
+            try:
+                reset_peak_memory()
+                self.model.train_on_batch(images, labels, sample_weight=sample_weight)  # first call at a new shape also traces
+                start = time.perf_counter()
+                self.model.train_on_batch(images, labels, sample_weight=sample_weight)
+                elapsed = time.perf_counter() - start
+            except (tf.errors.ResourceExhaustedError, MemoryError):
+                print(f"  batch {batch_size}: out of memory")
+                if ceiling is None and probes: ceiling = _extrapolate_peak(probes, batch_size)
+                break
+            probes.append({'batch_size': batch_size, 'peak_mb': peak_memory_mb(), 'images_per_sec': batch_size / elapsed})
+            print(f"  batch {batch_size}: peak {probes[-1]['peak_mb']:.0f} MB, {probes[-1]['images_per_sec']:.1f} img/s")
+            if ceiling is not None and probes[-1]['peak_mb'] > ceiling * (1 - headroom): break
+            batch_size *= 2
+
+        for layer, flag in trainable: layer.trainable = flag
+        self.model.set_weights(weights)
+        fits = [p for p in probes if ceiling is None or p['peak_mb'] <= ceiling * (1 - headroom)]
+        if not fits: raise ValueError(f"Batch size {min_batch_size} does not fit in memory")
+        micro_batch = fits[-1]['batch_size']
+        if target_batch_size:
+            self.accumulation_steps = math.ceil(target_batch_size / min(micro_batch, target_batch_size))
+            micro_batch = math.ceil(target_batch_size / self.accumulation_steps)
+        else:
+            self.accumulation_steps = 1
+        self._compile(self.model)  # fresh optimizer state, with accumulation if needed
+
+        self.batch_plan = {'batch_size': micro_batch, 'accumulation_steps': self.accumulation_steps,
+                           'effective_batch_size': micro_batch * self.accumulation_steps,
+                           'memory_ceiling_mb': ceiling, 'headroom': headroom, 'probes': probes}
+        print(f"✓ Batch size {micro_batch} x {self.accumulation_steps} accumulation step(s) = "
+              f"effective batch {self.batch_plan['effective_batch_size']}")
+        return self.batch_plan
+
+    def _probe_batch(self, batch_size: int):
+        """Random (images, labels, sample_weight) train batch for find_batch_size."""
+        return (tf.random.uniform((batch_size, *self.input_shape)),
+                tf.random.uniform((batch_size,), maxval=self.num_classes, dtype=tf.int32), None)
+
+    def train(self, train_dataset, val_dataset, epochs=20, output_dir='models', fine_tune_at=10, progressive_schedule=None, qat_epochs=0,
+              steps_per_epoch=None, validation_steps=None, profile=False, trace_steps=None):
+        """
+        Frozen-backbone training up to `fine_tune_at`, then full fine-tuning until `epochs`.
 
-    def train(self, train_dataset, val_dataset, epochs=20, output_dir='models', fine_tune_at=10):
+        progressive_schedule: optional list of (epochs, image_size, batch_size) stages such as
+            DEFAULT_PROGRESSIVE_SCHEDULE. It replaces `epochs`; datasets are re-batched and resized
+            per stage while the saved model keeps the fixed `input_shape`.
+        qat_epochs: if > 0, finish with quantization-aware fine-tuning; convert_to_tflite then
+            exports a full-integer model calibrated on `train_dataset`.
+        steps_per_epoch / validation_steps: needed for repeated datasets, e.g. per-worker shards from
+            distributed.load_sharded_tfrecord_dataset. Only the chief worker checkpoints and saves.
+        profile: attach a ThroughputProfiler (per-epoch JSON in <output_dir>/profile/<run>, input-bound vs
+            compute-bound verdict); trace_steps=(first, last) also captures a profiler trace for TensorBoard.
+        """
         output_path = Path(output_dir); output_path.mkdir(parents=True, exist_ok=True)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         model_name = f"crop_disease_{self.model_type}_{timestamp}"
         
         callbacks = [
-            keras.callbacks.ModelCheckpoint(str(output_path / f"{model_name}_best.keras"), monitor='val_accuracy', save_best_only=True, mode='max', verbose=1),
             keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1),
-            keras.callbacks.EarlyStopping(monitor='val_accuracy', patience=5, restore_best_weights=True, verbose=1),
-            keras.callbacks.TensorBoard(log_dir=str(output_path / 'logs' / model_name))
+            keras.callbacks.EarlyStopping(monitor=self.monitor[0], mode=self.monitor[1], patience=5, restore_best_weights=True, verbose=1),
         ]
+        if is_chief():
+            callbacks += [
+                keras.callbacks.ModelCheckpoint(str(output_path / f"{model_name}_best.keras"), monitor=self.monitor[0], save_best_only=True, mode=self.monitor[1], verbose=1),
+                keras.callbacks.TensorBoard(log_dir=str(output_path / 'logs' / model_name))
+            ]
+        if profile:
+            callbacks.append(ThroughputProfiler(output_path / 'profile' / model_name, trace_steps=trace_steps,
+                                                trace_dir=output_path / 'logs' / model_name))
+        steps = {'steps_per_epoch': steps_per_epoch, 'validation_steps': validation_steps}
         
-        history = self.model.fit(train_dataset, validation_data=val_dataset, epochs=fine_tune_at, callbacks=callbacks)
+        if progressive_schedule:
+            history = self._fit_progressive(train_dataset, val_dataset, progressive_schedule, fine_tune_at, callbacks)
+        else:
+            fit_train, fit_val = self._fixed_shape(train_dataset), self._fixed_shape(val_dataset)
+            history = self._fit(fit_train, fit_val, 0, fine_tune_at, callbacks, **steps)
         
+        if not progressive_schedule and fine_tune_at < epochs:
+            print(f"\nPhase 2: Fine-tuning entire model...")
+            self._compile_fine_tune()
+            history_fine = self._fit(fit_train, fit_val, fine_tune_at, epochs, callbacks, **steps)
+            _merge_history(history, history_fine)
+
+        if qat_epochs > 0:
+            self.qat_model = fine_tune_qat(self.model, train_dataset, val_dataset, epochs=qat_epochs)
+            self.calibration_dataset = train_dataset
+            
+        if not is_chief(): return history
+        final_model_path = output_path / f"{model_name}_final.keras"
+        self.model.save(final_model_path)
+        self._save_run_metadata(output_path / f"{model_name}_metadata.json", epochs=epochs, fine_tune_at=fine_tune_at,
+                                progressive_schedule=progressive_schedule, qat_epochs=qat_epochs)
+        print(f"\n✓ Training complete! Saved to {final_model_path}")
+        return history
+
+    def _fit(self, train_dataset, val_dataset, initial_epoch, epochs, callbacks, steps_per_epoch=None, validation_steps=None):
+        """model.fit, or the strategy.run loop from distributed.py when training across workers."""
+        if isinstance(self.strategy, tf.distribute.MultiWorkerMirroredStrategy):
+            return fit_multi_worker(self.model, self.strategy, train_dataset, val_dataset, epochs, steps_per_epoch,
+                                    validation_steps, initial_epoch=initial_epoch, callbacks=callbacks)
+        return self.model.fit(train_dataset, validation_data=val_dataset, initial_epoch=initial_epoch, epochs=epochs,
+                              callbacks=callbacks, steps_per_epoch=steps_per_epoch, validation_steps=validation_steps)
+
+    def _fixed_shape(self, dataset, batch_size: Optional[int] = None):
+        """Under XLA, pad the last batch (with zero sample weights) so every step has the same shape."""
+        if not self.jit_compile: return dataset
+        batch_size = batch_size or (self.batch_plan['batch_size'] if self.batch_plan else int(next(iter(dataset))[0].shape[0]))
+        return pad_batches(dataset, batch_size)
+
+    def _save_run_metadata(self, path: Path, **run_config):
+        metadata = {
+            'model_type': self.model_type, 'num_classes': self.num_classes, 'input_shape': list(self.input_shape),
+            'learning_rate': self.learning_rate, 'optimizer': self.optimizer, 'dropout': self.dropout, 'head_units': self.head_units, **run_config,
+            'precision': self.precision, 'batch_plan': self.batch_plan, 'jit_compile': self.jit_compile, 'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        with open(path, 'w') as f: json.dump(metadata, f, indent=2, default=str)
+
+    def _fit_progressive(self, train_dataset, val_dataset, schedule, fine_tune_at, callbacks):
+        """Run the schedule on a resolution-agnostic twin, then copy the weights into the fixed-shape model."""
+        deploy_model = self.model
+        # Best checkpoints are written from the deploy model, not the twin's (None, None) graph
+        callbacks = [_DeployCheckpoint(cb, deploy_model) if isinstance(cb, keras.callbacks.ModelCheckpoint) else cb
+                     for cb in callbacks]
+        self.model = self._build_architecture(False, (None, None, self.input_shape[2]))
+        self.model.set_weights(deploy_model.get_weights())
+        self._compile(self.model)
+
+        history, epoch = None, 0
+        for stage_epochs, image_size, batch_size in schedule:
+            stage_train = self._fixed_shape(resize_batches(train_dataset, image_size, batch_size), batch_size)
+            stage_val = self._fixed_shape(resize_batches(val_dataset, image_size, batch_size), batch_size)
+            stage_end = epoch + stage_epochs
+            print(f"\nStage {image_size}x{image_size} (batch {batch_size}): epochs {epoch + 1}-{stage_end}")
+            # A stage that straddles `fine_tune_at` is split in two fits
+            for boundary in sorted({max(epoch, min(fine_tune_at, stage_end)), stage_end}):
+                if boundary == epoch: continue
+                if epoch == fine_tune_at:
+                    print(f"\nPhase 2: Fine-tuning entire model...")
+                    self._compile_fine_tune()
+                stage_history = self.model.fit(stage_train, validation_data=stage_val, initial_epoch=epoch, epochs=boundary, callbacks=callbacks)
+                history = _merge_history(history, stage_history)
+                epoch = boundary
+
+        deploy_model.trainable = self.model.trainable
+        deploy_model.set_weights(self.model.get_weights())
+        self.model = deploy_model
+        self._compile(self.model)
+        return history
+
+    def distill(self, teacher: keras.Model, train_tfrecord_dir: str, val_dataset, epochs: int = 20,
+                output_dir: str = 'models', temperature: float = 4.0, alpha: float = 0.1,
+                batch_size: int = 64, fine_tune_at: int = 10):
+        """
+        Train this model as a student of `teacher` (e.g. a trained MobileNetV3Large/EfficientNet).
+
+        Teacher soft targets are computed once per TFRecord image and cached next to the shards.
+        Build the student first, e.g. CropDiseaseModel(n, model_type='mobilenetv3_small').build_model().
+        """
+        if self.model is None: raise ValueError("Model not built.")
+        output_path = Path(output_dir); output_path.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        model_name = f"crop_disease_{self.model_type}_distilled_{timestamp}"
+
+        cache_path = cache_teacher_targets(teacher, train_tfrecord_dir, temperature, batch_size=batch_size)
+        train_dataset = load_distillation_dataset(train_tfrecord_dir, cache_path, batch_size=batch_size)
+
+        distiller = Distiller(self.model, temperature=temperature, alpha=alpha)
+        callbacks = [
+            keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1),
+            keras.callbacks.EarlyStopping(monitor='val_accuracy', mode='max', patience=5, restore_best_weights=True, verbose=1),
+            keras.callbacks.TensorBoard(log_dir=str(output_path / 'logs' / model_name))
+        ]
+
+        print(f"\nDistilling {teacher.name} -> {self.model.name} (T={temperature}, alpha={alpha})")
+        distiller.compile(optimizer=keras.optimizers.Adam(learning_rate=self.learning_rate), metrics=['accuracy'])
+        history = distiller.fit(train_dataset, validation_data=val_dataset, epochs=min(fine_tune_at, epochs), callbacks=callbacks)
+
+        if fine_tune_at < epochs:
+            print(f"\nPhase 2: Fine-tuning entire student...")
+            self.model.trainable = True
+            distiller.compile(optimizer=keras.optimizers.Adam(learning_rate=1e-5), metrics=['accuracy'])
+            history_fine = distiller.fit(train_dataset, validation_data=val_dataset, initial_epoch=fine_tune_at, epochs=epochs, callbacks=callbacks)
+            _merge_history(history, history_fine)
+
+        self._compile(self.model)
+        final_model_path = output_path / f"{model_name}_final.keras"
+        self.model.save(final_model_path)
+        print(f"\n✓ Distillation complete! Student saved to {final_model_path}")
+        return history
+
+    def train_hard_mining(self, train_tfrecord_dir: str, val_dataset, epochs: int = 20, output_dir: str = 'models',
+                          fine_tune_at: int = 10, batch_size: int = 64, warmup_epochs: int = 2, budget: float = 0.5,
+                          uniform_mix: float = 0.2, max_repeats: int = 3):
+        """
+        Like train(), but after `warmup_epochs` uniform epochs each epoch draws `budget` x dataset size
+        samples in proportion to their last training loss: easy images are skipped, hard ones repeated.
+        Writes <run>_hard_mining.json with the images processed vs. uniform training and the hardest samples.
+        """
+        if self.model is None: raise ValueError("Model not built.")
+        output_path = Path(output_dir); output_path.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        model_name = f"crop_disease_{self.model_type}_mined_{timestamp}"
+
+        miner = HardExampleMiner(train_tfrecord_dir, warmup_epochs, budget, uniform_mix, max_repeats)
+        train_dataset = miner.dataset(batch_size)
+        trainer = HardExampleTrainer(self.model, miner)
+        callbacks = [
+            HardExampleSampler(miner),
+            keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1),
+            keras.callbacks.EarlyStopping(monitor='val_accuracy', mode='max', patience=5, restore_best_weights=True, verbose=1),
+            keras.callbacks.TensorBoard(log_dir=str(output_path / 'logs' / model_name))
+        ]
+
+        print(f"\nHard-example mining over {miner.num_records:,} records (warm-up {warmup_epochs}, budget {budget:.0%})")
+        trainer.compile(optimizer=self._make_optimizer(self.optimizer, self.learning_rate), metrics=['accuracy'])
+        history = trainer.fit(train_dataset, validation_data=val_dataset, epochs=min(fine_tune_at, epochs), callbacks=callbacks)
+
         if fine_tune_at < epochs:
             print(f"\nPhase 2: Fine-tuning entire model...")
             self.model.trainable = True
-            self.model.compile(optimizer=keras.optimizers.Adam(learning_rate=1e-5), loss='sparse_categorical_crossentropy', metrics=['accuracy'])
-            history_fine = self.model.fit(train_dataset, validation_data=val_dataset, initial_epoch=fine_tune_at, epochs=epochs, callbacks=callbacks)
-            for k in history.history: history.history[k].extend(history_fine.history[k])
-            
+            trainer.compile(optimizer=self._make_optimizer('adam', 1e-5), metrics=['accuracy'])
+            history_fine = trainer.fit(train_dataset, validation_data=val_dataset, initial_epoch=fine_tune_at, epochs=epochs, callbacks=callbacks)
+            _merge_history(history, history_fine)
+
+        self._compile(self.model)
+        val_accuracy = max(history.history.get('val_accuracy', [0.0]))
+        save_mining_report(miner, output_path / f"{model_name}_hard_mining.json", val_accuracy)
         final_model_path = output_path / f"{model_name}_final.keras"
         self.model.save(final_model_path)
+        self._save_run_metadata(output_path / f"{model_name}_metadata.json", epochs=epochs, fine_tune_at=fine_tune_at,
+                                hard_mining={'warmup_epochs': warmup_epochs, 'budget': budget, 'uniform_mix': uniform_mix,
+                                             'max_repeats': max_repeats})
         print(f"\n✓ Training complete! Saved to {final_model_path}")
         return history
 
-    def convert_to_tflite(self, output_path: str, quantize: bool = True):
-        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
-        if quantize:
-            converter.optimizations = [tf.lite.Optimize.DEFAULT]
-            converter.target_spec.supported_types = [tf.int8]
-        tflite_model = converter.convert()
-        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-        with open(output_path, 'wb') as f: f.write(tflite_model)
-        print(f"✓ TFLite model saved to: {output_path}")
-
-def prepare_training_data(raw_data_dir: str, output_dir: str, val_split: float = 0.2, batch_size: int = 64):
+    def prune(self, train_dataset, val_dataset, sparsity_levels=(0.25, 0.5, 0.75), mode: str = 'magnitude',
+              epochs_per_level: int = 2, output_dir: str = 'models', quantize: bool = True, calibration_dataset=None):
+        """
+        Iteratively prune the trained model through `sparsity_levels` with a short fine-tune per level.
+        Each level ramps up from the previous one over its first `epochs_per_level - 1` epochs and
+        recovers for one epoch at the target.
+
+        mode: 'magnitude' zeroes individual weights, 'channel' zeroes whole output channels and then
+            removes the zeroed units of Dense layers (e.g. a head_units=1024 head) from the exported model.
+        Masks live in the callback, so the pruned model is a plain Keras model with nothing to strip;
+        each level is exported (dense or sparse weight storage, whichever is smaller) and measured.
+        self.model ends at the last level, with the pruned Dense units removed.
+        """
+        output_path = Path(output_dir); output_path.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        model_name = f"crop_disease_{self.model_type}_pruned_{mode}_{timestamp}"
+        sample_image = (next(iter(val_dataset))[0][0].numpy() * 255).astype('uint8')
+
+        def measure(level):
+            tflite_path = output_path / f"{model_name}_{int(level * 100)}.tflite"
+            compact, removed = remove_pruned_units(self.model) if mode == 'channel' else (self.model, {})
+            encodings = self._export_tflite(compact, str(tflite_path), quantize, calibration_dataset)
+            tflite_model = tflite_path.read_bytes()
+            metrics = self.model.evaluate(val_dataset, return_dict=True, verbose=0)  # same outputs as `compact`
+            entry = {
+                'target_sparsity': level,
+                **sparsity_report(compact, mode),
+                'removed_units': removed,
+                'tflite_kb': round(len(tflite_model) / 1024, 1),
+                **(encodings or {}),
+                'latency_ms': measure_latency(tflite_model, sample_image, num_threads=1)['median_ms'],
+                'val_accuracy': float(metrics.get('accuracy', 0.0)),
+            }
+            print(f"  sparsity {level:.2f}: {entry['nonzero_params']:,}/{entry['total_params']:,} params, "
+                  f"{entry['tflite_kb']:.0f} KB, {entry['latency_ms']:.2f} ms, val_acc {entry['val_accuracy']:.4f}")
+            return entry
+
+        print(f"\nPruning ({mode}) through sparsity levels {list(sparsity_levels)}...")
+        self._compile_fine_tune()
+        report = [measure(0.0)]
+        previous = 0.0
+        for level in sparsity_levels:
+            callback = PruningCallback(self.model, level, previous, ramp_epochs=epochs_per_level - 1, mode=mode)
+            self.model.fit(train_dataset, validation_data=val_dataset, epochs=epochs_per_level, callbacks=[callback])
+            self.pruned = True
+            report.append(measure(level))
+            previous = level
+
+        if mode == 'channel':
+            self.model, removed = remove_pruned_units(self.model)
+            if removed: self._compile_fine_tune()
+        self.model.save(output_path / f"{model_name}_final.keras")
+        with open(output_path / f"{model_name}_report.json", 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Pruning complete! Report saved to {output_path / f'{model_name}_report.json'}")
+        return report
+
+    def convert_to_tflite(self, output_path: str, quantize: bool = True, calibration_dataset=None):
+        """
+        quantize=True exports full int8 with float I/O when calibration data is available
+        (`calibration_dataset` batches, or the QAT training data) and dynamic-range otherwise.
+        Use quantization_workbench.py to compare all variants before shipping one.
+        """
+        if not is_chief(): return  # in multi-worker runs only the chief exports
+        if quantize and self.qat_model is not None:
+            convert_qat_to_tflite(self.qat_model, representative_dataset_from(calibration_dataset if calibration_dataset is not None else self.calibration_dataset), output_path)
+            return
+        return self._export_tflite(self.model, output_path, quantize, calibration_dataset)
+
+    def _export_tflite(self, model: keras.Model, output_path: str, quantize: bool, calibration_dataset=None) -> Optional[Dict]:
+        """Convert and save `model`; pruned models keep the smaller of dense and sparse weight storage (sizes returned)."""
+        representative = representative_dataset_from(calibration_dataset) if calibration_dataset is not None else None
+        variant = 'float32' if not quantize else ('int8_float_io' if representative else 'dynamic_range')
+        if self.pruned:
+            tflite_model, encodings = convert_smallest(model, variant, representative)
+        else:
+            tflite_model, encodings = convert_variant(model, variant, representative), None
+        save_tflite(tflite_model, output_path)
+        note = f", {encodings['encoding']} weights: dense {encodings['dense_kb']:.0f} KB / sparse {encodings['sparse_kb']:.0f} KB" if encodings else ""
+        print(f"✓ TFLite model ({variant}{note}) saved to: {output_path}")
+        return encodings
+
+    def export_to_assets(self, name: str, labels_file: str, class_names: Sequence[str], assets_dir: Path = ASSETS_DIR,
+                         quantize: bool = True, calibration_dataset=None) -> Path:
+        """
+        convert_to_tflite into <assets_dir>/<name>.tflite and write `labels_file` next to it in this
+        model's class order (`class_names` from prepare_training_data), the names src/tflite_runner.MODEL_LABELS expects.
+        """
+        if len(class_names) != self.num_classes:
+            raise ValueError(f"{len(class_names)} class names for a {self.num_classes}-class model")
+        assets_dir = Path(assets_dir); assets_dir.mkdir(parents=True, exist_ok=True)
+        tflite_path = assets_dir / f"{name}.tflite"
+        self.convert_to_tflite(str(tflite_path), quantize, calibration_dataset)
+        if is_chief():
+            with open(assets_dir / labels_file, 'w') as f: f.write('\n'.join(class_names) + '\n')
+            print(f"✓ Labels saved to: {assets_dir / labels_file}")
+        return tflite_path
+
+def _extrapolate_peak(probes, batch_size):
+    """Linear estimate of peak memory at `batch_size` (the size that ran out of memory)."""
+    if len(probes) == 1: return probes[0]['peak_mb'] * batch_size / probes[0]['batch_size']
+    (b1, m1), (b2, m2) = [(p['batch_size'], p['peak_mb']) for p in probes[-2:]]
+    return m2 + (m2 - m1) / (b2 - b1) * (batch_size - b2)
+
+def _layer_tree(layer):
+    """`layer` and every nested layer, parents before children (so trainable flags restore in order)."""
+    yield layer
+    for sub in getattr(layer, 'layers', []): yield from _layer_tree(sub)
+
+def _merge_history(history, extra):
+    """Append the per-epoch logs of `extra` to `history`, or adopt `extra` if there is none yet."""
+    if history is None: return extra
+    for k in history.history: history.history[k].extend(extra.history.get(k, []))
+    return history
+
+class _DeployCheckpoint(keras.callbacks.Callback):
+    """Runs `checkpoint` on `deploy_model` with the trained model's weights, so the file holds the fixed-shape graph."""
+
+    def __init__(self, checkpoint: keras.callbacks.ModelCheckpoint, deploy_model: keras.Model):
+        super().__init__()
+        self.checkpoint, self.deploy_model = checkpoint, deploy_model
+
+    def set_model(self, model):
+        super().set_model(model)
+        self.checkpoint.set_model(self.deploy_model)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.deploy_model.trainable = self.model.trainable
+        self.deploy_model.set_weights(self.model.get_weights())
+        self.checkpoint.on_epoch_end(epoch, logs)
+
+def prepare_training_data(raw_data_dir: str, output_dir: str, val_split: float = 0.2, batch_size: int = 64, num_parallel_calls: int = tf.data.AUTOTUNE,
+                          data_service: Optional[str] = None, quality_gate=None):
+    """quality_gate: e.g. src/quality_gate.QualityGate(), drops blurry/badly exposed/tiny images from both splits."""
     print(f"Preparing training data from {raw_data_dir}...")
-    processor = CropDiseaseDatasetProcessor(batch_size=batch_size, augmentation=True)
+    processor = CropDiseaseDatasetProcessor(batch_size=batch_size, augmentation=True, quality_gate=quality_gate)
     class_folders = sorted([d for d in Path(raw_data_dir).iterdir() if d.is_dir()])
     class_names = [f.name for f in class_folders]
     labels_map = {}
@@ -132,12 +562,12 @@ def prepare_training_data(raw_data_dir: str, output_dir: str, val_split: float =
     processor.process_and_save_tfrecords(raw_data_dir, str(train_output), labels_map={f: labels_map[f] for f in train_files})
     processor.process_and_save_tfrecords(raw_data_dir, str(val_output), labels_map={f: labels_map[f] for f in val_files})
     
-    train_ds = load_tfrecord_dataset(str(train_output), batch_size=batch_size, shuffle=True)
-    val_ds = load_tfrecord_dataset(str(val_output), batch_size=batch_size, shuffle=False)
+    train_ds = load_tfrecord_dataset(str(train_output), batch_size=batch_size, shuffle=True, num_parallel_calls=num_parallel_calls, data_service=data_service)
+    val_ds = load_tfrecord_dataset(str(val_output), batch_size=batch_size, shuffle=False, num_parallel_calls=num_parallel_calls, data_service=data_service)
     
     return train_ds, val_ds, len(class_names), class_names
 
-def load_tfrecord_dataset(tfrecord_dir, batch_size=64, shuffle=True):
+def load_tfrecord_dataset(tfrecord_dir, batch_size=64, shuffle=True, num_parallel_calls=tf.data.AUTOTUNE, data_service=None):
     # Proxy to dataset_processor's method or reimplement if independent
     from dataset_processor import load_tfrecord_dataset as load_tf
-    return load_tf(tfrecord_dir, batch_size, shuffle)
+    return load_tf(tfrecord_dir, batch_size, shuffle, num_parallel_calls=num_parallel_calls, data_service=data_service)
@@ -23,6 +23,7 @@ except ImportError:
     # Handle direct script execution
     import sys
     sys.path.append(os.path.dirname(__file__))
+    from gpu_utils import setup_gpu, enable_mixed_precision
     from dataset_processor import CropDiseaseDatasetProcessor, load_tfrecord_dataset
 
 class CropDiseaseModel:
@@ -36,10 +37,8 @@ class CropDiseaseModel:
         self.model_type = model_type
         self.model = None
         
-        # Mixed precision
-        if use_mixed_precision:
-            policy = keras.mixed_precision.Policy('mixed_float16')
-            keras.mixed_precision.set_global_policy(policy)
+        # Precision policy resolved from the hardware (float32 unless a low precision is native and faster)
+        self.precision = enable_mixed_precision('auto' if use_mixed_precision else 'float32')
 
     def build_model(self, pretrained: bool = True) -> keras.Model:
         if self.model_type == 'mobilenetv3':
@@ -60,3 +59,5 @@ class CropDiseaseModel:
         self.model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
         self.model.fit(train_dataset, validation_data=val_dataset, epochs=epochs)
         self.model.save(os.path.join(output_dir, "gpu_model_final.keras"))
+        with open(os.path.join(output_dir, "gpu_model_metadata.json"), 'w') as f:
+            json.dump({'model_type': self.model_type, 'epochs': epochs, 'precision': self.precision}, f, indent=2)
@@ -0,0 +1,96 @@
+"""
+XLA Benchmark
+Compares train-step and inference time of CropDiseaseModel with and without XLA (jit_compile)
+on the current device, using synthetic fixed-shape batches.
+
+Usage:
+    python xla_benchmark.py --model-type mobilenetv3 --batch-size 32 --steps 20
+"""
+
+import argparse
+import json
+import time
+from typing import Dict
+
+import numpy as np
+import tensorflow as tf
+
+from gpu_utils import enable_xla_cache
+from train_model import CropDiseaseModel
+
+
+def _median_ms(fn, warmup: int, steps: int) -> Dict[str, float]:
+    start = time.perf_counter()
+    fn()
+    first_ms = (time.perf_counter() - start) * 1000  # includes tracing / XLA compilation
+    for _ in range(warmup - 1): fn()
+    timings = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'first_call_ms': first_ms, 'median_ms': float(np.median(timings))}
+
+
+def benchmark(model_type: str = 'mobilenetv3', image_size: int = 224, batch_size: int = 32, num_classes: int = 38,
+              steps: int = 20, warmup: int = 3, mixed_precision: bool = False) -> Dict:
+    """Median train-step / inference latency for jit_compile False vs True on identical weights and data."""
+    images = tf.random.uniform((batch_size, image_size, image_size, 3))
+    labels = tf.random.uniform((batch_size,), maxval=num_classes, dtype=tf.int32)
+    results, weights = {}, None
+    for jit in (False, True):
+        wrapper = CropDiseaseModel(num_classes, (image_size, image_size, 3), model_type, use_mixed_precision=mixed_precision)
+        model = wrapper.build_model(pretrained=False)
+        if weights is None: weights = model.get_weights()
+        model.set_weights(weights)
+        model.trainable = True
+        wrapper.compile_model(jit_compile=jit)
+        predict_fn = tf.function(lambda x: model(x, training=False), jit_compile=jit)
+
+        label = 'xla' if jit else 'default'
+        print(f"\n[{label}] timing {steps} train steps and inference batches...")
+        results[label] = {
+            'train_step': _median_ms(lambda: model.train_on_batch(images, labels), warmup, steps),
+            'inference': _median_ms(lambda: predict_fn(images).numpy(), warmup, steps),
+        }
+
+    report = {
+        'device': 'GPU' if tf.config.list_physical_devices('GPU') else 'CPU',
+        'model_type': model_type, 'image_size': image_size, 'batch_size': batch_size, **results,
+        'train_speedup': results['default']['train_step']['median_ms'] / results['xla']['train_step']['median_ms'],
+        'inference_speedup': results['default']['inference']['median_ms'] / results['xla']['inference']['median_ms'],
+    }
+    print("\n" + "=" * 70)
+    print(f"XLA BENCHMARK ({report['device']}, {model_type}, batch {batch_size}, {image_size}px)")
+    print("=" * 70)
+    print(f"{'':<12}{'train ms':>12}{'1st train ms':>14}{'infer ms':>12}{'1st infer ms':>14}")
+    for label in ('default', 'xla'):
+        r = results[label]
+        print(f"{label:<12}{r['train_step']['median_ms']:>12.1f}{r['train_step']['first_call_ms']:>14.0f}"
+              f"{r['inference']['median_ms']:>12.1f}{r['inference']['first_call_ms']:>14.0f}")
+    print(f"Speedup: train x{report['train_speedup']:.2f}, inference x{report['inference_speedup']:.2f}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CropDiseaseModel step time with and without XLA")
+    parser.add_argument('--model-type', default='mobilenetv3')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--num-classes', type=int, default=38)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--mixed-precision', action='store_true')
+    parser.add_argument('--xla-cache', default='xla_cache', help="Persistent XLA compilation cache directory")
+    parser.add_argument('--output', help="Optional JSON report path")
+    args = parser.parse_args()
+
+    enable_xla_cache(args.xla_cache)  # before TensorFlow initialises; 1st XLA call is fast on reruns
+    report = benchmark(args.model_type, args.image_size, args.batch_size, args.num_classes, args.steps,
+                       mixed_precision=args.mixed_precision)
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+        print(f"✓ Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Leaf-Check -> Disease Cascade
+Decodes each upload once into a shared buffer, optionally screens it with the OpenCV quality gate
+(quality_gate.py: blur, exposure, resolution), and runs the cheap MobileNetV3Small leaf gate
+(leaf_check.tflite) before the disease model. Only images the gate accepts as leaves reach
+disease_detection.tflite; the rest stop early with a reason. Per-stage latency and the share of
+traffic that stops at each stage are tracked, so the compute saved on non-leaf uploads is visible.
+
+The inference service exposes the same cascade as POST /predict/cascade, with each stage
+micro-batched.
+
+Usage:
+    python src/cascade.py --input datasets/leaf_check --leaf-threshold 0.5 --batch-size 16 --quality-gate
+"""
+
+import argparse
+import json
+import pathlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from quality_gate import QualityGate, QualityRejected, add_threshold_args, gate_from_args
+from tflite_runner import (ASSETS_DIR, BatchedTFLiteRunner, decode_rgb, load_disease_info, load_labels,
+                           to_model_input, top_k_predictions)
+
+LEAF_CHECK, DISEASE = 'leaf_check', 'disease_detection'
+STAGES = ('decode', LEAF_CHECK, DISEASE)
+QUALITY = 'quality'
+
+
+class SharedImage:
+    """
+    An upload decoded once; every stage reads its input size from the same buffer, resized at most once per size.
+    `quality` is the QualityGate report once the image has been checked.
+    """
+
+    def __init__(self, data: bytes):
+        self.rgb = decode_rgb(data)
+        self.quality: Optional[Dict] = None
+        self._inputs: Dict[Tuple[int, int], np.ndarray] = {}
+
+    def at(self, size: Tuple[int, int]) -> np.ndarray:
+        if size not in self._inputs:
+            self._inputs[size] = to_model_input(self.rgb, size)
+        return self._inputs[size]
+
+
+class CascadeStats:
+    """Images entering each stage, time spent in it, and where each image stopped."""
+
+    def __init__(self, stages: Sequence[str] = STAGES):
+        self.images = 0
+        self.entered = {stage: 0 for stage in stages}
+        self.stage_ms = {stage: 0.0 for stage in stages}
+        self.stopped = {stage: 0 for stage in stages}
+
+    def record(self, stage: str, images: int, ms: float):
+        self.entered[stage] += images
+        self.stage_ms[stage] += ms
+
+    def summary(self) -> Dict:
+        images = self.images or 1
+        return {
+            'images': self.images,
+            'stages': {stage: {'images': self.entered[stage], 'reached_fraction': self.entered[stage] / images,
+                               'ms_per_image': self.stage_ms[stage] / max(self.entered[stage], 1),
+                               'stopped_fraction': self.stopped[stage] / images} for stage in self.entered},
+            'ms_per_image': sum(self.stage_ms.values()) / images,
+        }
+
+
+class CascadeEngine:
+    """
+    leaf_model: two-class leaf check (see MODEL_LABELS), gate passes when p(leaf) >= leaf_threshold.
+    disease_model: the disease classifier run on the images that pass.
+    quality_gate: optional OpenCV pre-filter between decoding and the leaf check; images it rejects stop
+        at the 'quality' stage, unless reject_low_quality is False (the report is then only attached).
+    diagnoser: optional ConfidenceCascade that replaces the single disease model for the images that pass
+        (its 'stopped_at' / 'escalate' fields are kept; the 'disease_detection' stage then times the whole cascade).
+    """
+
+    def __init__(self, leaf_model: BatchedTFLiteRunner, disease_model: BatchedTFLiteRunner,
+                 leaf_threshold: float = 0.5, disease_info: Optional[Dict[str, Dict]] = None, top_k: int = 3,
+                 quality_gate: Optional[QualityGate] = None, reject_low_quality: bool = True, diagnoser=None):
+        self.leaf_model, self.disease_model = leaf_model, disease_model
+        self.diagnoser = diagnoser
+        self.leaf_index = leaf_model.labels.index('leaf')
+        self.leaf_threshold = leaf_threshold
+        self.disease_info = disease_info or {}
+        self.top_k = top_k
+        self.quality_gate, self.reject_low_quality = quality_gate, reject_low_quality
+        self.stats = CascadeStats(('decode', QUALITY, LEAF_CHECK, DISEASE) if quality_gate else STAGES)
+
+    @classmethod
+    def from_assets(cls, assets_dir: pathlib.Path = ASSETS_DIR, leaf_threshold: float = 0.5,
+                    batch_sizes: Sequence[int] = (1, 4, 16), num_threads: Optional[int] = None,
+                    quality_gate: Optional[QualityGate] = None) -> 'CascadeEngine':
+        assets_dir = pathlib.Path(assets_dir)
+        runners = [BatchedTFLiteRunner(assets_dir / f"{name}.tflite", load_labels(assets_dir, name), batch_sizes, num_threads)
+                   for name in (LEAF_CHECK, DISEASE)]
+        return cls(*runners, leaf_threshold, load_disease_info(assets_dir / "disease_info.json"), quality_gate=quality_gate)
+
+    def _gate(self, leaf_probs: np.ndarray) -> Dict:
+        p_leaf = float(leaf_probs[self.leaf_index])
+        result = {'leaf_probability': p_leaf, 'is_leaf': p_leaf >= self.leaf_threshold}
+        if not result['is_leaf']:
+            result.update(stopped_at=LEAF_CHECK, predictions=[],
+                          reason=f"Not a leaf (p={p_leaf:.2f} < {self.leaf_threshold:.2f}); retake the photo of a single leaf")
+            self.stats.stopped[LEAF_CHECK] += 1
+        return result
+
+    def _diagnose(self, result: Dict, disease_probs: np.ndarray, top_k: Optional[int] = None) -> Dict:
+        result.update(stopped_at=DISEASE, predictions=top_k_predictions(disease_probs, self.disease_model.labels,
+                                                                          self.disease_info, top_k or self.top_k))
+        self.stats.stopped[DISEASE] += 1
+        return result
+
+    def _timed(self, stage: str, images: int, fn: Callable, *args):
+        start = time.perf_counter()
+        out = fn(*args)
+        self.stats.record(stage, images, (time.perf_counter() - start) * 1000)
+        return out
+
+    def decode(self, data: bytes) -> SharedImage:
+        """Decode into a shared buffer; a ValueError stops the image at the decode stage."""
+        start = time.perf_counter()
+        try:
+            return SharedImage(data)
+        except ValueError:
+            self.stats.stopped['decode'] += 1
+            raise
+        finally:
+            self.stats.record('decode', 1, (time.perf_counter() - start) * 1000)
+
+    def check_quality(self, image: SharedImage):
+        """Run the quality gate (if any) and attach its report; QualityRejected stops the image at the quality stage."""
+        if self.quality_gate is None:
+            return
+        start = time.perf_counter()
+        try:
+            image.quality = self.quality_gate.enforce(image.rgb, self.reject_low_quality)
+        except QualityRejected:
+            self.stats.stopped[QUALITY] += 1
+            raise
+        finally:
+            self.stats.record(QUALITY, 1, (time.perf_counter() - start) * 1000)
+
+    def run(self, uploads: Sequence[bytes]) -> List[Dict]:
+        """Cascade a batch of encoded images: one leaf-gate invoke, then one disease invoke for the leaves."""
+        results: List[Dict] = []
+        images: List[SharedImage] = []
+        for data in uploads:
+            self.stats.images += 1
+            try:
+                image = self.decode(data)
+                self.check_quality(image)
+                images.append(image)
+                results.append({'quality': image.quality} if image.quality else {})
+            except QualityRejected as e:
+                images.append(None)
+                results.append({'stopped_at': QUALITY, 'reason': str(e), 'quality': e.report, 'predictions': []})
+            except ValueError as e:
+                images.append(None)
+                results.append({'stopped_at': 'decode', 'reason': str(e), 'predictions': []})
+        decoded = [i for i, image in enumerate(images) if image is not None]
+        if not decoded:
+            return results
+
+        leaf_batch = np.stack([images[i].at(self.leaf_model.image_size) for i in decoded])
+        leaf_probs = self._timed(LEAF_CHECK, len(decoded), self.leaf_model.predict_batch, leaf_batch)
+        for i, probs in zip(decoded, leaf_probs):
+            results[i].update(self._gate(probs))
+
+        leaves = [i for i in decoded if results[i]['is_leaf']]
+        if leaves and self.diagnoser:
+            diagnoses = self._timed(DISEASE, len(leaves), self.diagnoser.run, [images[i] for i in leaves])
+            for i, diagnosis in zip(leaves, diagnoses):
+                results[i].update(diagnosis)
+            self.stats.stopped[DISEASE] += len(leaves)
+        elif leaves:
+            disease_batch = np.stack([images[i].at(self.disease_model.image_size) for i in leaves])
+            disease_probs = self._timed(DISEASE, len(leaves), self.disease_model.predict_batch, disease_batch)
+            for i, probs in zip(leaves, disease_probs):
+                self._diagnose(results[i], probs)
+        return results
+
+    async def run_async(self, image: SharedImage,
+                        submit: Callable[[str, np.ndarray], Awaitable[Tuple[np.ndarray, int]]],
+                        top_k: Optional[int] = None) -> Dict:
+        """Cascade one decoded image, handing each stage's input to `submit(model_name, input)` (e.g. a micro-batcher)."""
+        self.stats.images += 1
+        start = time.perf_counter()
+        leaf_probs, _ = await submit(LEAF_CHECK, image.at(self.leaf_model.image_size))
+        self.stats.record(LEAF_CHECK, 1, (time.perf_counter() - start) * 1000)
+        result = self._gate(leaf_probs)
+        if result['is_leaf'] and self.diagnoser:
+            start = time.perf_counter()
+            result.update(await self.diagnoser.run_async(image, submit, top_k))
+            self.stats.record(DISEASE, 1, (time.perf_counter() - start) * 1000)
+            self.stats.stopped[DISEASE] += 1
+        elif result['is_leaf']:
+            start = time.perf_counter()
+            disease_probs, _ = await submit(DISEASE, image.at(self.disease_model.image_size))
+            self.stats.record(DISEASE, 1, (time.perf_counter() - start) * 1000)
+            self._diagnose(result, disease_probs, top_k)
+        return result
+
+
+def print_summary(summary: Dict):
+    print("\n" + "=" * 64)
+    print(f"CASCADE SUMMARY ({summary['images']} images)")
+    print("=" * 64)
+    print(f"{'stage':<22}{'images':>10}{'ms/img':>10}{'stopped here':>16}")
+    for stage, s in summary['stages'].items():
+        print(f"{stage:<22}{s['images']:>10}{s['ms_per_image']:>10.2f}{s['stopped_fraction']:>16.1%}")
+    last, reached = list(summary['stages'].items())[-1]
+    print(f"\nAverage cost {summary['ms_per_image']:.2f} ms/image; {last} skipped for "
+          f"{1 - reached['reached_fraction']:.1%} of images")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Leaf-check gate -> disease model cascade over a folder of images")
+    parser.add_argument('--input', required=True, help="Image directory (searched recursively)")
+    parser.add_argument('--assets', default=str(ASSETS_DIR))
+    parser.add_argument('--leaf-threshold', type=float, default=0.5)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--output', help="Optional JSON-lines results path (summary goes to <output>.summary.json)")
+    parser.add_argument('--quality-gate', action='store_true', help="Reject blurry, badly exposed or tiny images before the leaf check")
+    add_threshold_args(parser)
+    args = parser.parse_args()
+
+    from interpreter_pool import find_images
+    paths = find_images(args.input)
+    engine = CascadeEngine.from_assets(pathlib.Path(args.assets), args.leaf_threshold, batch_sizes=(1, args.batch_size),
+                                       quality_gate=gate_from_args(args) if args.quality_gate else None)
+    out = open(args.output, 'w') if args.output else None
+    for start in range(0, len(paths), args.batch_size):
+        chunk = paths[start:start + args.batch_size]
+        for path, result in zip(chunk, engine.run([pathlib.Path(p).read_bytes() for p in chunk])):
+            if out: out.write(json.dumps({'path': path, **result}) + '\n')
+    summary = engine.stats.summary()
+    print_summary(summary)
+    if out:
+        out.close()
+        with open(f"{args.output}.summary.json", 'w') as f: json.dump(summary, f, indent=2)
+        print(f"✓ Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Confidence-Gated Disease Cascade
+Runs a small disease model first: the distilled MobileNetV3Small student, exported to
+assets/disease_detection_small.tflite with labels_disease_small.txt by gpu_pipeline's
+CropDiseaseModel.export_to_assets (the labels must match labels_disease.txt). An image escalates
+to the MobileNetV3Large disease_detection.tflite only when the small model's top-1 confidence (or
+top-1 - top-2 margin) is under a calibrated threshold. Images the large model is also unsure about are flagged for
+the Gemini path.
+
+`calibrate` picks each stage's threshold on a held-out labelled set, so the images a stage
+answers meet a target accuracy. It then reports the resulting average cost per image.
+
+Usage:
+    python src/confidence_cascade.py calibrate --data datasets/holdout --target-accuracy 0.95
+    python src/confidence_cascade.py run --input uploads/
+"""
+
+import argparse
+import json
+import pathlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cascade import DISEASE, CascadeStats, SharedImage
+from tflite_runner import (ASSETS_DIR, BatchedTFLiteRunner, benchmark_batch_sizes, load_disease_info, load_labels,
+                           normalize_name, top_k_predictions)
+
+SMALL = 'disease_detection_small'
+GEMINI = 'gemini'
+THRESHOLDS_FILE = 'cascade_thresholds.json'
+DEFAULT_STAGES = (SMALL, DISEASE)
+DEFAULT_GEMINI_MS = 4000.0  # rough round trip of the Gemini path, only used for cost estimates
+
+
+def gate_score(probs: np.ndarray, criterion: str = 'confidence') -> np.ndarray:
+    """Top-1 probability ('confidence') or top-1 minus top-2 ('margin') along the last axis."""
+    top2 = np.sort(probs, axis=-1)[..., -2:]
+    return top2[..., 1] if criterion == 'confidence' else top2[..., 1] - top2[..., 0]
+
+
+def check_label_order(runners: Dict[str, BatchedTFLiteRunner]):
+    """Every stage must predict the same classes in the same order, or escalating would swap diagnoses."""
+    (first, reference), *rest = runners.items()
+    mismatched = [name for name, runner in rest if runner.labels != reference.labels]
+    if mismatched:
+        raise ValueError(f"Cascade stages {mismatched} have different labels from {first}; "
+                         f"export them from the same dataset (see gpu_pipeline CropDiseaseModel.export_to_assets)")
+
+
+class ConfidenceCascade:
+    """
+    stages: (name, runner) pairs, cheapest first; thresholds: one per stage. An image stops at the
+    first stage whose gate score reaches its threshold; past the last one it is marked `escalate`
+    (the Gemini path) and carries the last stage's predictions.
+    """
+
+    def __init__(self, stages: Sequence[Tuple[str, BatchedTFLiteRunner]], thresholds: Sequence[float],
+                 criterion: str = 'confidence', disease_info: Optional[Dict[str, Dict]] = None, top_k: int = 3):
+        if len(stages) != len(thresholds):
+            raise ValueError(f"{len(stages)} stages but {len(thresholds)} thresholds")
+        check_label_order(dict(stages))
+        self.stages = list(stages)
+        self.thresholds = list(thresholds)
+        self.criterion = criterion
+        self.disease_info = disease_info or {}
+        self.top_k = top_k
+        self.stats = CascadeStats([name for name, _ in self.stages] + [GEMINI])
+
+    @classmethod
+    def from_config(cls, config_path: pathlib.Path, runners: Dict[str, BatchedTFLiteRunner],
+                    disease_info: Optional[Dict[str, Dict]] = None) -> 'ConfidenceCascade':
+        """Stages and thresholds saved by `calibrate`, run on already loaded `runners` (keyed by model name)."""
+        with open(config_path) as f:
+            config = json.load(f)
+        missing = [s['model'] for s in config['stages'] if s['model'] not in runners]
+        if missing:
+            raise FileNotFoundError(f"Cascade stages {missing} have no loaded model")
+        return cls([(s['model'], runners[s['model']]) for s in config['stages']],
+                   [s['threshold'] for s in config['stages']], config['criterion'], disease_info)
+
+    @classmethod
+    def from_assets(cls, assets_dir: pathlib.Path = ASSETS_DIR, config_path: Optional[pathlib.Path] = None,
+                    batch_sizes: Sequence[int] = (1, 4, 16), num_threads: Optional[int] = None) -> 'ConfidenceCascade':
+        """Load the calibrated stages (assets/cascade_thresholds.json by default) from `assets_dir`."""
+        assets_dir = pathlib.Path(assets_dir)
+        config_path = pathlib.Path(config_path or assets_dir / THRESHOLDS_FILE)
+        with open(config_path) as f:
+            models = [s['model'] for s in json.load(f)['stages']]
+        runners = {m: BatchedTFLiteRunner(assets_dir / f"{m}.tflite", load_labels(assets_dir, m), batch_sizes, num_threads)
+                   for m in models}
+        return cls.from_config(config_path, runners, load_disease_info(assets_dir / "disease_info.json"))
+
+    def _result(self, stage: str, probs: np.ndarray, accepted: bool, top_k: Optional[int]) -> Dict:
+        self.stats.stopped[stage if accepted else GEMINI] += 1
+        return {'stopped_at': stage if accepted else GEMINI, 'escalate': not accepted,
+                'score': float(gate_score(probs, self.criterion)),
+                'predictions': top_k_predictions(probs, self.stages[0][1].labels, self.disease_info, top_k or self.top_k)}
+
+    def run(self, images: Sequence[SharedImage], top_k: Optional[int] = None) -> List[Dict]:
+        """Cascade decoded images, one invoke per stage over the images still unresolved."""
+        results: List[Optional[Dict]] = [None] * len(images)
+        pending = list(range(len(images)))
+        self.stats.images += len(images)
+        for i, ((name, runner), threshold) in enumerate(zip(self.stages, self.thresholds)):
+            if not pending: break
+            start = time.perf_counter()
+            probs = runner.predict_batch(np.stack([images[j].at(runner.image_size) for j in pending]))
+            self.stats.record(name, len(pending), (time.perf_counter() - start) * 1000)
+            accepted = gate_score(probs, self.criterion) >= threshold
+            last = i == len(self.stages) - 1
+            for j, p, ok in zip(pending, probs, accepted):
+                if ok or last: results[j] = self._result(name, p, ok, top_k)
+            pending = [j for j, ok in zip(pending, accepted) if not ok]
+        if pending: self.stats.record(GEMINI, len(pending), 0.0)  # paid outside this process
+        return results
+
+    async def run_async(self, image: SharedImage, submit: Callable[[str, np.ndarray], Awaitable[Tuple[np.ndarray, int]]],
+                        top_k: Optional[int] = None) -> Dict:
+        """Cascade one decoded image, handing each stage's input to `submit(model_name, input)` (e.g. a micro-batcher)."""
+        self.stats.images += 1
+        for i, ((name, runner), threshold) in enumerate(zip(self.stages, self.thresholds)):
+            start = time.perf_counter()
+            probs, _ = await submit(name, image.at(runner.image_size))
+            self.stats.record(name, 1, (time.perf_counter() - start) * 1000)
+            accepted = bool(gate_score(probs, self.criterion) >= threshold)
+            if accepted or i == len(self.stages) - 1:
+                if not accepted: self.stats.record(GEMINI, 1, 0.0)
+                return self._result(name, probs, accepted, top_k)
+
+
+# ==================== CALIBRATION ====================
+
+def load_labelled_images(data_dir: str, labels: Sequence[str], per_class: Optional[int] = None,
+                         seed: int = 0) -> Tuple[List[str], np.ndarray]:
+    """Images in class folders whose names match a label (case / underscore-insensitive)."""
+    from interpreter_pool import find_images
+    index = {normalize_name(label): i for i, label in enumerate(labels)}
+    rng = np.random.default_rng(seed)
+    paths, targets = [], []
+    for folder in sorted(p for p in pathlib.Path(data_dir).iterdir() if p.is_dir()):
+        if normalize_name(folder.name) not in index:
+            print(f"⚠ Folder {folder.name} matches no label, skipping")
+            continue
+        files = find_images(str(folder))
+        if per_class and len(files) > per_class:
+            files = list(rng.choice(files, per_class, replace=False))
+        paths += files
+        targets += [index[normalize_name(folder.name)]] * len(files)
+    return paths, np.array(targets)
+
+
+def collect_probs(runners: Dict[str, BatchedTFLiteRunner], paths: Sequence[str], batch_size: int = 32) -> Dict[str, np.ndarray]:
+    """Every stage's probabilities on every image, decoding each image once for all stages."""
+    probs = {name: [] for name in runners}
+    for start in range(0, len(paths), batch_size):
+        images = [SharedImage(pathlib.Path(p).read_bytes()) for p in paths[start:start + batch_size]]
+        for name, runner in runners.items():
+            probs[name].append(runner.predict_batch(np.stack([im.at(runner.image_size) for im in images])))
+        print(f"\rScored {min(start + batch_size, len(paths)):,}/{len(paths):,} images", end='')
+    print()
+    return {name: np.concatenate(p) for name, p in probs.items()}
+
+
+def pick_threshold(scores: np.ndarray, correct: np.ndarray, target_accuracy: float, min_support: int = 20) -> float:
+    """
+    Lowest score threshold whose accepted set (score >= threshold) is at least `target_accuracy`
+    accurate, i.e. the largest most-confident prefix that meets the target. Returns a value
+    above 1 (accept nothing) when no prefix of `min_support` images does.
+    """
+    order = np.argsort(-scores)
+    accuracy = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    ok = np.flatnonzero(accuracy[min_support - 1:] >= target_accuracy) + min_support - 1
+    return float(scores[order[ok[-1]]]) if len(ok) else 1.01
+
+
+def simulate(probs: Dict[str, np.ndarray], targets: np.ndarray, stages: Sequence[str], thresholds: Sequence[float],
+             criterion: str, stage_ms: Dict[str, float], gemini_ms: float = DEFAULT_GEMINI_MS) -> Dict:
+    """Where each held-out image stops, accuracy of the local answers and the average cost per image."""
+    n = len(targets)
+    pending = np.ones(n, bool)
+    report = {'stages': {}, 'local_correct': 0, 'local_answered': 0}
+    cost = 0.0
+    for stage, threshold in zip(stages, thresholds):
+        accepted = pending & (gate_score(probs[stage], criterion) >= threshold)
+        correct = probs[stage].argmax(axis=1) == targets
+        cost += pending.mean() * stage_ms[stage]
+        report['stages'][stage] = {'threshold': threshold, 'reached_fraction': float(pending.mean()),
+                                   'answered_fraction': float(accepted.mean()),
+                                   'accuracy': float(correct[accepted].mean()) if accepted.any() else None,
+                                   'ms_per_image': stage_ms[stage]}
+        report['local_correct'] += int(correct[accepted].sum())
+        report['local_answered'] += int(accepted.sum())
+        pending &= ~accepted
+    cost += pending.mean() * gemini_ms
+    report.update(escalated_fraction=float(pending.mean()),
+                  local_accuracy=report['local_correct'] / max(report['local_answered'], 1),
+                  avg_ms_per_image=cost,
+                  baselines={f"{stages[-1]}_only_ms": stage_ms[stages[-1]], 'gemini_only_ms': gemini_ms})
+    return report
+
+
+def calibrate(data_dir: str, assets_dir: pathlib.Path = ASSETS_DIR, stages: Sequence[str] = DEFAULT_STAGES,
+              target_accuracy: float = 0.95, criterion: str = 'confidence', per_class: Optional[int] = None,
+              gemini_ms: float = DEFAULT_GEMINI_MS, output_path: Optional[pathlib.Path] = None) -> Dict:
+    """
+    Choose each stage's threshold on held-out images, on the images that actually reach that stage,
+    and save them with the simulated cascade report for `ConfidenceCascade.from_assets`.
+    """
+    assets_dir = pathlib.Path(assets_dir)
+    runners = {name: BatchedTFLiteRunner(assets_dir / f"{name}.tflite", load_labels(assets_dir, name), (1, 32)) for name in stages}
+    check_label_order(runners)
+    paths, targets = load_labelled_images(data_dir, runners[stages[0]].labels, per_class)
+    if not paths:
+        raise ValueError(f"No labelled images found in {data_dir}")
+    print(f"Calibrating on {len(paths):,} held-out images, target accuracy {target_accuracy:.1%} ({criterion})")
+    probs = collect_probs(runners, paths)
+    stage_ms = {name: benchmark_batch_sizes(runner.model_path, (1,), runs=20)['1']['invoke_ms']
+                for name, runner in runners.items()}
+
+    thresholds, reaching = [], np.ones(len(targets), bool)
+    for stage in stages:
+        scores = gate_score(probs[stage], criterion)
+        correct = probs[stage].argmax(axis=1) == targets
+        subset = reaching if reaching.sum() >= 20 else np.ones(len(targets), bool)
+        thresholds.append(pick_threshold(scores[subset], correct[subset], target_accuracy))
+        reaching &= scores < thresholds[-1]
+
+    report = simulate(probs, targets, stages, thresholds, criterion, stage_ms, gemini_ms)
+    config = {'criterion': criterion, 'target_accuracy': target_accuracy, 'held_out_images': len(paths),
+              'stages': [{'model': s, 'threshold': t} for s, t in zip(stages, thresholds)], 'report': report}
+    output_path = pathlib.Path(output_path or assets_dir / THRESHOLDS_FILE)
+    with open(output_path, 'w') as f: json.dump(config, f, indent=2)
+    print_calibration(report)
+    print(f"✓ Thresholds saved to: {output_path}")
+    return config
+
+
+def print_calibration(report: Dict):
+    print("\n" + "=" * 78)
+    print("CONFIDENCE CASCADE (held-out simulation)")
+    print("=" * 78)
+    print(f"{'stage':<28}{'threshold':>10}{'reached':>10}{'answered':>10}{'accuracy':>10}{'ms/img':>10}")
+    for stage, s in report['stages'].items():
+        accuracy = f"{s['accuracy']:.1%}" if s['accuracy'] is not None else '-'
+        print(f"{stage:<28}{s['threshold']:>10.3f}{s['reached_fraction']:>10.1%}{s['answered_fraction']:>10.1%}"
+              f"{accuracy:>10}{s['ms_per_image']:>10.2f}")
+    print(f"{GEMINI:<28}{'':>10}{report['escalated_fraction']:>10.1%}")
+    baseline_name, baseline_ms = next(iter(report['baselines'].items()))
+    print(f"\nLocal answers {report['local_accuracy']:.1%} accurate; average cost {report['avg_ms_per_image']:.2f} ms/image "
+          f"(vs {baseline_ms:.2f} ms {baseline_name.replace('_only_ms', '')} only, "
+          f"{report['baselines']['gemini_only_ms']:.0f} ms Gemini only)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Small -> large -> Gemini confidence cascade for disease classification")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('calibrate', help="Pick thresholds on a held-out labelled set")
+    p.add_argument('--data', required=True, help="Held-out images in class folders named like labels_disease.txt")
+    p.add_argument('--assets', default=str(ASSETS_DIR))
+    p.add_argument('--stages', nargs='+', default=list(DEFAULT_STAGES), help="Model names in assets/, cheapest first")
+    p.add_argument('--target-accuracy', type=float, default=0.95)
+    p.add_argument('--criterion', choices=['confidence', 'margin'], default='confidence')
+    p.add_argument('--per-class', type=int, help="Cap held-out images per class")
+    p.add_argument('--gemini-ms', type=float, default=DEFAULT_GEMINI_MS, help="Assumed Gemini cost for the estimate")
+    p.add_argument('--output', help=f"Thresholds JSON (default: assets/{THRESHOLDS_FILE})")
+
+    p = sub.add_parser('run', help="Cascade a folder of images with calibrated thresholds")
+    p.add_argument('--input', required=True, help="Image directory (searched recursively)")
+    p.add_argument('--assets', default=str(ASSETS_DIR))
+    p.add_argument('--config', help=f"Thresholds JSON (default: assets/{THRESHOLDS_FILE})")
+    p.add_argument('--batch-size', type=int, default=16)
+    p.add_argument('--output', help="Optional JSON-lines results path")
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        calibrate(args.data, pathlib.Path(args.assets), args.stages, args.target_accuracy, args.criterion,
+                  args.per_class, args.gemini_ms, args.output)
+        return
+
+    from cascade import print_summary
+    from interpreter_pool import find_images
+    engine = ConfidenceCascade.from_assets(pathlib.Path(args.assets), args.config, batch_sizes=(1, args.batch_size))
+    paths = find_images(args.input)
+    out = open(args.output, 'w') if args.output else None
+    for start in range(0, len(paths), args.batch_size):
+        chunk = paths[start:start + args.batch_size]
+        for path, result in zip(chunk, engine.run([SharedImage(pathlib.Path(p).read_bytes()) for p in chunk])):
+            if out: out.write(json.dumps({'path': path, **result}) + '\n')
+    if out: out.close()
+    print_summary(engine.stats.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Local TFLite Inference Service
+Loads the asset models (disease_detection, leaf_check, grain_quality) once and serves them over
+HTTP from a single asyncio process. Concurrent requests for the same model are collected into a
+micro-batch (up to --max-batch-size images, or whatever arrived within --max-wait-ms of the first
+one) and run as one invoke on an interpreter pre-allocated for that batch size. Results are the
+top-k labels, joined with disease_info.json where an entry exists.
+
+Every upload first passes the OpenCV quality gate (quality_gate.py, ~1 ms): blurry, badly exposed
+or tiny photos get a 422 with the failed checks instead of a worthless diagnosis
+(`--quality-gate flag` only attaches the report). Repeat uploads (the same photo, or a
+re-compressed copy) are answered from a perceptual-hash result cache (result_cache.py) without
+running any model; --cache-dir adds a disk tier that survives restarts.
+
+The backend calls this first (LOCAL_INFERENCE_URL in backend/.env) and only falls back to Gemini
+for low-confidence results or when the client asks for the detailed analysis.
+
+Needs only requirements_inference.txt (standalone TFLite runtime + OpenCV), not TensorFlow.
+
+Usage:
+    python src/inference_service.py --port 8500 --max-batch-size 16 --max-wait-ms 5
+
+    curl -X POST --data-binary @leaf.jpg "localhost:8500/predict/disease_detection?top_k=3"
+    curl -X POST --data-binary @leaf.jpg "localhost:8500/predict/cascade"   # leaf gate, then disease
+    curl -X POST --data-binary @leaf.jpg "localhost:8500/predict/adaptive"  # small -> large, see confidence_cascade.py
+    curl -X POST --data-binary @leaf.jpg "localhost:8500/predict/adaptive?leaf_gate=true"  # leaf gate, then small -> large
+    curl -X POST --data-binary @field.jpg "localhost:8500/predict/tiled?scale=0.5"  # tiles + heatmap, see tiled_inference.py
+    curl localhost:8500/health                                              # includes cache hit rate
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from cascade import DISEASE, LEAF_CHECK, CascadeEngine, SharedImage
+from confidence_cascade import THRESHOLDS_FILE, ConfidenceCascade
+from quality_gate import QualityGate, QualityRejected, add_threshold_args, gate_from_args
+from result_cache import ResultCache, assets_version, model_files, perceptual_hash, upload_digest
+from tflite_runner import (ASSETS_DIR, MODEL_LABELS, BatchedTFLiteRunner, load_disease_info, load_labels,
+                           power_of_two_sizes, top_k_predictions)
+from tiled_inference import TiledInference
+
+# Per-request details that are not part of a cached result
+UNCACHED_FIELDS = ('batch_size', 'latency_ms')
+
+class MicroBatcher:
+    """
+    Queues single-image requests for one model and runs them in micro-batches on a dedicated
+    thread, so the event loop keeps accepting requests while a batch is in flight.
+
+    A batch closes when it holds `max_batch_size` images or `max_wait_ms` after its first image
+    arrived; requests that arrive while a batch is running form the next one.
+    """
+
+    def __init__(self, model: BatchedTFLiteRunner, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"tflite-{model.name}")
+        self.stats = {'requests': 0, 'batches': 0, 'invoke_ms': 0.0}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, image: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Probabilities for one preprocessed image, and the size of the batch it ran in."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[np.ndarray, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0 and self.queue.empty():
+                break
+            try:
+                items.append(self.queue.get_nowait() if not self.queue.empty()
+                             else await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._next_batch()
+            batch = np.stack([image for image, _ in items])
+            start = time.perf_counter()
+            try:
+                probs = await loop.run_in_executor(self.executor, self.model.predict_batch, batch)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done(): future.set_exception(e)
+                continue
+            self.stats['invoke_ms'] += (time.perf_counter() - start) * 1000
+            self.stats['requests'] += len(items)
+            self.stats['batches'] += 1
+            for (_, future), p in zip(items, probs):
+                if not future.done(): future.set_result((p, len(items)))
+
+    def summary(self) -> Dict:
+        batches = self.stats['batches'] or 1
+        return {'requests': self.stats['requests'], 'batches': self.stats['batches'],
+                'mean_batch_size': self.stats['requests'] / batches,
+                'mean_invoke_ms': self.stats['invoke_ms'] / batches}
+
+
+def _preprocess(data: bytes, sizes, gate: Optional[QualityGate] = None, reject: bool = True) -> SharedImage:
+    """Decode once, run the quality gate (before any resizing) and resize for every input size up front, off the event loop."""
+    image = SharedImage(data)
+    if gate is not None:
+        image.quality = gate.enforce(image.rgb, reject)
+    for size in sizes: image.at(size)
+    return image
+
+
+def _decode_and_hash(decode: Callable[[bytes], SharedImage], data: bytes, hashed: bool) -> Tuple[SharedImage, Optional[int]]:
+    image = decode(data)
+    return image, perceptual_hash(image.rgb) if hashed else None
+
+
+class InferenceService:
+    """Every .tflite in `assets_dir` with known labels, each behind its own MicroBatcher."""
+
+    def __init__(self, assets_dir: pathlib.Path = ASSETS_DIR, max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 num_threads: Optional[int] = None, leaf_threshold: float = 0.5, cache_size: int = 4096,
+                 cache_ttl_s: float = 24 * 3600, cache_distance: int = 0, cache_dir: Optional[str] = None,
+                 quality_gate: Optional[QualityGate] = None, reject_low_quality: bool = True):
+        """
+        cache_size: results kept in memory (0 disables the result cache); see ResultCache for the rest.
+        quality_gate: checked on every upload before any model; rejects raise QualityRejected
+            unless reject_low_quality is False, and the report is attached to every result.
+        """
+        self.assets_dir = pathlib.Path(assets_dir)
+        self.max_batch_size, self.max_wait_ms, self.num_threads = max_batch_size, max_wait_ms, num_threads
+        self.leaf_threshold = leaf_threshold
+        self.cache_size, self.cache_ttl_s, self.cache_distance, self.cache_dir = cache_size, cache_ttl_s, cache_distance, cache_dir
+        self.cascade: Optional[CascadeEngine] = None
+        self.adaptive: Optional[ConfidenceCascade] = None
+        self.gated_adaptive: Optional[CascadeEngine] = None
+        self.tiled: Optional[TiledInference] = None
+        self.cache: Optional[ResultCache] = None
+        self.quality_gate, self.reject_low_quality = quality_gate, reject_low_quality
+        self.disease_info = load_disease_info(self.assets_dir / "disease_info.json")
+        self.models: Dict[str, BatchedTFLiteRunner] = {}
+        self.batchers: Dict[str, MicroBatcher] = {}
+
+    def load_models(self):
+        for name in MODEL_LABELS:
+            path = self.assets_dir / f"{name}.tflite"
+            if not path.exists():
+                print(f"⚠ {path.name} not found in {self.assets_dir}, skipping")
+                continue
+            labels = load_labels(self.assets_dir, name)
+            # Batches of any size up to the maximum run on a pre-allocated power-of-two interpreter
+            self.models[name] = BatchedTFLiteRunner(path, labels, power_of_two_sizes(self.max_batch_size), self.num_threads)
+            print(f"✓ Loaded {path.name}: input {self.models[name].image_size}, {len(labels)} labels")
+        if not self.models:
+            raise FileNotFoundError(f"No known .tflite models in {self.assets_dir}")
+        if LEAF_CHECK in self.models and DISEASE in self.models:
+            self.cascade = CascadeEngine(self.models[LEAF_CHECK], self.models[DISEASE], self.leaf_threshold, self.disease_info,
+                                         quality_gate=self.quality_gate, reject_low_quality=self.reject_low_quality)
+        if DISEASE in self.models:
+            self.tiled = TiledInference(self.models[DISEASE], self.models.get(LEAF_CHECK), leaf_threshold=self.leaf_threshold,
+                                        disease_info=self.disease_info)
+        thresholds = self.assets_dir / THRESHOLDS_FILE
+        if thresholds.exists():
+            self.adaptive = ConfidenceCascade.from_config(thresholds, self.models, self.disease_info)
+            print(f"✓ Confidence cascade: " + " -> ".join(f"{name} (>= {t:.2f})" for (name, _), t
+                                                          in zip(self.adaptive.stages, self.adaptive.thresholds)) + " -> gemini")
+            if self.cascade:
+                self.gated_adaptive = CascadeEngine(self.models[LEAF_CHECK], self.models[DISEASE], self.leaf_threshold,
+                                                    self.disease_info, quality_gate=self.quality_gate,
+                                                    reject_low_quality=self.reject_low_quality, diagnoser=self.adaptive)
+        if self.cache_size > 0:
+            # Keyed by the files actually loaded: new assets (after a restart) never see old results
+            version = assets_version(model_files(self.assets_dir, self.models) + [thresholds])
+            self.cache = ResultCache(version, self.cache_size, self.cache_ttl_s, self.cache_distance, self.cache_dir)
+            near = f"near-duplicates within {self.cache_distance} bits" if self.cache_distance else "exact pHash only"
+            print(f"✓ Result cache: {self.cache_size} entries, TTL {self.cache_ttl_s:.0f}s, {near} (model version {version})")
+
+    def start(self):
+        for name, model in self.models.items():
+            self.batchers[name] = MicroBatcher(model, self.max_batch_size, self.max_wait_ms)
+            self.batchers[name].start()
+
+    async def stop(self):
+        for batcher in self.batchers.values():
+            await batcher.stop()
+        if self.cache:
+            self.cache.close()
+
+    async def _cached(self, namespace: str, data: bytes, decode: Callable[[bytes], SharedImage],
+                      run: Callable[[SharedImage], Awaitable[Dict]]) -> Dict:
+        """
+        `run(decode(data))` unless the result cache already holds this upload: byte-identical repeats
+        are answered before decoding, re-encoded copies by their perceptual hash after it.
+        """
+        start = time.perf_counter()
+        cache = self.cache
+        digest = upload_digest(data) if cache else None
+        result = cache.get_bytes(namespace, digest) if cache else None
+        if result is None:
+            # cv2 releases the GIL, so decoding on the default pool overlaps with other requests and the invoke
+            image, phash = await asyncio.get_running_loop().run_in_executor(None, _decode_and_hash, decode, data, cache is not None)
+            result = cache.get(namespace, phash, digest) if cache else None
+            if result is None:
+                result = await run(image)
+                if image.quality: result['quality'] = image.quality
+                if cache: cache.put(namespace, phash, {k: v for k, v in result.items() if k not in UNCACHED_FIELDS}, digest)
+        latency_ms = (time.perf_counter() - start) * 1000
+        if cache: cache.stats.record(result['cache']['tier'] if 'cache' in result else None, latency_ms)
+        return {**result, 'latency_ms': latency_ms}
+
+    async def predict(self, model_name: str, data: bytes, top_k: int = 3) -> Dict:
+        if model_name not in self.models:
+            raise KeyError(model_name)
+        model = self.models[model_name]
+
+        async def run(image: SharedImage) -> Dict:
+            probs, batch_size = await self.batchers[model_name].submit(image.at(model.image_size))
+            return {'model': model_name, 'predictions': top_k_predictions(probs, model.labels, self.disease_info, top_k),
+                    'batch_size': batch_size}
+        return await self._cached(f"{model_name}:top{top_k}", data, lambda d: self._preprocess(d, [model.image_size]), run)
+
+    def _preprocess(self, data: bytes, sizes) -> SharedImage:
+        return _preprocess(data, sizes, self.quality_gate, self.reject_low_quality)
+
+    def _decode_shared(self, data: bytes, engine: CascadeEngine) -> SharedImage:
+        image = engine.decode(data)
+        engine.check_quality(image)
+        diagnosers = [runner for _, runner in engine.diagnoser.stages] if engine.diagnoser else [engine.disease_model]
+        for model in [engine.leaf_model, *diagnosers]:
+            image.at(model.image_size)
+        return image
+
+    async def _predict_gated(self, engine: CascadeEngine, name: str, namespace: str, data: bytes, top_k: int) -> Dict:
+        async def run(image: SharedImage) -> Dict:
+            return {'model': name, **await engine.run_async(image, lambda model, x: self.batchers[model].submit(x), top_k)}
+        try:
+            return await self._cached(f"{namespace}:top{top_k}", data, lambda d: self._decode_shared(d, engine), run)
+        except ValueError:
+            engine.stats.images += 1
+            raise
+
+    async def predict_cascade(self, data: bytes, top_k: int = 3) -> Dict:
+        """Leaf gate first; the disease model only runs (micro-batched like /predict/<model>) for leaves."""
+        if self.cascade is None:
+            raise KeyError('cascade')
+        return await self._predict_gated(self.cascade, 'cascade', 'cascade', data, top_k)
+
+    async def predict_adaptive(self, data: bytes, top_k: int = 3, leaf_gate: bool = False) -> Dict:
+        """
+        Small disease model first, escalating to larger ones (and finally `escalate: true`) on low confidence.
+        leaf_gate: run the leaf check first, as /predict/cascade does; non-leaves stop at 'leaf_check'.
+        """
+        if leaf_gate:
+            if self.gated_adaptive is None:
+                raise KeyError('adaptive?leaf_gate=true')
+            return await self._predict_gated(self.gated_adaptive, 'adaptive', 'adaptive+leaf_gate', data, top_k)
+        if self.adaptive is None:
+            raise KeyError('adaptive')
+        sizes = {runner.image_size for _, runner in self.adaptive.stages}
+
+        async def run(image: SharedImage) -> Dict:
+            return {'model': 'adaptive', **await self.adaptive.run_async(image, lambda name, x: self.batchers[name].submit(x), top_k)}
+        return await self._cached(f"adaptive:top{top_k}", data, lambda d: self._preprocess(d, sizes), run)
+
+    async def predict_tiled(self, data: bytes, top_k: int = 3, scale: float = 0.5) -> Dict:
+        """Overlapping tiles of a high-resolution photo: leaf check, then disease model, each tile micro-batched."""
+        if self.tiled is None:
+            raise KeyError('tiled')
+
+        async def run(image: SharedImage) -> Dict:
+            return {'model': 'tiled', **await self.tiled.run_async(image, lambda name, x: self.batchers[name].submit(x), scale, top_k)}
+        return await self._cached(f"tiled:{scale:g}:top{top_k}", data, lambda d: self._preprocess(d, []), run)
+
+    def health(self) -> Dict:
+        return {'status': 'running', 'models': {name: {'labels': len(m.labels), 'input_size': m.image_size,
+                                                       **self.batchers[name].summary()}
+                                                for name, m in self.models.items()},
+                'cascade': self.cascade.stats.summary() if self.cascade else None,
+                'adaptive': self.adaptive.stats.summary() if self.adaptive else None,
+                'adaptive_leaf_gate': self.gated_adaptive.stats.summary() if self.gated_adaptive else None,
+                'cache': self.cache.summary() if self.cache else None,
+                'quality': self.quality_gate.summary() if self.quality_gate else None,
+                'max_batch_size': self.max_batch_size, 'max_wait_ms': self.max_wait_ms}
+
+
+# ==================== HTTP ====================
+# Minimal HTTP/1.1 (keep-alive, Content-Length bodies) on asyncio streams, so the service needs
+# nothing beyond what the training scripts already install. The request body is the raw image.
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error'}
+MAX_BODY_BYTES = 20 * 1024 * 1024
+
+
+async def _write_json(writer: asyncio.StreamWriter, status: int, payload: Dict, keep_alive: bool):
+    body = json.dumps(payload).encode()
+    headers = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Type: application/json\r\n"
+               f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(headers.encode() + body)
+    await writer.drain()
+
+
+def _query_number(query: Dict[str, List[str]], name: str, default, kind):
+    """`kind`(query[name]) or `default`; a malformed value raises ValueError (-> 400)."""
+    if name not in query:
+        return default
+    try:
+        return kind(query[name][0])
+    except ValueError:
+        expected = 'an integer' if kind is int else 'a number'
+        raise ValueError(f"Query parameter {name} must be {expected}, got {query[name][0]!r}") from None
+
+
+async def _route(service: InferenceService, method: str, target: str, body: bytes) -> Tuple[int, Dict]:
+    url = urlsplit(target)
+    if url.path == '/health':
+        return 200, service.health()
+    if not url.path.startswith('/predict/'):
+        return 404, {'error': f"Unknown path {url.path}"}
+    if method != 'POST':
+        return 405, {'error': "POST the image bytes"}
+    if not body:
+        return 400, {'error': "Empty body: POST the image bytes"}
+    model_name = url.path[len('/predict/'):]
+    query = parse_qs(url.query)
+    try:
+        top_k = _query_number(query, 'top_k', 3, int)
+        if model_name == 'tiled':
+            return 200, await service.predict_tiled(body, top_k, _query_number(query, 'scale', 0.5, float))
+        if model_name == 'cascade':
+            return 200, await service.predict_cascade(body, top_k)
+        if model_name == 'adaptive':
+            return 200, await service.predict_adaptive(body, top_k, query.get('leaf_gate', ['false'])[0] == 'true')
+        return 200, await service.predict(model_name, body, top_k)
+    except KeyError:
+        return 404, {'error': f"Unknown model {model_name}", 'models': list(service.models)}
+    except QualityRejected as e:
+        return 422, {'error': str(e), 'quality': e.report}
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+
+def make_handler(service: InferenceService):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    await _write_json(writer, 413, {'error': "Image too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, payload = await _route(service, method, target, body)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                await _write_json(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def serve(service: InferenceService, host: str = '0.0.0.0', port: int = 8500):
+    service.load_models()
+    service.start()
+    server = await asyncio.start_server(make_handler(service), host, port)
+    print(f"✓ Inference service on http://{host}:{port} (max batch {service.max_batch_size}, "
+          f"max wait {service.max_wait_ms} ms)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the asset TFLite models with dynamic micro-batching")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--assets', default=str(ASSETS_DIR), help="Directory with the .tflite models and labels")
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="How long a batch waits for more requests")
+    parser.add_argument('--threads', type=int, help="Interpreter threads per model (default: TFLite's choice)")
+    parser.add_argument('--leaf-threshold', type=float, default=0.5, help="p(leaf) the cascade needs to run the disease model")
+    parser.add_argument('--cache-size', type=int, default=4096, help="Cached results in memory (0 disables the cache)")
+    parser.add_argument('--cache-ttl', type=float, default=24 * 3600, help="Seconds a cached result stays valid")
+    parser.add_argument('--cache-distance', type=int, default=0,
+                        help="Max pHash Hamming distance served as a near-duplicate (opt-in; 0 = exact pHash only)")
+    parser.add_argument('--cache-dir', help="Directory for the persistent (SQLite) cache tier")
+    parser.add_argument('--quality-gate', choices=('reject', 'flag', 'off'), default='reject',
+                        help="Reject (422) or only flag blurry, badly exposed or tiny uploads")
+    add_threshold_args(parser)
+    args = parser.parse_args()
+
+    service = InferenceService(pathlib.Path(args.assets), args.max_batch_size, args.max_wait_ms, args.threads,
+                               args.leaf_threshold, args.cache_size, args.cache_ttl, args.cache_distance, args.cache_dir,
+                               gate_from_args(args) if args.quality_gate != 'off' else None, args.quality_gate == 'reject')
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+TFLite Interpreter Pool
+A tf.lite.Interpreter can only run one invoke at a time, so a single interpreter keeps bulk scoring
+on one invoke stream. The pool keeps N pre-allocated interpreters of one model, each with its own
+XNNPACK thread count. Work is spread over a thread pool (invoke and cv2 decoding both release the
+GIL), and every task borrows whichever interpreter is free.
+
+Usage:
+    # which pool-size x threads-per-interpreter mix is fastest on this host
+    python src/interpreter_pool.py bench --model assets/disease_detection.tflite --images 256
+
+    # re-score an image archive with the best mix
+    python src/interpreter_pool.py score --model assets/disease_detection.tflite --input scans/ \\
+        --output scores.jsonl --pool-size 4 --threads 1
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from tflite_runner import TFLiteClassifier, decode_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class InterpreterPool:
+    """
+    `pool_size` interpreters of `model_path` with `threads_per_interpreter` XNNPACK threads each.
+    Defaults to one single-threaded interpreter per core.
+    """
+
+    def __init__(self, model_path: str, pool_size: Optional[int] = None, threads_per_interpreter: int = 1,
+                 labels: Sequence[str] = ()):
+        self.pool_size = pool_size or os.cpu_count() or 1
+        self.threads_per_interpreter = threads_per_interpreter
+        self.interpreters: List[TFLiteClassifier] = [
+            TFLiteClassifier(pathlib.Path(model_path), list(labels), threads_per_interpreter)
+            for _ in range(self.pool_size)]
+        self.image_size = self.interpreters[0].image_size
+        self._free: queue.Queue = queue.Queue()
+        for interpreter in self.interpreters: self._free.put(interpreter)
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='tflite-pool')
+
+    @contextmanager
+    def interpreter(self) -> Iterator[TFLiteClassifier]:
+        """Borrow a free interpreter, blocking until one is returned."""
+        interpreter = self._free.get()
+        try:
+            yield interpreter
+        finally:
+            self._free.put(interpreter)
+
+    def _predict(self, images: np.ndarray) -> np.ndarray:
+        with self.interpreter() as interpreter:
+            return interpreter.predict_batch(images)
+
+    def _predict_files(self, paths: Sequence[str]) -> np.ndarray:
+        images = np.stack([decode_image(pathlib.Path(p).read_bytes(), self.image_size) for p in paths])
+        return self._predict(images)
+
+    def predict_many(self, images: np.ndarray, batch_size: int = 1) -> np.ndarray:
+        """Outputs for (N, H, W, 3) preprocessed images, in order, split into `batch_size` chunks across the pool."""
+        chunks = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        return np.concatenate(list(self.executor.map(self._predict, chunks)))
+
+    def predict_files(self, paths: Sequence[str], batch_size: int = 1) -> np.ndarray:
+        """Like predict_many, with decoding and resizing done inside the pool's threads."""
+        chunks = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        return np.concatenate(list(self.executor.map(self._predict_files, chunks)))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def default_mixes(cores: Optional[int] = None) -> List[Tuple[int, int]]:
+    """(pool_size, threads_per_interpreter) pairs covering one big interpreter to one interpreter per core."""
+    cores = cores or os.cpu_count() or 1
+    mixes = {(1, 1), (1, cores), (cores, 1)}
+    threads = 2
+    while threads < cores:
+        mixes.add((cores // threads, threads))
+        threads *= 2
+    return sorted(mixes)
+
+
+def benchmark_mixes(model_path: str, images: np.ndarray, mixes: Sequence[Tuple[int, int]],
+                    batch_size: int = 1, repeats: int = 2) -> List[Dict]:
+    """Aggregate images/sec of predict_many for each (pool_size, threads_per_interpreter) mix."""
+    rows = []
+    for pool_size, threads in mixes:
+        with InterpreterPool(model_path, pool_size, threads) as pool:
+            pool.predict_many(images[:pool_size * batch_size], batch_size)  # warm up every interpreter
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                pool.predict_many(images, batch_size)
+                best = min(best, time.perf_counter() - start)
+        rows.append({'pool_size': pool_size, 'threads_per_interpreter': threads, 'batch_size': batch_size,
+                     'images_per_sec': len(images) / best, 'ms_per_image': best * 1000 / len(images)})
+        print(f"pool {pool_size:>3} x {threads:>2} threads: {rows[-1]['images_per_sec']:8.1f} img/s "
+              f"({rows[-1]['ms_per_image']:.2f} ms/img)")
+    best_row = max(rows, key=lambda r: r['images_per_sec'])
+    print(f"\n✓ Fastest: pool {best_row['pool_size']} x {best_row['threads_per_interpreter']} threads "
+          f"({best_row['images_per_sec']:.1f} img/s, x{best_row['images_per_sec'] / rows[0]['images_per_sec']:.2f} "
+          f"vs pool {rows[0]['pool_size']} x {rows[0]['threads_per_interpreter']})")
+    return rows
+
+
+def find_images(root: str) -> List[str]:
+    return sorted(str(p) for p in pathlib.Path(root).rglob('*') if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def score_archive(model_path: str, input_dir: str, output_path: str, labels: Sequence[str] = (),
+                  pool_size: Optional[int] = None, threads: int = 1, batch_size: int = 1, top_k: int = 3,
+                  chunk: int = 1024) -> Dict:
+    """Score every image under `input_dir` and write one JSON line per image with its top-k labels."""
+    paths = find_images(input_dir)
+    start = time.perf_counter()
+    with InterpreterPool(model_path, pool_size, threads, labels) as pool, open(output_path, 'w') as out:
+        for i in range(0, len(paths), chunk):
+            probs = pool.predict_files(paths[i:i + chunk], batch_size)
+            for path, p in zip(paths[i:i + chunk], probs):
+                top = np.argsort(-p)[:top_k]
+                out.write(json.dumps({'path': path, 'top_k': [
+                    {'label': labels[j] if j < len(labels) else int(j), 'confidence': float(p[j])} for j in top]}) + '\n')
+            print(f"Scored {min(i + chunk, len(paths)):,}/{len(paths):,} images")
+    elapsed = time.perf_counter() - start
+    print(f"✓ {len(paths):,} images in {elapsed:.1f}s ({len(paths) / max(elapsed, 1e-9):.1f} img/s), saved to: {output_path}")
+    return {'images': len(paths), 'seconds': elapsed}
+
+
+def _read_labels(path: Optional[str]) -> List[str]:
+    if not path:
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-interpreter TFLite inference across all cores")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('bench', help="Throughput per pool-size x threads-per-interpreter mix")
+    p.add_argument('--model', required=True, help=".tflite model path")
+    p.add_argument('--images', type=int, default=256, help="Random images per run")
+    p.add_argument('--mixes', nargs='+', help="pool_size:threads pairs, e.g. 1:4 2:2 4:1 (default: powers of two)")
+    p.add_argument('--batch-size', type=int, default=1, help="Images per invoke")
+    p.add_argument('--output', help="Optional JSON report path")
+
+    p = sub.add_parser('score', help="Score every image in a directory tree")
+    p.add_argument('--model', required=True, help=".tflite model path")
+    p.add_argument('--input', required=True, help="Image directory (searched recursively)")
+    p.add_argument('--output', required=True, help="JSON-lines output path")
+    p.add_argument('--labels', help="Labels file, one per line")
+    p.add_argument('--pool-size', type=int, help="Interpreters (default: one per core)")
+    p.add_argument('--threads', type=int, default=1, help="XNNPACK threads per interpreter")
+    p.add_argument('--batch-size', type=int, default=1, help="Images per invoke")
+    p.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        mixes = [tuple(int(v) for v in m.split(':')) for m in args.mixes] if args.mixes else default_mixes()
+        probe = TFLiteClassifier(pathlib.Path(args.model), [])
+        images = np.random.rand(args.images, *probe.image_size, 3).astype(np.float32)
+        rows = benchmark_mixes(args.model, images, mixes, args.batch_size)
+        if args.output:
+            with open(args.output, 'w') as f: json.dump({'model': args.model, 'cpu_count': os.cpu_count(), 'results': rows}, f, indent=2)
+            print(f"✓ Report saved to: {args.output}")
+    else:
+        score_archive(args.model, args.input, args.output, _read_labels(args.labels), args.pool_size,
+                      args.threads, args.batch_size, args.top_k)
+
+
+if __name__ == "__main__":
+    main()
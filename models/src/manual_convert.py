@@ -1,51 +1,40 @@
 import tensorflow as tf
 import pathlib
 import os
+import sys
 import numpy as np
 
-def manual_conversion():
+sys.path.append(str(pathlib.Path(__file__).parent.parent / "gpu_pipeline"))
+from quantization import TFLITE_VARIANTS, convert_variant, save_tflite
+from quantization_workbench import build_calibration_set
+
+def manual_conversion(variant="dynamic_range"):
     current_file = pathlib.Path(__file__)
     project_root = current_file.parent.parent # models/
     assets_dir = project_root / "assets"
     data_dir = project_root / "datasets" / "raw"
-    
+
     keras_path = assets_dir / "best_disease_model.keras"
     tflite_path = assets_dir / "disease_detection.tflite"
 
     print(f"Loading Keras model from {keras_path}...")
     model = tf.keras.models.load_model(str(keras_path))
 
-    print("Converting to TFLite with INT8 Quantization...")
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    converter.optimizations = [tf.lite.Optimize.DEFAULT]
-
-    # Representative Dataset generator
-    def representative_dataset_gen():
-        # Setup data generator for representative samples
-        datagen = tf.keras.preprocessing.image.ImageDataGenerator(rescale=1./255)
-        generator = datagen.flow_from_directory(
-            data_dir,
-            target_size=(224, 224),
-            batch_size=1,
-            class_mode='categorical',
-            shuffle=True
-        )
-        for _ in range(50):
-            img, _ = next(generator)
-            yield [img.astype(np.float32)]
-
-    # Relaxed Quantization (Hybrid) - More compatible
-    # converter.representative_dataset = representative_dataset_gen # Optional for hybrid
-    # converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
-    # converter.inference_input_type = tf.float32
-    # converter.inference_output_type = tf.float32
-
-    tflite_model = converter.convert()
-
-    with open(tflite_path, 'wb') as f:
-        f.write(tflite_model)
-    
+    print(f"Converting to TFLite ({variant})...")
+    # Representative Dataset: the same persisted, class-stratified calibration set the workbench uses
+    representative_dataset_gen = None
+    if TFLITE_VARIANTS[variant][2]:
+        calibration = build_calibration_set(data_dir, assets_dir / "calibration_224px.npz", image_size=224)
+        def representative_dataset_gen():
+            for img in calibration['calib_images']:
+                yield [img[np.newaxis].astype(np.float32) / 255.0]
+
+    # Hybrid (dynamic range) stays the default; run gpu_pipeline/quantization_workbench.py
+    # to measure every variant before switching.
+    tflite_model = convert_variant(model, variant, representative_dataset_gen)
+    save_tflite(tflite_model, str(tflite_path))
+
     print(f"Success! Model converted to {tflite_path}")
 
 if __name__ == "__main__":
-    manual_conversion()
+    manual_conversion(sys.argv[1] if len(sys.argv) > 1 else "dynamic_range")
@@ -0,0 +1,183 @@
+"""
+Image Quality Gate
+Cheap OpenCV checks that run before any model: blurry, badly exposed or tiny uploads give
+worthless diagnoses, so they are rejected (or flagged) before the TFLite models and Gemini see
+them. All metrics come from one ~320 px copy (bilinear to twice that, then area-downscaled), so a
+check costs under a millisecond after decoding, even on a 12 MP photo:
+
+  resolution     shorter side of the original image                      reject below --min-side
+  sharpness      variance of the Laplacian of the grayscale copy         reject below --min-sharpness
+  exposure       mean brightness and share of clipped (near 0/255) pixels  reject if too dark/bright
+  leaf_coverage  share of leaf-coloured pixels (green-yellow-brown HSV)  flag below --min-leaf-fraction
+
+The inference service runs it on every upload (--quality-gate reject|flag|off) and the cascade
+CLI can too; for training data, `scan` reports every image and can move the rejects aside.
+Sharpness depends on the downscaled size, so calibrate thresholds on your own photos with `scan`.
+
+Usage:
+    python src/quality_gate.py scan --input datasets/disease --output quality.jsonl
+    python src/quality_gate.py scan --input datasets/disease --move-rejects datasets/rejected
+"""
+
+import argparse
+import json
+import pathlib
+import shutil
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from tflite_runner import decode_rgb
+
+# OpenCV HSV (hue 0-179): green through yellow to brown, excluding grey/white/black background
+LEAF_HSV_LOW, LEAF_HSV_HIGH = (10, 40, 30), (95, 255, 255)
+HARD_CHECKS = ('unreadable', 'resolution', 'sharpness', 'underexposed', 'overexposed')
+
+
+class QualityRejected(ValueError):
+    """Raised by QualityGate.enforce; `report` holds the metrics and reasons."""
+
+    def __init__(self, report: Dict):
+        super().__init__("Image quality too low: " + ", ".join(report['reasons']))
+        self.report = report
+
+
+class QualityGate:
+    """
+    verdict 'reject' when any hard check fails (resolution, sharpness, exposure), 'flag' when only the
+    leaf-coverage check fails, else 'pass'. `size` is the long side of the copy the metrics are computed on.
+    """
+
+    def __init__(self, min_side: int = 224, min_sharpness: float = 10.0, min_brightness: float = 35.0,
+                 max_brightness: float = 225.0, max_clipped: float = 0.5, min_leaf_fraction: float = 0.15, size: int = 320):
+        self.min_side, self.min_sharpness = min_side, min_sharpness
+        self.min_brightness, self.max_brightness, self.max_clipped = min_brightness, max_brightness, max_clipped
+        self.min_leaf_fraction = min_leaf_fraction
+        self.size = size
+        self.stats = {'checked': 0, 'pass': 0, 'flag': 0, 'reject': 0, 'ms': 0.0}
+        self.reasons: Counter = Counter()
+
+    def _downscale(self, rgb: np.ndarray) -> np.ndarray:
+        h, w = rgb.shape[:2]
+        scale = self.size / max(h, w)
+        if scale >= 1:
+            return rgb
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        if scale < 0.5:
+            # A bilinear pass to twice the target keeps INTER_AREA's cost independent of the original resolution
+            rgb = cv2.resize(rgb, (size[0] * 2, size[1] * 2), interpolation=cv2.INTER_LINEAR)
+        return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+
+    def score(self, rgb: np.ndarray) -> Dict:
+        """Raw metrics for a uint8 RGB image."""
+        small = self._downscale(rgb)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        leaf = cv2.inRange(cv2.cvtColor(small, cv2.COLOR_RGB2HSV), LEAF_HSV_LOW, LEAF_HSV_HIGH)
+        return {
+            'width': int(rgb.shape[1]), 'height': int(rgb.shape[0]),
+            'sharpness': float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+            'brightness': float(gray.mean()),
+            'dark_fraction': float(np.count_nonzero(gray <= 10) / gray.size),
+            'bright_fraction': float(np.count_nonzero(gray >= 245) / gray.size),
+            'leaf_fraction': float(cv2.countNonZero(leaf) / leaf.size),
+        }
+
+    def _reasons(self, m: Dict) -> List[str]:
+        reasons = []
+        if min(m['width'], m['height']) < self.min_side: reasons.append('resolution')
+        if m['sharpness'] < self.min_sharpness: reasons.append('sharpness')
+        if m['brightness'] < self.min_brightness or m['dark_fraction'] > self.max_clipped: reasons.append('underexposed')
+        if m['brightness'] > self.max_brightness or m['bright_fraction'] > self.max_clipped: reasons.append('overexposed')
+        if m['leaf_fraction'] < self.min_leaf_fraction: reasons.append('leaf_coverage')
+        return reasons
+
+    def _record(self, report: Dict, ms: float) -> Dict:
+        report['ms'] = ms
+        self.stats['checked'] += 1
+        self.stats[report['verdict']] += 1
+        self.stats['ms'] += ms
+        self.reasons.update(report['reasons'])
+        return report
+
+    def check(self, rgb: np.ndarray) -> Dict:
+        """Metrics plus 'verdict' (pass/flag/reject) and the failed checks as 'reasons'."""
+        start = time.perf_counter()
+        metrics = self.score(rgb)
+        reasons = self._reasons(metrics)
+        verdict = 'reject' if any(r in HARD_CHECKS for r in reasons) else 'flag' if reasons else 'pass'
+        return self._record({'verdict': verdict, 'reasons': reasons, 'metrics': metrics}, (time.perf_counter() - start) * 1000)
+
+    def check_file(self, path: str) -> Dict:
+        try:
+            return self.check(decode_rgb(pathlib.Path(path).read_bytes()))
+        except ValueError:
+            return self._record({'verdict': 'reject', 'reasons': ['unreadable'], 'metrics': {}}, 0.0)
+
+    def enforce(self, rgb: np.ndarray, reject: bool = True) -> Dict:
+        """check(), raising QualityRejected for a 'reject' verdict when `reject` is set (flag-only mode otherwise)."""
+        report = self.check(rgb)
+        if reject and report['verdict'] == 'reject':
+            raise QualityRejected(report)
+        return report
+
+    def summary(self) -> Dict:
+        checked = self.stats['checked'] or 1
+        return {'checked': self.stats['checked'],
+                **{f"{v}_fraction": self.stats[v] / checked for v in ('pass', 'flag', 'reject')},
+                'reasons': dict(self.reasons), 'ms_per_image': self.stats['ms'] / checked}
+
+
+def add_threshold_args(parser: argparse.ArgumentParser):
+    """The gate thresholds as CLI flags (shared by the scan CLI, the cascade CLI and the inference service)."""
+    defaults = QualityGate()
+    parser.add_argument('--min-side', type=int, default=defaults.min_side, help="Shorter image side in pixels")
+    parser.add_argument('--min-sharpness', type=float, default=defaults.min_sharpness, help="Laplacian variance of the downscaled copy")
+    parser.add_argument('--min-leaf-fraction', type=float, default=defaults.min_leaf_fraction, help="Leaf-coloured share below which images are flagged")
+
+
+def gate_from_args(args: argparse.Namespace) -> QualityGate:
+    return QualityGate(min_side=args.min_side, min_sharpness=args.min_sharpness, min_leaf_fraction=args.min_leaf_fraction)
+
+
+def scan(input_dir: str, gate: QualityGate, output_path: Optional[str] = None, move_rejects: Optional[str] = None) -> Dict:
+    """Check every image under `input_dir`; optionally write one JSON line each and move rejects (keeping subfolders)."""
+    from interpreter_pool import find_images
+    paths = find_images(input_dir)
+    out = open(output_path, 'w') if output_path else None
+    for i, path in enumerate(paths, 1):
+        report = gate.check_file(path)
+        if out: out.write(json.dumps({'path': path, **report}) + '\n')
+        if move_rejects and report['verdict'] == 'reject':
+            target = pathlib.Path(move_rejects) / pathlib.Path(path).relative_to(input_dir)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(path, target)
+        if i % 1000 == 0: print(f"Checked {i:,}/{len(paths):,} images")
+    if out: out.close()
+    summary = gate.summary()
+    print(f"\n✓ {summary['checked']:,} images: {summary['pass_fraction']:.1%} pass, {summary['flag_fraction']:.1%} flagged, "
+          f"{summary['reject_fraction']:.1%} rejected ({summary['ms_per_image']:.2f} ms/check after decoding)")
+    for reason, count in Counter(summary['reasons']).most_common():
+        print(f"  {reason:<16}{count:>8,}")
+    if move_rejects: print(f"✓ Rejects moved to: {move_rejects}")
+    if output_path: print(f"✓ Report saved to: {output_path}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenCV image quality gate (blur, exposure, resolution, leaf coverage)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('scan', help="Check every image in a directory tree (e.g. to clean training data)")
+    p.add_argument('--input', required=True, help="Image directory (searched recursively)")
+    p.add_argument('--output', help="Optional JSON-lines report path")
+    p.add_argument('--move-rejects', help="Move rejected images into this directory")
+    add_threshold_args(p)
+    args = parser.parse_args()
+
+    scan(args.input, gate_from_args(args), args.output, args.move_rejects)
+
+
+if __name__ == "__main__":
+    main()
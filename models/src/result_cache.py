@@ -0,0 +1,303 @@
+"""
+Perceptual-Hash Result Cache
+Farmers often re-upload the same photo, or a re-compressed / re-sized copy of it. The cache sits in
+front of the inference path and answers those repeats without running the models:
+
+  1. bytes  - a digest of the upload itself; an identical file is answered before it is even decoded
+  2. exact  - the 64-bit DCT perceptual hash (pHash) of the decoded image
+  3. disk   - optional SQLite tier with the same pHash keys, which survives restarts and evictions
+  4. near   - opt-in: another cached pHash within `max_distance` bits, found through Hamming-distance
+              buckets. Off by default, since a near copy can be a different leaf of the same crop; enable it
+              only after checking on real uploads that near hits keep the top label.
+
+Entries are evicted LRU-first beyond `max_entries` and expire after `ttl_s`. Every key includes the
+model version (a content hash of the asset files the service loaded), so results from a previous
+model are never served: new assets plus a restart start a fresh keyspace, on disk too.
+
+The inference service enables it with --cache-size (see /health for hit rate and latencies).
+
+Usage:
+    # miss vs. repeat latency and hit rate over a folder (every image is scored twice)
+    python src/result_cache.py --input scans/ --model disease_detection --disk-dir cache/
+"""
+
+import argparse
+import hashlib
+import json
+import pathlib
+import sqlite3
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from tflite_runner import (ASSETS_DIR, MODEL_LABELS, BatchedTFLiteRunner, decode_rgb, load_disease_info, load_labels,
+                           to_model_input, top_k_predictions)
+
+HASH_BITS = 64
+TIERS = ('bytes', 'exact', 'disk', 'near')
+
+
+def perceptual_hash(rgb: np.ndarray) -> int:
+    """64-bit pHash: sign of the 8x8 lowest DCT frequencies of a 32x32 grayscale copy against their median."""
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # the DC term only tracks brightness
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def upload_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def assets_version(paths: Iterable[pathlib.Path]) -> str:
+    """Short content hash of the model, label and config files; changes whenever any of them does."""
+    digest = hashlib.sha256()
+    for path in sorted(pathlib.Path(p) for p in paths):
+        if not path.exists(): continue
+        digest.update(path.name.encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''): digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+@lru_cache(maxsize=None)
+def _band_edges(num_bands: int) -> Tuple[Tuple[int, int], ...]:
+    edges = np.linspace(0, HASH_BITS, num_bands + 1).astype(int).tolist()
+    return tuple((lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges[:-1], edges[1:]))
+
+
+def _bands(phash: int, num_bands: int) -> List[int]:
+    """Split the hash into `num_bands` bit ranges. Two hashes within num_bands - 1 bits share at least one band."""
+    return [(phash >> shift) & mask for shift, mask in _band_edges(num_bands)]
+
+
+class CacheStats:
+    """Lookups, hits per tier, and end-to-end latency of hits vs. misses."""
+
+    def __init__(self):
+        self.hits = {tier: 0 for tier in TIERS}
+        self.hit_ms = {tier: 0.0 for tier in TIERS}
+        self.misses, self.miss_ms = 0, 0.0
+        self.evictions, self.expirations = 0, 0
+
+    def record(self, tier: Optional[str], ms: float):
+        if tier is None:
+            self.misses += 1
+            self.miss_ms += ms
+        else:
+            self.hits[tier] += 1
+            self.hit_ms[tier] += ms
+
+    def summary(self) -> Dict:
+        hits = sum(self.hits.values())
+        lookups = hits + self.misses
+        return {
+            'lookups': lookups, 'hits': hits, 'misses': self.misses, 'hit_rate': hits / lookups if lookups else 0.0,
+            'tiers': {tier: {'hits': self.hits[tier], 'mean_ms': self.hit_ms[tier] / max(self.hits[tier], 1)} for tier in TIERS},
+            'mean_hit_ms': sum(self.hit_ms.values()) / max(hits, 1), 'mean_miss_ms': self.miss_ms / max(self.misses, 1),
+            'evictions': self.evictions, 'expirations': self.expirations,
+        }
+
+
+class ResultCache:
+    """
+    In-memory LRU + TTL cache of JSON-able results keyed by (namespace, pHash) for one model `version`,
+    with an optional write-through SQLite tier in `disk_dir`.
+
+    namespace: separates endpoints and options whose results differ for the same image (e.g. 'cascade:top3').
+    max_distance: largest Hamming distance served as a near-duplicate (default 0 = exact pHash only).
+    Not thread-safe: use it from one thread (the service's event loop).
+    """
+
+    def __init__(self, version: str, max_entries: int = 4096, ttl_s: float = 24 * 3600, max_distance: int = 0,
+                 disk_dir: Optional[str] = None):
+        self.version = version
+        self.max_entries, self.ttl_s, self.max_distance = max_entries, ttl_s, max_distance
+        self.num_bands = max_distance + 1
+        self.entries: 'OrderedDict[Tuple[str, int], Dict]' = OrderedDict()
+        self.buckets: Dict[Tuple[str, int, int], set] = {}
+        self.digests: Dict[Tuple[str, str], int] = {}
+        self.stats = CacheStats()
+        self.db: Optional[sqlite3.Connection] = None
+        if disk_dir:
+            self._open_disk(pathlib.Path(disk_dir))
+
+    # ---------- memory tier ----------
+
+    def _insert(self, namespace: str, phash: int, result: Dict, expires: float, digests: Sequence[str] = ()):
+        key = (namespace, phash)
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = {'result': result, 'expires': expires, 'digests': set(digests)}
+        for i, band in enumerate(_bands(phash, self.num_bands)):
+            self.buckets.setdefault((namespace, i, band), set()).add(phash)
+        for digest in digests:
+            self.digests[(namespace, digest)] = phash
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+            self.stats.evictions += 1
+
+    def _remove(self, key: Tuple[str, int]):
+        namespace, phash = key
+        entry = self.entries.pop(key)
+        for i, band in enumerate(_bands(phash, self.num_bands)):
+            bucket = self.buckets.get((namespace, i, band))
+            if bucket is not None:
+                bucket.discard(phash)
+                if not bucket: del self.buckets[(namespace, i, band)]
+        for digest in entry['digests']:
+            self.digests.pop((namespace, digest), None)
+
+    def _live(self, key: Tuple[str, int]) -> Optional[Dict]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] < time.time():
+            self._remove(key)
+            self.stats.expirations += 1
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, namespace: str, phash: int) -> Optional[Tuple[int, int]]:
+        """(cached pHash, distance) of the closest live entry within max_distance, via the band buckets."""
+        candidates = set()
+        for i, band in enumerate(_bands(phash, self.num_bands)):
+            candidates |= self.buckets.get((namespace, i, band), set())
+        best = None
+        for other in candidates:
+            distance = (phash ^ other).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[1]):
+                best = (other, distance)
+        return best
+
+    # ---------- lookups ----------
+
+    def get_bytes(self, namespace: str, digest: str) -> Optional[Dict]:
+        """Result for a byte-identical upload seen before, without decoding it."""
+        phash = self.digests.get((namespace, digest))
+        entry = self._live((namespace, phash)) if phash is not None else None
+        return {**entry['result'], 'cache': {'tier': 'bytes', 'distance': 0}} if entry else None
+
+    def get(self, namespace: str, phash: int, digest: Optional[str] = None) -> Optional[Dict]:
+        """Result for this pHash (memory, then disk), else a near duplicate; `digest` is remembered for get_bytes."""
+        tier, distance, key = 'exact', 0, (namespace, phash)
+        entry = self._live(key)
+        if entry is None and self.db is not None:
+            row = self.db.execute("SELECT result, created FROM results WHERE version = ? AND namespace = ? AND phash = ?",
+                                  (self.version, namespace, f"{phash:016x}")).fetchone()
+            if row and row[1] + self.ttl_s >= time.time():
+                tier = 'disk'
+                self._insert(namespace, phash, json.loads(row[0]), row[1] + self.ttl_s)
+                entry = self.entries[key]
+        if entry is None and self.max_distance > 0:
+            nearest = self._nearest(namespace, phash)
+            if nearest is not None:
+                (tier, distance), key = ('near', nearest[1]), (namespace, nearest[0])
+                entry = self._live(key)
+        if entry is None:
+            return None
+        if digest:
+            entry['digests'].add(digest)
+            self.digests[(namespace, digest)] = key[1]
+        return {**entry['result'], 'cache': {'tier': tier, 'distance': distance}}
+
+    def put(self, namespace: str, phash: int, result: Dict, digest: Optional[str] = None):
+        now = time.time()
+        self._insert(namespace, phash, result, now + self.ttl_s, [digest] if digest else [])
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                            (self.version, namespace, f"{phash:016x}", json.dumps(result), now))
+            self.db.commit()
+
+    def clear(self):
+        self.entries.clear(); self.buckets.clear(); self.digests.clear()
+
+    # ---------- disk tier ----------
+
+    def _open_disk(self, disk_dir: pathlib.Path):
+        disk_dir.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(disk_dir / 'result_cache.sqlite3'))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (version TEXT, namespace TEXT, phash TEXT, result TEXT, "
+                        "created REAL, PRIMARY KEY (version, namespace, phash))")
+        # Rows of other model versions can never hit again
+        stale = self.db.execute("DELETE FROM results WHERE version != ? OR created < ?",
+                                (self.version, time.time() - self.ttl_s)).rowcount
+        self.db.commit()
+        # Warm the memory tier (and its near-duplicate buckets) with the most recent entries
+        rows = self.db.execute("SELECT namespace, phash, result, created FROM results ORDER BY created DESC LIMIT ?",
+                               (self.max_entries,)).fetchall()
+        for namespace, phash, result, created in reversed(rows):
+            self._insert(namespace, int(phash, 16), json.loads(result), created + self.ttl_s)
+        print(f"✓ Result cache on disk: {disk_dir} ({len(rows)} entries loaded, {stale} stale removed)")
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def summary(self) -> Dict:
+        return {'version': self.version, 'entries': len(self.entries), 'max_entries': self.max_entries,
+                'ttl_s': self.ttl_s, 'max_distance': self.max_distance, 'disk': self.db is not None, **self.stats.summary()}
+
+
+def model_files(assets_dir: pathlib.Path, model_names: Iterable[str]) -> List[pathlib.Path]:
+    """The asset files a set of models' results depend on: the .tflite files, their label files and disease_info.json."""
+    assets_dir = pathlib.Path(assets_dir)
+    files = [assets_dir / "disease_info.json"]
+    for name in model_names:
+        files.append(assets_dir / f"{name}.tflite")
+        if isinstance(MODEL_LABELS.get(name), str): files.append(assets_dir / MODEL_LABELS[name])
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Result cache hit rate and latency over a folder of images")
+    parser.add_argument('--input', required=True, help="Image directory (searched recursively)")
+    parser.add_argument('--assets', default=str(ASSETS_DIR))
+    parser.add_argument('--model', default='disease_detection')
+    parser.add_argument('--max-distance', type=int, default=0, help="Near-duplicate Hamming distance (0 = exact only)")
+    parser.add_argument('--disk-dir', help="Optional disk tier directory")
+    args = parser.parse_args()
+
+    from interpreter_pool import find_images
+    assets_dir = pathlib.Path(args.assets)
+    runner = BatchedTFLiteRunner(assets_dir / f"{args.model}.tflite", load_labels(assets_dir, args.model), (1,))
+    disease_info = load_disease_info(assets_dir / "disease_info.json")
+    cache = ResultCache(assets_version(model_files(assets_dir, [args.model])), max_distance=args.max_distance,
+                        disk_dir=args.disk_dir)
+    uploads = [pathlib.Path(p).read_bytes() for p in find_images(args.input)]
+    namespace = f"{args.model}:top3"
+    for data in uploads * 2:
+        start = time.perf_counter()
+        digest = upload_digest(data)
+        result = cache.get_bytes(namespace, digest)
+        tier = 'bytes'
+        if result is None:
+            try:
+                rgb = decode_rgb(data)
+            except ValueError:
+                continue
+            phash = perceptual_hash(rgb)
+            result = cache.get(namespace, phash, digest)
+            tier = result['cache']['tier'] if result else None
+            if result is None:
+                probs = runner.predict_batch(to_model_input(rgb, runner.image_size)[None])[0]
+                cache.put(namespace, phash, {'predictions': top_k_predictions(probs, runner.labels, disease_info)}, digest)
+        cache.stats.record(tier, (time.perf_counter() - start) * 1000)
+    summary = cache.summary()
+    cache.close()
+    print(json.dumps(summary, indent=2))
+    print(f"\n✓ Hit rate {summary['hit_rate']:.1%}: {summary['mean_hit_ms']:.3f} ms per hit vs "
+          f"{summary['mean_miss_ms']:.2f} ms per miss")
+
+
+if __name__ == "__main__":
+    main()
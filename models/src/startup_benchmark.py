@@ -0,0 +1,116 @@
+"""
+Inference Startup Benchmark
+Cold start (process spawn -> first prediction) and resident memory of the lightweight inference
+path (tflite_runner: standalone TFLite runtime + OpenCV) vs. what verify_tflite.py / verify_model.py
+did before (import tensorflow for tf.lite.Interpreter and tf.image decoding). Every run is a fresh
+Python process, so the numbers are what an autoscaled worker or a CLI batch job pays per start.
+
+Usage:
+    python src/startup_benchmark.py --model assets/disease_detection.tflite --runs 5
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import time
+from typing import Dict
+
+import numpy as np
+
+SRC_DIR = pathlib.Path(__file__).resolve().parent
+
+_RSS = """
+def rss_mb():
+    if not os.path.exists('/proc/self/status'): return None
+    with open('/proc/self/status') as f:
+        return next(int(l.split()[1]) for l in f if l.startswith('VmRSS')) / 1024
+"""
+
+# Each child prints one JSON line: seconds spent importing, total seconds to first prediction, RSS after it
+CANDIDATES = {
+    'tensorflow': _RSS + """
+import json, os, time
+start = time.perf_counter()
+import numpy as np
+import tensorflow as tf
+imported = time.perf_counter()
+interpreter = tf.lite.Interpreter(model_path=MODEL)
+interpreter.allocate_tensors()
+detail = interpreter.get_input_details()[0]
+img = tf.image.decode_image(tf.io.read_file(IMAGE), channels=3, expand_animations=False)
+img = tf.expand_dims(tf.image.resize(img, detail['shape'][1:3]) / 255.0, 0)
+interpreter.set_tensor(detail['index'], img)
+interpreter.invoke()
+print(json.dumps({'runtime': 'tensorflow', 'import_s': imported - start, 'ready_s': time.perf_counter() - start, 'rss_mb': rss_mb()}))
+""",
+    'lightweight': _RSS + """
+import json, os, time
+start = time.perf_counter()
+from tflite_runner import TFLiteClassifier, decode_image, load_interpreter_class
+load_interpreter_class()
+imported = time.perf_counter()
+model = TFLiteClassifier(pathlib.Path(MODEL), [])
+with open(IMAGE, 'rb') as f:
+    model.predict_batch(decode_image(f.read(), model.image_size)[None])
+print(json.dumps({'runtime': model.runtime, 'import_s': imported - start, 'ready_s': time.perf_counter() - start, 'rss_mb': rss_mb()}))
+""",
+}
+
+
+def _run_child(code: str, model_path: str, image_path: str) -> Dict:
+    prelude = f"import os, pathlib\nMODEL = {model_path!r}\nIMAGE = {image_path!r}\n"
+    env = {**os.environ, 'TF_CPP_MIN_LOG_LEVEL': '3', 'PYTHONPATH': os.pathsep.join([str(SRC_DIR), os.environ.get('PYTHONPATH', '')])}
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', prelude + code], capture_output=True, text=True, env=env, check=True).stdout
+    wall = time.perf_counter() - start
+    result = json.loads(out.strip().splitlines()[-1])
+    result['wall_s'] = wall
+    return result
+
+
+def measure_startup(model_path: str, image_path: str, runs: int = 5) -> Dict[str, Dict]:
+    """Median cold-start wall time, import time, time to first prediction and RSS per candidate."""
+    report = {}
+    for name, code in CANDIDATES.items():
+        samples = [_run_child(code, model_path, image_path) for _ in range(runs)]
+        report[name] = {'runtime': samples[0]['runtime'],
+                        **{key: float(np.median([s[key] for s in samples])) for key in ('wall_s', 'import_s', 'ready_s')},
+                        'rss_mb': float(np.median([s['rss_mb'] for s in samples])) if samples[0]['rss_mb'] else None}
+        r = report[name]
+        print(f"{name:<12} ({r['runtime']:<16}) cold start {r['wall_s']:.2f}s, import {r['import_s']:.2f}s, "
+              f"first prediction at {r['ready_s']:.2f}s" + (f", RSS {r['rss_mb']:.0f} MB" if r['rss_mb'] else ""))
+    base, light = report['tensorflow'], report['lightweight']
+    print(f"\n✓ Lightweight path: x{base['wall_s'] / light['wall_s']:.1f} faster cold start"
+          + (f", {base['rss_mb'] - light['rss_mb']:.0f} MB less RSS" if base['rss_mb'] and light['rss_mb'] else ""))
+    if light['runtime'] == 'tensorflow':
+        print("⚠ No standalone TFLite runtime installed, so the lightweight path fell back to TensorFlow: "
+              "pip install ai-edge-litert (or tflite-runtime)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start and RSS: standalone TFLite runtime vs. full TensorFlow")
+    parser.add_argument('--model', required=True, help=".tflite model path")
+    parser.add_argument('--image', help="Test image (default: a generated 640x480 JPEG)")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help="Optional JSON report path")
+    args = parser.parse_args()
+
+    image_path = args.image
+    if not image_path:
+        import tempfile
+        import cv2
+        image_path = os.path.join(tempfile.mkdtemp(), 'startup_test.jpg')
+        cv2.imwrite(image_path, np.random.randint(0, 256, (480, 640, 3), np.uint8))
+
+    report = measure_startup(str(pathlib.Path(args.model).resolve()), image_path, args.runs)
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+        print(f"✓ Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
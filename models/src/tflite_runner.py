@@ -0,0 +1,258 @@
+"""
+Batched TFLite Runner
+Shared TFLite plumbing for the inference scripts: image decoding, a single-interpreter classifier,
+and a batched runner. TensorFlow is not imported here: interpreters come from a standalone TFLite
+runtime (ai-edge-litert or tflite-runtime) when one is installed, and TensorFlow is only loaded
+as a fallback, so inference workers and CLI jobs start in a fraction of the time and memory. The batched runner amortizes per-invoke overhead for server-side scoring: it
+keeps one interpreter per batch size, resized and allocated exactly once. It splits any number of
+images into the largest batches it has, and pads the remainder up to the nearest cached size.
+(On-device the app still runs batch 1.)
+
+Usage:
+    # per-image cost at batch 1/4/16/64 for every exported variant
+    python src/tflite_runner.py --models assets/ ../gpu_pipeline/quantization_workbench/ --output batch_bench.json
+"""
+
+import argparse
+import importlib
+import json
+import pathlib
+import re
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+ASSETS_DIR = pathlib.Path(__file__).resolve().parent.parent / "assets"
+DEFAULT_BATCH_SIZES = (1, 4, 16, 64)
+MODEL_LABELS = {
+    'disease_detection': 'labels_disease.txt',
+    # distilled student for the confidence cascade, written by gpu_pipeline CropDiseaseModel.export_to_assets
+    'disease_detection_small': 'labels_disease_small.txt',
+    'grain_quality': 'labels_grain.txt',
+    # flow_from_directory indexes the class folders alphabetically, so the sigmoid is p('random')
+    'leaf_check': ['leaf', 'random'],
+}
+RUNTIME_MODULES = ('ai_edge_litert.interpreter', 'tflite_runtime.interpreter')
+
+
+@lru_cache(maxsize=None)
+def load_interpreter_class():
+    """(Interpreter class, runtime name): a standalone TFLite runtime if installed, else TensorFlow's."""
+    for module in RUNTIME_MODULES:
+        try:
+            return importlib.import_module(module).Interpreter, module.split('.')[0]
+        except ImportError:
+            continue
+    import tensorflow as tf  # seconds of startup and hundreds of MB; only when no runtime is installed
+    return tf.lite.Interpreter, 'tensorflow'
+
+
+def decode_rgb(data: bytes) -> np.ndarray:
+    """Encoded image bytes -> uint8 RGB at the original resolution."""
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def to_model_input(rgb: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """uint8 RGB -> float32 in [0, 1] at `size` (height, width), as in training."""
+    return cv2.resize(rgb, (size[1], size[0]), interpolation=cv2.INTER_LINEAR).astype(np.float32) / 255.0
+
+
+def decode_image(data: bytes, size: Tuple[int, int]) -> np.ndarray:
+    """Encoded image bytes -> float32 RGB in [0, 1] at `size` (height, width)."""
+    return to_model_input(decode_rgb(data), size)
+
+
+def normalize_name(name: str) -> str:
+    """'Potato___Early_blight' and 'Potato_Early_Blight' both become 'potato_early_blight'."""
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+def load_disease_info(path: pathlib.Path) -> Dict[str, Dict]:
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return {normalize_name(d['name']): d for d in json.load(f)['diseases']}
+
+
+def load_labels(assets_dir: pathlib.Path, model_name: str) -> List[str]:
+    labels = MODEL_LABELS[model_name]
+    if isinstance(labels, list):
+        return labels
+    with open(pathlib.Path(assets_dir) / labels) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def top_k_predictions(probs: np.ndarray, labels: Sequence[str], disease_info: Dict[str, Dict], k: int = 3) -> List[Dict]:
+    """The k most likely labels with confidences, each joined with its disease_info entry if there is one."""
+    predictions = []
+    for i in np.argsort(-probs)[:k]:
+        label = labels[i] if i < len(labels) else str(i)
+        prediction = {'label': label, 'confidence': float(probs[i])}
+        info = disease_info.get(normalize_name(label))
+        if info: prediction['info'] = info
+        predictions.append(prediction)
+    return predictions
+
+
+class TFLiteClassifier:
+    """One interpreter for one .tflite classifier. Not thread-safe: callers serialize predict_batch."""
+
+    def __init__(self, model_path: pathlib.Path, labels: List[str], num_threads: Optional[int] = None):
+        self.name = model_path.stem
+        self.labels = labels
+        interpreter_class, self.runtime = load_interpreter_class()
+        self.interpreter = interpreter_class(model_path=str(model_path), num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.image_size = tuple(int(d) for d in self.input_detail['shape'][1:3])
+        self.batch_size = 1
+        width = int(self.output_detail['shape'][-1])
+        if labels and width != len(labels) and not (width == 1 and len(labels) == 2):
+            raise ValueError(f"{model_path.name} outputs {width} classes but has {len(labels)} labels")
+
+    def resize(self, batch_size: int):
+        """Resize the input's batch dimension and re-allocate (a no-op at the current size)."""
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_detail['index'], [batch_size, *self.image_size, 3])
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch_size
+
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        """(N, H, W, 3) floats in [0, 1] -> (N, num_labels) probabilities, in a single invoke."""
+        self.resize(len(images))
+        x = images
+        if self.input_detail['dtype'] in (np.uint8, np.int8):
+            scale, zero_point = self.input_detail['quantization']
+            info = np.iinfo(self.input_detail['dtype'])
+            x = np.clip(np.round(x / scale + zero_point), info.min, info.max)
+        self.interpreter.set_tensor(self.input_detail['index'], x.astype(self.input_detail['dtype']))
+        self.interpreter.invoke()
+        y = self.interpreter.get_tensor(self.output_detail['index'])
+        if self.output_detail['dtype'] in (np.uint8, np.int8):
+            scale, zero_point = self.output_detail['quantization']
+            y = (y.astype(np.float32) - zero_point) * scale
+        if y.shape[-1] == 1:  # single sigmoid unit p(class 1) -> [p(class 0), p(class 1)]
+            y = np.concatenate([1 - y, y], axis=-1)
+        return y
+
+
+def power_of_two_sizes(max_batch_size: int) -> Tuple[int, ...]:
+    """1, 2, 4, ... up to and including max_batch_size."""
+    sizes = [1]
+    while sizes[-1] * 2 < max_batch_size:
+        sizes.append(sizes[-1] * 2)
+    return tuple(sorted(set(sizes + [max_batch_size])))
+
+
+class BatchedTFLiteRunner:
+    """
+    One TFLiteClassifier per batch size in `batch_sizes`, each allocated once on first use.
+    Same interface as TFLiteClassifier (name, labels, image_size, predict_batch), so it can stand in
+    for one anywhere. Not thread-safe.
+    """
+
+    def __init__(self, model_path: pathlib.Path, labels: Sequence[str] = (),
+                 batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES, num_threads: Optional[int] = None):
+        self.model_path = pathlib.Path(model_path)
+        self.name = self.model_path.stem
+        self.labels = list(labels)
+        self.batch_sizes = sorted(set(batch_sizes))
+        self.num_threads = num_threads
+        self._interpreters: Dict[int, TFLiteClassifier] = {}
+        self.image_size = self.interpreter_for(self.batch_sizes[0]).image_size
+
+    def interpreter_for(self, batch_size: int) -> TFLiteClassifier:
+        if batch_size not in self._interpreters:
+            interpreter = TFLiteClassifier(self.model_path, self.labels, self.num_threads)
+            interpreter.resize(batch_size)
+            self._interpreters[batch_size] = interpreter
+        return self._interpreters[batch_size]
+
+    def bucket(self, n: int) -> int:
+        """Smallest cached batch size that holds n images (the largest if none does)."""
+        return next((size for size in self.batch_sizes if size >= n), self.batch_sizes[-1])
+
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        """Outputs for any number of (H, W, 3) images; partial batches are zero-padded and trimmed."""
+        outputs = []
+        for start in range(0, len(images), self.batch_sizes[-1]):
+            chunk = images[start:start + self.batch_sizes[-1]]
+            size = self.bucket(len(chunk))
+            if size > len(chunk):
+                chunk = np.concatenate([chunk, np.zeros((size - len(chunk), *chunk.shape[1:]), chunk.dtype)])
+            outputs.append(self.interpreter_for(size).predict_batch(chunk)[:len(images) - start])
+        return np.concatenate(outputs)
+
+
+def benchmark_batch_sizes(model_path: pathlib.Path, batch_sizes: Sequence[int] = DEFAULT_BATCH_SIZES,
+                          num_threads: Optional[int] = None, runs: int = 10) -> Dict[str, Dict]:
+    """Median per-invoke and per-image latency (ms) at each batch size."""
+    runner = BatchedTFLiteRunner(model_path, batch_sizes=batch_sizes, num_threads=num_threads)
+    results = {}
+    for size in runner.batch_sizes:
+        images = np.random.rand(size, *runner.image_size, 3).astype(np.float32)
+        interpreter = runner.interpreter_for(size)
+        interpreter.predict_batch(images)  # warm up
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            interpreter.predict_batch(images)
+            timings.append((time.perf_counter() - start) * 1000)
+        invoke_ms = float(np.median(timings))
+        results[str(size)] = {'invoke_ms': invoke_ms, 'per_image_ms': invoke_ms / size,
+                              'images_per_sec': size * 1000 / invoke_ms}
+    return results
+
+
+def find_models(paths: Sequence[str]) -> List[pathlib.Path]:
+    """.tflite files given directly or found in the given directories."""
+    models = []
+    for path in map(pathlib.Path, paths):
+        models += sorted(path.glob('*.tflite')) if path.is_dir() else [path]
+    return models
+
+
+def print_benchmark(report: Dict[str, Dict[str, Dict]]):
+    sizes = list(next(iter(report.values())).keys())
+    print("\n" + "=" * (36 + 11 * len(sizes)))
+    print("PER-IMAGE LATENCY (ms) BY BATCH SIZE")
+    print("=" * (36 + 11 * len(sizes)))
+    print(f"{'model':<36}" + "".join(f"{f'b{s}':>11}" for s in sizes))
+    for name, results in report.items():
+        print(f"{name:<36}" + "".join(f"{results[s]['per_image_ms']:>11.2f}" for s in sizes))
+    for name, results in report.items():
+        speedup = results[sizes[0]]['per_image_ms'] / results[sizes[-1]]['per_image_ms']
+        print(f"{name}: per-image speedup at batch {sizes[-1]} vs batch {sizes[0]}: x{speedup:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-image TFLite cost at several batch sizes")
+    parser.add_argument('--models', nargs='+', required=True, help=".tflite files or directories of them")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument('--threads', type=int, help="Interpreter threads (default: TFLite's choice)")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help="Optional JSON report path")
+    args = parser.parse_args()
+
+    report = {}
+    for model_path in find_models(args.models):
+        print(f"Benchmarking {model_path}...")
+        report[model_path.name] = benchmark_batch_sizes(model_path, args.batch_sizes, args.threads, args.runs)
+    if not report:
+        print("No .tflite models found")
+        return
+    print_benchmark(report)
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+        print(f"✓ Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""
+Tiled High-Resolution Inference
+The models see one 224x224 resize of the whole photo, so on a large field photo full of leaves small
+lesions are squashed away. Tiled mode cuts the image into overlapping square tiles (side = --scale x
+the shorter image side), drops the tiles the leaf-check model rejects, and runs the remaining tiles
+through the disease model as one batch. Tile results are merged into one verdict per image:
+  - the top-k of the mean probabilities over the diseased tiles, so a few lesion tiles are not
+    outvoted by many healthy ones, or over all leaf tiles when none is diseased;
+  - the share of leaf tiles that are diseased;
+  - a coarse lesion heatmap (max p(disease) of the leaf tiles covering each cell).
+
+p(disease) sums the disease classes only: healthy classes and the dataset-folder classes the disease
+model also learned (color, segmented, Rice_train, ...; see NON_DISEASE_LABELS) are not lesions.
+
+The inference service exposes it as POST /predict/tiled?scale=0.5 (tiles micro-batched like every
+other request).
+
+Usage:
+    python src/tiled_inference.py run --input field.jpg --scale 0.5 --heatmap field_heatmap.jpg
+    python src/tiled_inference.py bench --input field.jpg --scales 1 0.5 0.33 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import pathlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from cascade import DISEASE, LEAF_CHECK, SharedImage
+from tflite_runner import (ASSETS_DIR, BatchedTFLiteRunner, load_disease_info, load_labels, normalize_name,
+                           power_of_two_sizes, to_model_input, top_k_predictions)
+
+TILED = 'tiled'
+HEATMAP_CELLS = 16  # heatmap cells along the longer image side
+
+Box = Tuple[int, int, int, int]  # y0, x0, y1, x1
+
+# Classes of labels_disease.txt that are dataset folders (image variants, splits, unlabelled dumps), not diseases;
+# compared after normalize_name
+NON_DISEASE_LABELS = frozenset({
+    'color', 'grayscale', 'segmented', 'plantvillage_dataset', 'labelledrice', 'rice_labelled', 'ricediseasedataset',
+    'rice_train', 'rice_validation', 'cgiar_wheat_train', 'cgiar_wheat_test',
+})
+
+
+def is_disease_label(label: str) -> bool:
+    """True for disease classes; False for healthy classes and NON_DISEASE_LABELS."""
+    name = normalize_name(label)
+    return name not in NON_DISEASE_LABELS and 'healthy' not in name
+
+
+def tile_boxes(height: int, width: int, tile_px: int, overlap: float = 0.25) -> List[Box]:
+    """Square tiles of `tile_px` overlapping by `overlap`, covering the image; the last row/column is flush with the edge."""
+    tile_px = max(1, min(tile_px, height, width))
+    stride = max(1, int(tile_px * (1 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        return sorted(set(range(0, length - tile_px, stride)) | {length - tile_px})
+    return [(y, x, y + tile_px, x + tile_px) for y in starts(height) for x in starts(width)]
+
+
+class TiledInference:
+    """
+    disease_model: run on every leaf tile, in one batch.
+    leaf_model: optional leaf check run on every tile first; tiles with p(leaf) < leaf_threshold are skipped.
+    scale: tile side as a fraction of the shorter image side (1.0 = one square tile per image height).
+    lesion_threshold: p(disease) above which a tile whose top label is a disease counts as diseased.
+    disease_labels: the disease model's labels that are diseases (default: every label passing is_disease_label).
+    """
+
+    def __init__(self, disease_model: BatchedTFLiteRunner, leaf_model: Optional[BatchedTFLiteRunner] = None,
+                 scale: float = 0.5, overlap: float = 0.25, leaf_threshold: float = 0.5, lesion_threshold: float = 0.5,
+                 disease_info: Optional[Dict[str, Dict]] = None, top_k: int = 3,
+                 disease_labels: Optional[Sequence[str]] = None):
+        self.disease_model, self.leaf_model = disease_model, leaf_model
+        self.leaf_index = leaf_model.labels.index('leaf') if leaf_model else None
+        self.scale, self.overlap = scale, overlap
+        self.leaf_threshold, self.lesion_threshold = leaf_threshold, lesion_threshold
+        self.disease_info = disease_info or {}
+        self.top_k = top_k
+        if disease_labels is None:
+            self.disease = np.array([is_disease_label(label) for label in disease_model.labels])
+        else:
+            unknown = set(disease_labels) - set(disease_model.labels)
+            if unknown: raise ValueError(f"Disease labels not in the disease model: {sorted(unknown)}")
+            self.disease = np.isin(disease_model.labels, list(disease_labels))
+
+    @classmethod
+    def from_assets(cls, assets_dir: pathlib.Path = ASSETS_DIR, max_batch_size: int = 64,
+                    num_threads: Optional[int] = None, **kwargs) -> 'TiledInference':
+        assets_dir = pathlib.Path(assets_dir)
+        sizes = power_of_two_sizes(max_batch_size)
+        disease = BatchedTFLiteRunner(assets_dir / f"{DISEASE}.tflite", load_labels(assets_dir, DISEASE), sizes, num_threads)
+        leaf_path = assets_dir / f"{LEAF_CHECK}.tflite"
+        leaf = BatchedTFLiteRunner(leaf_path, load_labels(assets_dir, LEAF_CHECK), sizes, num_threads) if leaf_path.exists() else None
+        return cls(disease, leaf, disease_info=load_disease_info(assets_dir / "disease_info.json"), **kwargs)
+
+    def boxes(self, image: SharedImage, scale: Optional[float] = None) -> List[Box]:
+        scale = scale or self.scale
+        if not 0 < scale <= 1:
+            raise ValueError(f"Tile scale must be in (0, 1], got {scale}")
+        height, width = image.rgb.shape[:2]
+        return tile_boxes(height, width, round(scale * min(height, width)), self.overlap)
+
+    @staticmethod
+    def crops(image: SharedImage, boxes: Sequence[Box], size: Tuple[int, int]) -> np.ndarray:
+        return np.stack([to_model_input(image.rgb[y0:y1, x0:x1], size) for y0, x0, y1, x1 in boxes])
+
+    def merge(self, image: SharedImage, boxes: Sequence[Box], leaf_probs: Optional[np.ndarray],
+              disease_probs: np.ndarray, leaves: Sequence[int], top_k: Optional[int] = None) -> Dict:
+        """Per-image verdict, diseased-tile share and lesion heatmap from the per-tile outputs."""
+        height, width = image.rgb.shape[:2]
+        cell = max(height, width) / HEATMAP_CELLS
+        heatmap = np.zeros((math.ceil(height / cell), math.ceil(width / cell)), np.float32)
+        tiles = {'count': len(boxes), 'tile_px': boxes[0][2] - boxes[0][0], 'leaf': len(leaves), 'diseased': 0}
+        result = {'stopped_at': TILED, 'tiles': tiles}
+        if leaf_probs is not None:
+            result['leaf_probabilities'] = [round(float(p[self.leaf_index]), 3) for p in leaf_probs]
+        if not leaves:
+            result.update(stopped_at=LEAF_CHECK, predictions=[], heatmap=heatmap.tolist(),
+                          reason="No tile looks like a leaf; retake the photo closer to the plants")
+            return result
+
+        lesion = disease_probs[:, self.disease].sum(axis=1)
+        diseased = self.disease[disease_probs.argmax(axis=1)] & (lesion >= self.lesion_threshold)
+        for (y0, x0, y1, x1), score in zip((boxes[i] for i in leaves), lesion):
+            region = heatmap[int(y0 / cell):math.ceil(y1 / cell), int(x0 / cell):math.ceil(x1 / cell)]
+            np.maximum(region, score, out=region)
+        merged = disease_probs[diseased].mean(axis=0) if diseased.any() else disease_probs.mean(axis=0)
+        tiles['diseased'] = int(diseased.sum())
+        result.update(predictions=top_k_predictions(merged, self.disease_model.labels, self.disease_info, top_k or self.top_k),
+                      affected_fraction=float(diseased.mean()), heatmap=np.round(heatmap.astype(float), 3).tolist(),
+                      tile_boxes=[list(boxes[i]) for i in leaves], tile_lesion=[round(float(s), 3) for s in lesion])
+        return result
+
+    def _leaves(self, leaf_probs: Optional[np.ndarray], count: int) -> List[int]:
+        if leaf_probs is None:
+            return list(range(count))
+        return [i for i, p in enumerate(leaf_probs) if p[self.leaf_index] >= self.leaf_threshold]
+
+    def run(self, image: SharedImage, scale: Optional[float] = None, top_k: Optional[int] = None) -> Dict:
+        """Leaf check on all tiles in one batch, then the disease model on the leaf tiles in one batch."""
+        boxes = self.boxes(image, scale)
+        leaf_probs = self.leaf_model.predict_batch(self.crops(image, boxes, self.leaf_model.image_size)) if self.leaf_model else None
+        leaves = self._leaves(leaf_probs, len(boxes))
+        disease_probs = (self.disease_model.predict_batch(self.crops(image, [boxes[i] for i in leaves], self.disease_model.image_size))
+                         if leaves else np.zeros((0, len(self.disease_model.labels)), np.float32))
+        return self.merge(image, boxes, leaf_probs, disease_probs, leaves, top_k)
+
+    async def run_async(self, image: SharedImage, submit: Callable[[str, np.ndarray], Awaitable[Tuple[np.ndarray, int]]],
+                        scale: Optional[float] = None, top_k: Optional[int] = None) -> Dict:
+        """Like run(), handing every tile to `submit(model_name, input)` at once so a micro-batcher batches them together."""
+        loop = asyncio.get_running_loop()
+        boxes = self.boxes(image, scale)
+        leaf_probs = None
+        if self.leaf_model:
+            crops = await loop.run_in_executor(None, self.crops, image, boxes, self.leaf_model.image_size)
+            leaf_probs = np.stack([p for p, _ in await asyncio.gather(*(submit(LEAF_CHECK, c) for c in crops))])
+        leaves = self._leaves(leaf_probs, len(boxes))
+        disease_probs = np.zeros((0, len(self.disease_model.labels)), np.float32)
+        if leaves:
+            crops = await loop.run_in_executor(None, self.crops, image, [boxes[i] for i in leaves], self.disease_model.image_size)
+            disease_probs = np.stack([p for p, _ in await asyncio.gather(*(submit(DISEASE, c) for c in crops))])
+        return self.merge(image, boxes, leaf_probs, disease_probs, leaves, top_k)
+
+
+def render_heatmap(image: SharedImage, heatmap: Sequence[Sequence[float]], path: str, alpha: float = 0.45):
+    """Save the photo with the lesion heatmap blended over it (red = likely lesion)."""
+    height, width = image.rgb.shape[:2]
+    heat = cv2.resize(np.asarray(heatmap, np.float32), (width, height), interpolation=cv2.INTER_NEAREST)
+    colors = cv2.applyColorMap((heat * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    cv2.imwrite(path, cv2.addWeighted(cv2.cvtColor(image.rgb, cv2.COLOR_RGB2BGR), 1 - alpha, colors, alpha, 0))
+
+
+def benchmark_scales(engine: TiledInference, image: SharedImage, scales: Sequence[float], runs: int = 5) -> List[Dict]:
+    """Median wall time per image (tiling, leaf check and disease model) at each tile scale, vs. one whole-image resize."""
+    models = [m for m in (engine.leaf_model, engine.disease_model) if m]
+
+    def whole_image():
+        return [m.predict_batch(to_model_input(image.rgb, m.image_size)[None]) for m in models]
+    whole_image()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        whole_image()
+        timings.append(time.perf_counter() - start)
+    rows = [{'scale': None, 'tiles': 1, 'leaf_tiles': 1, 'ms_per_image': float(np.median(timings)) * 1000}]
+    for scale in scales:
+        engine.run(image, scale)  # warm up this batch size
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = engine.run(image, scale)
+            timings.append(time.perf_counter() - start)
+        rows.append({'scale': scale, 'tiles': result['tiles']['count'], 'leaf_tiles': result['tiles']['leaf'],
+                     'ms_per_image': float(np.median(timings)) * 1000})
+    for row in rows:
+        row['ms_per_tile'] = row['ms_per_image'] / row['tiles']
+        row['tiles_per_sec'] = row['tiles'] * 1000 / row['ms_per_image']
+        label = 'whole image' if row['scale'] is None else f"scale {row['scale']:g}"
+        print(f"{label:<14}{row['tiles']:>6} tiles ({row['leaf_tiles']:>3} leaf){row['ms_per_image']:>10.1f} ms/img"
+              f"{row['ms_per_tile']:>9.2f} ms/tile{row['tiles_per_sec']:>9.1f} tiles/s")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiled disease inference for high-resolution field photos")
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('run', "Tile one image and print the merged verdict"), ('bench', "Throughput at several tile scales")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument('--input', required=True, help="Image path")
+        p.add_argument('--assets', default=str(ASSETS_DIR))
+        p.add_argument('--overlap', type=float, default=0.25)
+        p.add_argument('--leaf-threshold', type=float, default=0.5)
+        p.add_argument('--max-batch-size', type=int, default=64)
+        p.add_argument('--output', help="Optional JSON output path")
+    sub.choices['run'].add_argument('--scale', type=float, default=0.5, help="Tile side / shorter image side")
+    sub.choices['run'].add_argument('--heatmap', help="Save the photo with the lesion heatmap overlaid")
+    sub.choices['bench'].add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5, 0.33, 0.25])
+    sub.choices['bench'].add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = TiledInference.from_assets(pathlib.Path(args.assets), args.max_batch_size, overlap=args.overlap,
+                                        leaf_threshold=args.leaf_threshold)
+    image = SharedImage(pathlib.Path(args.input).read_bytes())
+    if args.command == 'run':
+        report = engine.run(image, args.scale)
+        tiles = report['tiles']
+        print(f"{tiles['count']} tiles of {tiles['tile_px']}px, {tiles['leaf']} leaf, {tiles['diseased']} diseased")
+        for p in report['predictions']:
+            print(f"  {p['label']:<45}{p['confidence']:.3f}")
+        if args.heatmap:
+            render_heatmap(image, report['heatmap'], args.heatmap)
+            print(f"✓ Heatmap saved to: {args.heatmap}")
+    else:
+        report = {'image': args.input, 'size': list(image.rgb.shape[:2]), 'results': benchmark_scales(engine, image, args.scales, args.runs)}
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+        print(f"✓ Report saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
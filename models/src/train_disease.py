@@ -6,14 +6,19 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, EarlyStopping
 import os
+import sys
 import pathlib
 import numpy as np
 
+sys.path.append(str(pathlib.Path(__file__).parent.parent / "gpu_pipeline"))
+from quantization import fine_tune_qat, convert_qat_to_tflite
+
 # Config (SPEED RUN)
 IMG_SIZE = 224
 BATCH_SIZE = 64
 EPOCHS = 1       # Final pass for 1 AM deadline
 LEARNING_RATE = 1e-3 # Increased LR for faster convergence
+QAT_EPOCHS = 0   # > 0: quantization-aware fine-tuning before the full-int8 export
 
 def train_model():
     current_file = pathlib.Path(__file__)
@@ -127,13 +132,6 @@ def train_model():
     # base_model.trainable = True
     # ... code commented out ...
 
-    # Convert to TFLite
-    print("Converting to TFLite...")
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    
-    # Optimization (Quantization)
-    converter.optimizations = [tf.lite.Optimize.DEFAULT]
-    
     # Representative Dataset for INT8 Quantization (Crucial for Mobile Accuracy/Speed)
     def representative_dataset_gen():
         for _ in range(100):
@@ -141,6 +139,20 @@ def train_model():
             # Yield the first image of the batch
             yield [img[0].reshape(1, IMG_SIZE, IMG_SIZE, 3).astype(np.float32)]
 
+    tflite_path = assets_dir / "disease_detection.tflite"
+    if QAT_EPOCHS > 0:
+        qat_model = fine_tune_qat(model, train_generator, validation_generator, epochs=QAT_EPOCHS,
+                                  loss='categorical_crossentropy', steps_per_epoch=hackathon_steps)
+        convert_qat_to_tflite(qat_model, representative_dataset_gen, str(tflite_path))
+        return
+
+    # Convert to TFLite
+    print("Converting to TFLite...")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    
+    # Optimization (Quantization)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
     converter.representative_dataset = representative_dataset_gen
     converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
     converter.inference_input_type = tf.float32 # Keep input float for easy app integration (normalization happens in app)
@@ -148,7 +160,6 @@ def train_model():
     
     tflite_model = converter.convert()
 
-    tflite_path = assets_dir / "disease_detection.tflite"
     with open(tflite_path, 'wb') as f:
         f.write(tflite_model)
         
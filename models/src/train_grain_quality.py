@@ -1,5 +1,6 @@
 import tensorflow as tf
 import os
+import sys
 import numpy as np
 import pathlib
 
@@ -8,12 +9,16 @@ IMG_SIZE = 224
 BATCH_SIZE = 32
 EPOCHS = 10 # Slightly reduced for faster 1 AM delivery
 LEARNING_RATE = 0.0001
+QAT_EPOCHS = 0 # > 0: quantization-aware fine-tuning before the full-int8 export
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Target the specific Rice dataset extracted
 DATA_DIR = os.path.join(BASE_DIR, "datasets", "grain_quality", "rice_varieties_Rice_Image_Dataset")
 MODEL_SAVE_PATH = os.path.join(BASE_DIR, "assets", "grain_quality.tflite")
 LABELS_SAVE_PATH = os.path.join(BASE_DIR, "assets", "labels_grain.txt")
 
+sys.path.append(os.path.join(BASE_DIR, "gpu_pipeline"))
+from quantization import fine_tune_qat, convert_qat_to_tflite
+
 print(f"--- Training Grain Quality Model ---")
 print(f"Data Directory: {DATA_DIR}")
 
@@ -95,16 +100,21 @@ model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=1e-5),
               metrics=['accuracy'])
 model.fit(train_ds, validation_data=val_ds, epochs=3)
 
-# 6. TFLite Conversion
-print("Converting to TFLite...")
-converter = tf.lite.TFLiteConverter.from_keras_model(model)
-converter.optimizations = [tf.lite.Optimize.DEFAULT]
-
 # Representative Dataset for Quantization
 def representative_dataset_gen():
     for img, _ in train_ds.take(100):
         yield [img[0:1]]
 
+if QAT_EPOCHS > 0:
+    qat_model = fine_tune_qat(model, train_ds, val_ds, epochs=QAT_EPOCHS)
+    convert_qat_to_tflite(qat_model, representative_dataset_gen, MODEL_SAVE_PATH, int8_io=True)
+    exit(0)
+
+# 6. TFLite Conversion
+print("Converting to TFLite...")
+converter = tf.lite.TFLiteConverter.from_keras_model(model)
+converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
 converter.representative_dataset = representative_dataset_gen
 converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
 converter.inference_input_type = tf.int8
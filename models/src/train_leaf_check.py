@@ -6,14 +6,19 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
 import os
+import sys
 import pathlib
 import numpy as np
 
+sys.path.append(str(pathlib.Path(__file__).parent.parent / "gpu_pipeline"))
+from quantization import fine_tune_qat, convert_qat_to_tflite
+
 # Config
 IMG_SIZE = 224
 BATCH_SIZE = 32
 EPOCHS = 10 
 LEARNING_RATE = 1e-4
+QAT_EPOCHS = 0 # > 0: quantization-aware fine-tuning before the full-int8 export
 
 def train_leaf_check():
     current_file = pathlib.Path(__file__)
@@ -85,17 +90,24 @@ def train_leaf_check():
         ]
     )
 
-    # Convert to TFLite
-    print("Converting to TFLite...")
-    converter = tf.lite.TFLiteConverter.from_keras_model(model)
-    converter.optimizations = [tf.lite.Optimize.DEFAULT]
-    
     # Representative Dataset
     def representative_dataset_gen():
         for _ in range(50):
             img, _ = next(train_generator)
             yield [img[0].reshape(1, IMG_SIZE, IMG_SIZE, 3).astype(np.float32)]
 
+    tflite_path = assets_dir / "leaf_check.tflite"
+    if QAT_EPOCHS > 0:
+        qat_model = fine_tune_qat(model, train_generator, validation_generator, epochs=QAT_EPOCHS,
+                                  loss='binary_crossentropy', steps_per_epoch=train_generator.samples // BATCH_SIZE)
+        convert_qat_to_tflite(qat_model, representative_dataset_gen, str(tflite_path))
+        return
+
+    # Convert to TFLite
+    print("Converting to TFLite...")
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
     converter.representative_dataset = representative_dataset_gen
     converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
     converter.inference_input_type = tf.float32
@@ -103,7 +115,6 @@ def train_leaf_check():
     
     tflite_model = converter.convert()
 
-    tflite_path = assets_dir / "leaf_check.tflite"
     with open(tflite_path, 'wb') as f:
         f.write(tflite_model)
         
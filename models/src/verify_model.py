@@ -1,4 +1,3 @@
-import tensorflow as tf
 import numpy as np
 import cv2
 import os
@@ -6,6 +5,8 @@ import pathlib
 import random
 import json
 
+from tflite_runner import load_interpreter_class
+
 def verify_tflite_model(model_name="disease_detection.tflite"):
     current_file = pathlib.Path(__file__)
     project_root = current_file.parent.parent # models/
@@ -17,7 +18,9 @@ def verify_tflite_model(model_name="disease_detection.tflite"):
         return
 
     # Load TFLite Model
-    interpreter = tf.lite.Interpreter(model_path=str(model_path))
+    # Standalone TFLite runtime when installed; TensorFlow is only imported as a fallback
+    interpreter_class, _ = load_interpreter_class()
+    interpreter = interpreter_class(model_path=str(model_path))
     interpreter.allocate_tensors()
 
     input_details = interpreter.get_input_details()
@@ -32,8 +35,8 @@ def verify_tflite_model(model_name="disease_detection.tflite"):
         labels_path = assets_dir / "labels_disease.txt"
         img_root = project_root / "datasets" / "raw"
     else:
-        # leaf check has explicit binary classes
-        labels = ["random", "leaf"] 
+        # leaf check has explicit binary classes, indexed alphabetically by flow_from_directory
+        labels = ["leaf", "random"]
         img_root = project_root / "datasets" / "leaf_check"
 
     if not labels and labels_path.exists():
@@ -1,4 +1,3 @@
-import tensorflow as tf
 import numpy as np
 import time
 import os
@@ -6,6 +5,9 @@ import glob
 import random
 from pathlib import Path
 
+from interpreter_pool import InterpreterPool
+from tflite_runner import decode_image, load_interpreter_class
+
 # Config
 IMG_SIZE = 224
 ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "assets")
@@ -27,8 +29,10 @@ def run_benchmark():
     print(f"Labels loaded: {len(labels)} classes")
 
     # 2. Load Model
-    interpreter = tf.lite.Interpreter(model_path=MODEL_PATH)
+    interpreter_class, runtime = load_interpreter_class()
+    interpreter = interpreter_class(model_path=MODEL_PATH)
     interpreter.allocate_tensors()
+    print(f"Runtime: {runtime}")
 
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
@@ -59,11 +63,9 @@ def run_benchmark():
         img_name = os.path.basename(img_path)
         parent_folder = os.path.basename(os.path.dirname(img_path))
         
-        img = tf.io.read_file(img_path)
-        img = tf.image.decode_image(img, channels=3, expand_animations=False)
-        img = tf.image.resize(img, (IMG_SIZE, IMG_SIZE))
-        img = img / 255.0 # Normalize [0,1]
-        img = tf.expand_dims(img, 0) # Batch dim
+        with open(img_path, 'rb') as f:
+            img = decode_image(f.read(), (IMG_SIZE, IMG_SIZE)) # Resize + normalize [0,1]
+        img = np.expand_dims(img, 0) # Batch dim
 
         # Set input
         interpreter.set_tensor(input_details[0]['index'], img)
@@ -95,5 +97,14 @@ def run_benchmark():
     print(f"Efficiency Rating: {'EXCELLENT' if avg_time < 100 else 'GOOD'}")
     print("="*40)
 
+    # 6. Aggregate throughput with one interpreter per core
+    pool_size = os.cpu_count() or 1
+    with InterpreterPool(MODEL_PATH, pool_size, threads_per_interpreter=1) as pool:
+        pool.predict_files(test_images)  # warm up
+        start = time.time()
+        pool.predict_files(test_images)
+        pool_time = time.time() - start
+    print(f"Interpreter Pool ({pool_size} x 1 thread): {len(test_images) / pool_time:.1f} img/s end-to-end (decode + invoke)")
+
 if __name__ == "__main__":
     run_benchmark()